@@ -21,6 +21,10 @@ from . import distribution
 from . import rebuilding
 from . import space_allocation
 from . import stats
+from . import sparse_graph
+from . import accessibility
+from . import od_matrix
+from . import contraction_hierarchy
 from . import street_graph_node
 from . import street_graph_edge
 
@@ -36,6 +40,7 @@ def get_street_graph(
         osm_filter=OSM_FILTER,
         perimeter_crs=None,
         elevation_file=None,
+        elevation_spacing=None,
         export_raw_streetgraph=None,
 ):
     """
@@ -57,6 +62,11 @@ def get_street_graph(
     osm_filter : list
     perimeter_crs : int
         crs of the provided perimeter, if None, than the main crs will be used
+    elevation_file : str
+        path to an elevation raster, if given, elevations and grades are added
+    elevation_spacing : float
+        if given, the grades are calculated from elevations sampled at this spacing along the edges,
+        see add_elevation()
 
     Returns
     -------
@@ -147,7 +157,9 @@ def get_street_graph(
         merge_edges.merge_parallel_edges(G)
 
         print('Update precalculated attributes')
-        street_graph.update_precalculated_attributes(G)
+        # the simplification steps keep the street counts up to date, they are recounted only once
+        # to replace the counts from the OSM download, which include the streets outside the perimeter
+        street_graph.update_precalculated_attributes(G, recount=(i == 0))
 
     print('Simplify edge geometries (2/2)')
     simplification.simplify_edge_geometries(G, 35)
@@ -163,20 +175,41 @@ def get_street_graph(
     space_allocation.update_osm_tags(G)
 
     print('Update street counts per node')
-    spn = oxc.stats.count_streets_per_node(G, nodes=G.nodes)
-    nx.set_node_attributes(G, values=spn, name="street_count")
+    street_graph.update_precalculated_attributes(G, recount=(simplification_iterations == 0))
 
     if elevation_file:
         print('Add elevation')
-        G = add_elevation(G, elevation_file)
+        G = add_elevation(G, elevation_file, spacing=elevation_spacing)
 
     return G
 
 
-def add_elevation(G, raster, cpus=1):
+def add_elevation(G, raster, cpus=1, spacing=None):
+    """
+    Adds node elevations and edge grades from an elevation raster
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        street graph
+    raster : str
+        path to the elevation raster
+    cpus : int
+    spacing : float
+        if None, the grades are calculated from the elevations of the end nodes,
+        otherwise from elevations sampled at this spacing along the edge geometries,
+        which also adds the steepest and the mean uphill grade in both directions
+
+    Returns
+    -------
+    G : nx.MultiDiGraph
+    """
     print('Add elevation')
     G = oxc.elevation.add_node_elevations_raster(G, raster, cpus=1)
-    G = oxc.elevation.add_edge_grades(G, add_absolute=False)
+    if spacing is None:
+        G = oxc.elevation.add_edge_grades(G, add_absolute=False)
+    else:
+        G = oxc.elevation.add_edge_grades_raster(G, raster, spacing=spacing)
     return G
 
 
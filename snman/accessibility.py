@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely as shp
+from . import osmnx_customized as oxc
+from . import lane_graph, sparse_graph, _errors
+from .constants import *
+
+
+ACCESSIBILITY_MODES = (MODE_CYCLING, MODE_PRIVATE_CARS, MODE_TRANSIT)
+ACCESSIBILITY_LANES_KEYS = {'before': KEY_LANES_DESCRIPTION, 'after': KEY_LANES_DESCRIPTION_AFTER}
+
+
+def snap_pois_to_nodes(L, pois, mode=None, max_distance=None):
+    """
+    Snap each POI to the nearest node of the lane graph, using the spatial index cached in the lane graph
+
+    Parameters
+    ----------
+    L : nx.MultiDiGraph
+        lane graph
+    pois : gpd.GeoDataFrame or gpd.GeoSeries
+        points of interest, e.g. from io.load_poi(), in the same crs as the lane graph
+    mode : str
+        consider only nodes with at least one edge that is accessible to this mode
+    max_distance : float
+        POIs farther away from any node will not be snapped
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per POI with the columns node and distance, node is None for POIs that could not be snapped
+    """
+
+    geometries = pois.geometry if isinstance(pois, gpd.GeoDataFrame) else pois
+    result = pd.DataFrame(
+        {
+            'node': pd.Series([None] * len(geometries), dtype=object, index=geometries.index),
+            'distance': np.nan,
+        },
+        index=geometries.index
+    )
+
+    if len(L) == 0 or len(geometries) == 0:
+        return result
+
+    # the index is cached in the lane graph and reused by later calls
+    index = oxc.distance.spatial_index(L)
+    mask = None
+    if mode is not None:
+        nodes = set()
+        for u, v, data in L.edges(data=True):
+            if data.get('cost_' + mode, np.inf) < np.inf:
+                nodes.add(u)
+                nodes.add(v)
+        mask = np.array([node in nodes for node in index.node_ids], dtype=bool)
+
+    points = np.asarray(geometries, dtype=object)
+    node_idx, distances = index.query_nodes(
+        shp.get_x(points), shp.get_y(points), mask=mask, max_distance=max_distance
+    )
+    poi_idx = np.flatnonzero(node_idx >= 0)
+
+    result.iloc[poi_idx, result.columns.get_loc('node')] = index.node_ids[node_idx[poi_idx]]
+    result.iloc[poi_idx, result.columns.get_loc('distance')] = distances[poi_idx]
+    return result
+
+
+def costs_to_nearest_pois(L, poi_nodes, mode, k=1, max_cost=np.inf, chunk_size=100, S=None):
+    """
+    Travel cost from each node of the lane graph to its k nearest POIs, using multi-source Dijkstra
+    against the edge directions; for k=1, all POIs are searched from at once
+
+    Parameters
+    ----------
+    L : nx.MultiDiGraph
+        lane graph
+    poi_nodes : list
+        the node of each POI, see snap_pois_to_nodes(), POIs without a node (None) are ignored,
+        several POIs on the same node count separately
+    mode : str
+        the cost attribute 'cost_' + mode is used
+    k : int
+        number of nearest POIs
+    max_cost : float
+        do not search beyond this cost, nodes further away from the POIs get np.inf
+    chunk_size : int
+        for k > 1, number of POI nodes searched from at once, to limit the memory
+    S : sparse_graph.SparseGraph
+        compiled lane graph, to reuse it across calls
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per node of the lane graph, with the costs to the nearest POI (column 1) to the k-th nearest POI
+        (column k), and for k=1 the node of the nearest POI (column nearest_poi_node)
+    """
+
+    if S is None:
+        S = sparse_graph.SparseGraph(L, weights=('cost_' + mode,))
+
+    if k < 1:
+        raise _errors.OptionNotImplemented('k=' + str(k) + ' is not valid')
+
+    # several POIs on the same node are searched from only once
+    poi_nodes = pd.Series(list(poi_nodes), dtype=object)
+    poi_nodes = poi_nodes[poi_nodes.notna() & poi_nodes.isin(S.node_index.keys())]
+    counts = poi_nodes.value_counts(sort=False)
+    sources = list(counts.index)
+
+    costs = np.full((len(S.nodes), k), np.inf)
+    nearest_poi_node = np.empty(len(S.nodes), dtype=object)
+
+    if len(sources) > 0 and k == 1:
+        costs[:, 0], predecessors, nearest = S.distances(
+            'cost_' + mode, sources=sources, return_predecessors=True,
+            limit=max_cost, min_only=True, reverse=True
+        )
+        nearest_poi_node[:] = S.node_ids(nearest)
+
+    elif len(sources) > 0:
+        repeats = np.minimum(counts.to_numpy(), k)
+        for start in range(0, len(sources), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            distances = S.distances('cost_' + mode, sources=sources[chunk], limit=max_cost, reverse=True)
+            # keep the k lowest costs for each node, the current ones and those of this chunk
+            candidates = np.vstack([costs.T, np.repeat(distances, repeats[chunk], axis=0)])
+            if len(candidates) > k:
+                candidates = np.partition(candidates, k - 1, axis=0)[:k]
+            costs = np.sort(candidates, axis=0).T
+
+    result = pd.DataFrame(costs, index=pd.Index(S.nodes, name='node'), columns=range(1, k + 1))
+    if k == 1:
+        result['nearest_poi_node'] = nearest_poi_node
+    return result
+
+
+def isochrones(L, node_costs, thresholds, buffer=25):
+    """
+    Creates isochrone polygons: the area around all lane edges whose both ends can be reached within a threshold
+
+    Parameters
+    ----------
+    L : nx.MultiDiGraph
+        lane graph
+    node_costs : pd.Series
+        travel cost for each node, e.g. a column of costs_to_nearest_pois()
+    thresholds : list
+        cost thresholds, one isochrone for each
+    buffer : float
+        how far around the reached edges the isochrones extend, in meters
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        one row per threshold
+    """
+
+    edges = [
+        (u, v, data['geometry'])
+        for u, v, data in L.edges(data=True)
+        if data.get('geometry') is not None
+    ]
+    costs_u = node_costs.reindex([edge[0] for edge in edges]).to_numpy(dtype=float)
+    costs_v = node_costs.reindex([edge[1] for edge in edges]).to_numpy(dtype=float)
+    edge_costs = np.fmax(costs_u, costs_v)
+
+    geometries = np.empty(len(edges), dtype=object)
+    geometries[:] = [edge[2] for edge in edges]
+    # parallel lanes share the same geometry, buffer each one only once
+    unique_geometries, inverse = np.unique(shp.to_wkb(geometries), return_inverse=True)
+    buffered = shp.buffer(shp.from_wkb(unique_geometries), buffer)
+    unique_costs = np.full(len(unique_geometries), np.inf)
+    np.minimum.at(unique_costs, inverse, np.nan_to_num(edge_costs, nan=np.inf))
+
+    return gpd.GeoDataFrame(
+        {
+            'threshold': list(thresholds),
+            'geometry': [
+                shp.union_all(buffered[unique_costs <= threshold])
+                for threshold in thresholds
+            ],
+        },
+        crs=L.graph.get('crs')
+    )
+
+
+def accessibility(
+        G, pois,
+        modes=ACCESSIBILITY_MODES, lanes_keys=None,
+        k=1, max_cost=np.inf, max_distance=None,
+        thresholds=()
+):
+    """
+    Travel costs from each node to the nearest POIs for several modes, before and after rebuilding
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        street graph
+    pois : gpd.GeoDataFrame
+        points of interest, e.g. from io.load_poi(), in the same crs as the street graph
+    modes : tuple
+        the costs 'cost_' + mode of the lane graph are used
+    lanes_keys : dict
+        label -> lane description key, by default
+        {'before': KEY_LANES_DESCRIPTION, 'after': KEY_LANES_DESCRIPTION_AFTER}
+    k : int
+        the cost to the k-th nearest POI is returned, see costs_to_nearest_pois()
+    max_cost : float
+        do not search beyond this cost
+    max_distance : float
+        maximal distance for snapping the POIs to the lane graph nodes
+    thresholds : list
+        cost thresholds for isochrones
+
+    Returns
+    -------
+    tuple
+        a pd.DataFrame with the costs per node and a column for each mode and label, e.g. 'cost_cycling_before',
+        and a gpd.GeoDataFrame with the isochrones for each mode, label and threshold
+    """
+
+    if lanes_keys is None:
+        lanes_keys = ACCESSIBILITY_LANES_KEYS
+
+    costs = {}
+    all_isochrones = []
+    for label, lanes_key in lanes_keys.items():
+        L = lane_graph.create_lane_graph(G, lanes_key)
+        S = sparse_graph.SparseGraph(L, weights=tuple('cost_' + mode for mode in modes))
+        for mode in modes:
+            snapped = snap_pois_to_nodes(L, pois, mode=mode, max_distance=max_distance)
+            node_costs = costs_to_nearest_pois(L, snapped['node'], mode, k=k, max_cost=max_cost, S=S)[k]
+            costs['cost_' + mode + '_' + label] = node_costs
+            if len(thresholds) > 0:
+                mode_isochrones = isochrones(L, node_costs, thresholds)
+                mode_isochrones['mode'] = mode
+                mode_isochrones['label'] = label
+                all_isochrones.append(mode_isochrones)
+
+    costs = pd.DataFrame(costs)
+    if len(all_isochrones) > 0:
+        all_isochrones = gpd.GeoDataFrame(pd.concat(all_isochrones, ignore_index=True), crs=all_isochrones[0].crs)
+    else:
+        all_isochrones = gpd.GeoDataFrame({'threshold': [], 'mode': [], 'label': []}, geometry=[])
+    return costs, all_isochrones
@@ -0,0 +1,388 @@
+from hashlib import sha1
+from heapq import heappush, heappop
+import json
+import os
+import numpy as np
+
+
+class ContractionHierarchy:
+    """
+    A contraction hierarchy over a lane graph (or street graph) for one cost attribute,
+    for answering many point-to-point shortest path queries on a graph that does not change.
+
+    The nodes are contracted one by one, from the least to the most important, adding shortcut edges
+    wherever a shortest path passed through the contracted node. A query is a bidirectional Dijkstra
+    that only goes upwards in the hierarchy from both ends and settles only a few nodes.
+    Shortcuts remember the node they bypass, so that paths can be unpacked into the original edges.
+
+    Build it once with ContractionHierarchy(L, weight), save it next to the graph with save()
+    and restore it with ContractionHierarchy.load(), or use load_or_build_contraction_hierarchy().
+    """
+
+    def __init__(self, G=None, weight='length', witness_settle_limit=50):
+        """
+        Builds the contraction hierarchy
+
+        Parameters
+        ----------
+        G : nx.MultiDiGraph
+            lane graph or street graph, the graph must not change afterwards,
+            None creates an empty object (used by load())
+        weight : str
+            edge attribute used as cost, edges without it get a cost of 1, edges with infinite cost are left out
+        witness_settle_limit : int
+            how many nodes a witness search may settle before giving up and adding the shortcut anyway,
+            higher values lead to fewer shortcuts but slower preprocessing
+        """
+
+        self.weight = weight
+        if G is None:
+            return
+
+        self.nodes = list(G.nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        self.edges = list(G.edges(keys=True)) if G.is_multigraph() else list(G.edges)
+        self.fingerprint = graph_fingerprint(G, weight)
+
+        n = len(self.nodes)
+        # remaining graph during the contraction: {v: [cost, middle node or -1, position of the original edge]}
+        out_edges = [{} for i in range(n)]
+        in_edges = [{} for i in range(n)]
+        for position, (u, v, data) in enumerate(
+            (edge[0], edge[1], edge[-1]) for edge in
+            (G.edges(keys=True, data=True) if G.is_multigraph() else G.edges(data=True))
+        ):
+            cost = data.get(weight, 1)
+            u, v = self.node_index[u], self.node_index[v]
+            if u == v or not cost < np.inf:
+                continue
+            if v not in out_edges[u] or cost < out_edges[u][v][0]:
+                out_edges[u][v] = [cost, -1, position]
+                in_edges[v][u] = out_edges[u][v]
+
+        # all edges of the hierarchy (original edges and shortcuts), for unpacking the paths
+        self._edge_table = {}
+        for u in range(n):
+            for v, edge in out_edges[u].items():
+                self._edge_table[(u, v)] = tuple(edge)
+
+        self.rank = np.full(n, -1, dtype=np.int64)
+        contracted_neighbors = np.zeros(n, dtype=np.int64)
+
+        queue = []
+        for x in range(n):
+            heappush(queue, (self._priority(x, out_edges, in_edges, contracted_neighbors, witness_settle_limit), x))
+
+        # upward edges for the queries: forward from lower to higher rank, backward (reversed) likewise
+        up_out = [None] * n
+        up_in = [None] * n
+
+        rank = 0
+        while queue:
+            priority, x = heappop(queue)
+            if self.rank[x] >= 0:
+                continue
+            # lazy update: contract x only if it is still the least important node
+            priority = self._priority(x, out_edges, in_edges, contracted_neighbors, witness_settle_limit)
+            if queue and priority > queue[0][0]:
+                heappush(queue, (priority, x))
+                continue
+
+            shortcuts = self._shortcuts(x, out_edges, in_edges, witness_settle_limit)
+            self.rank[x] = rank
+            rank += 1
+
+            up_out[x] = [(v, edge[0]) for v, edge in out_edges[x].items()]
+            up_in[x] = [(u, edge[0]) for u, edge in in_edges[x].items()]
+
+            # remove x from the remaining graph
+            for v in out_edges[x]:
+                del in_edges[v][x]
+                contracted_neighbors[v] += 1
+            for u in in_edges[x]:
+                del out_edges[u][x]
+                contracted_neighbors[u] += 1
+            out_edges[x] = {}
+            in_edges[x] = {}
+
+            for u, v, cost in shortcuts:
+                if v not in out_edges[u] or cost < out_edges[u][v][0]:
+                    out_edges[u][v] = [cost, x, -1]
+                    in_edges[v][u] = out_edges[u][v]
+                    self._edge_table[(u, v)] = (cost, x, -1)
+
+        self._set_upward_graph(up_out, up_in)
+
+    def _set_upward_graph(self, up_out, up_in):
+        """
+        Stores the upward edges as adjacency lists
+        """
+
+        self._up_out = up_out
+        self._up_in = up_in
+
+    @staticmethod
+    def _witness_costs(source, excluded, max_cost, out_edges, settle_limit):
+        """
+        Local Dijkstra in the remaining graph that avoids the node being contracted
+        """
+
+        costs = {source: 0}
+        queue = [(0, source)]
+        settled = 0
+        while queue and settled < settle_limit:
+            cost, u = heappop(queue)
+            if cost > costs.get(u, np.inf):
+                continue
+            if cost > max_cost:
+                break
+            settled += 1
+            for v, edge in out_edges[u].items():
+                if v == excluded:
+                    continue
+                new_cost = cost + edge[0]
+                if new_cost < costs.get(v, np.inf):
+                    costs[v] = new_cost
+                    heappush(queue, (new_cost, v))
+        return costs
+
+    def _shortcuts(self, x, out_edges, in_edges, settle_limit):
+        """
+        Shortcuts (u, v, cost) needed when contracting x
+        """
+
+        shortcuts = []
+        if len(out_edges[x]) == 0:
+            return shortcuts
+        max_out = max(edge[0] for edge in out_edges[x].values())
+        for u, in_edge in in_edges[x].items():
+            witness_costs = self._witness_costs(u, x, in_edge[0] + max_out, out_edges, settle_limit)
+            for v, out_edge in out_edges[x].items():
+                if v == u:
+                    continue
+                cost = in_edge[0] + out_edge[0]
+                if witness_costs.get(v, np.inf) > cost:
+                    shortcuts.append((u, v, cost))
+        return shortcuts
+
+    def _priority(self, x, out_edges, in_edges, contracted_neighbors, settle_limit):
+        """
+        Edge difference plus the number of contracted neighbors, lower values get contracted first
+        """
+
+        n_shortcuts = len(self._shortcuts(x, out_edges, in_edges, settle_limit))
+        return n_shortcuts - len(out_edges[x]) - len(in_edges[x]) + contracted_neighbors[x]
+
+    def _search(self, source, target):
+        """
+        Bidirectional upward Dijkstra, returns the cost, the meeting node and the predecessors of both searches
+        """
+
+        if source == target:
+            return 0, source, {}, {}
+
+        costs = ({source: 0}, {target: 0})
+        predecessors = ({}, {})
+        queues = ([(0, source)], [(0, target)])
+        adjacency = (self._up_out, self._up_in)
+        best_cost = np.inf
+        meeting_node = None
+        side = 0
+
+        while queues[0] or queues[1]:
+            # alternate between the directions, continue with the other one if one is exhausted
+            if not queues[side]:
+                side = 1 - side
+            queue = queues[side]
+            cost, u = heappop(queue)
+            if cost > costs[side][u]:
+                continue
+            if cost >= best_cost:
+                # this direction cannot improve the result anymore
+                queue.clear()
+                side = 1 - side
+                continue
+            if u in costs[1 - side] and cost + costs[1 - side][u] < best_cost:
+                best_cost = cost + costs[1 - side][u]
+                meeting_node = u
+            for v, edge_cost in adjacency[side][u]:
+                new_cost = cost + edge_cost
+                if new_cost < costs[side].get(v, np.inf):
+                    costs[side][v] = new_cost
+                    predecessors[side][v] = u
+                    heappush(queue, (new_cost, v))
+            side = 1 - side
+
+        return best_cost, meeting_node, predecessors[0], predecessors[1]
+
+    def cost(self, source, target):
+        """
+        Cost of the shortest path between two nodes, np.inf if there is none
+        """
+
+        return self._search(self.node_index[source], self.node_index[target])[0]
+
+    def path(self, source, target):
+        """
+        Shortest path between two nodes as a list of edge ids (u, v, key) of the original graph,
+        None if there is no path
+        """
+
+        cost, meeting_node, forward, backward = self._search(self.node_index[source], self.node_index[target])
+        if meeting_node is None:
+            return None
+
+        # path in the hierarchy
+        hierarchy_path = [meeting_node]
+        while hierarchy_path[0] in forward:
+            hierarchy_path.insert(0, forward[hierarchy_path[0]])
+        while hierarchy_path[-1] in backward:
+            hierarchy_path.append(backward[hierarchy_path[-1]])
+
+        positions = []
+        for u, v in zip(hierarchy_path[:-1], hierarchy_path[1:]):
+            self._unpack(u, v, positions)
+        return [self.edges[position] for position in positions]
+
+    def _unpack(self, u, v, positions):
+        """
+        Expands an edge of the hierarchy into the positions of the original edges
+        """
+
+        stack = [(u, v)]
+        while stack:
+            u, v = stack.pop()
+            cost, middle, position = self._edge_table[(u, v)]
+            if middle < 0:
+                positions.append(position)
+            else:
+                stack.append((middle, v))
+                stack.append((u, middle))
+
+    def save(self, path):
+        """
+        Saves the contraction hierarchy as a compressed numpy archive, e.g. next to the saved graph
+        """
+
+        table = list(self._edge_table.items())
+        np.savez_compressed(
+            path,
+            weight=np.array(self.weight),
+            fingerprint=np.array(self.fingerprint),
+            # node ids and edge ids as JSON, so that loading does not need pickle
+            nodes=np.array(json.dumps(self.nodes)),
+            edges=np.array(json.dumps(self.edges)),
+            rank=self.rank,
+            up_out_indptr=np.cumsum([0] + [len(edges) for edges in self._up_out]),
+            up_out=np.array([edge for edges in self._up_out for edge in edges], dtype=float).reshape(-1, 2),
+            up_in_indptr=np.cumsum([0] + [len(edges) for edges in self._up_in]),
+            up_in=np.array([edge for edges in self._up_in for edge in edges], dtype=float).reshape(-1, 2),
+            table_uv=np.array([uv for uv, edge in table], dtype=np.int64).reshape(-1, 2),
+            table_cost=np.array([edge[0] for uv, edge in table], dtype=float),
+            table_middle_position=np.array([edge[1:] for uv, edge in table], dtype=np.int64).reshape(-1, 2),
+        )
+
+    @classmethod
+    def load(cls, path, G=None):
+        """
+        Loads a contraction hierarchy saved with save()
+
+        Parameters
+        ----------
+        path : str
+        G : nx.MultiDiGraph
+            if provided, it is checked that the hierarchy was built on a graph with the same
+            nodes, edges and costs
+
+        Returns
+        -------
+        ContractionHierarchy
+        """
+
+        archive = np.load(path)
+        ch = cls(weight=str(archive['weight']))
+        ch.fingerprint = str(archive['fingerprint'])
+        if G is not None and graph_fingerprint(G, ch.weight) != ch.fingerprint:
+            raise ValueError('The contraction hierarchy in ' + str(path) + ' was built on a different graph')
+
+        ch.nodes = [_from_json(node) for node in json.loads(str(archive['nodes']))]
+        ch.node_index = {node: i for i, node in enumerate(ch.nodes)}
+        ch.edges = [_from_json(edge) for edge in json.loads(str(archive['edges']))]
+        ch.rank = archive['rank']
+
+        def adjacency(indptr, edges):
+            targets = edges[:, 0].astype(np.int64).tolist()
+            costs = edges[:, 1].tolist()
+            return [list(zip(targets[start:end], costs[start:end])) for start, end in zip(indptr[:-1], indptr[1:])]
+
+        ch._set_upward_graph(
+            adjacency(archive['up_out_indptr'], archive['up_out']),
+            adjacency(archive['up_in_indptr'], archive['up_in'])
+        )
+        ch._edge_table = {
+            (u, v): (cost, middle, position)
+            for (u, v), cost, (middle, position) in zip(
+                archive['table_uv'].tolist(), archive['table_cost'].tolist(),
+                archive['table_middle_position'].tolist()
+            )
+        }
+        return ch
+
+
+def _from_json(value):
+    """
+    Restores the tuples in a node id or edge id that JSON turned into lists
+    """
+
+    if isinstance(value, list):
+        return tuple(_from_json(item) for item in value)
+    return value
+
+
+def graph_fingerprint(G, weight):
+    """
+    A checksum of the node ids and of the edges with their directions and costs,
+    to detect whether a saved contraction hierarchy is outdated
+    """
+
+    checksum = sha1()
+    for node in sorted(G.nodes):
+        checksum.update(repr(node).encode('utf-8'))
+    edges = G.edges(keys=True, data=True) if G.is_multigraph() else G.edges(data=True)
+    for edge in sorted((edge[:-1], float(edge[-1].get(weight, 1))) for edge in edges):
+        checksum.update(repr(edge).encode('utf-8'))
+    return checksum.hexdigest()
+
+
+def load_or_build_contraction_hierarchy(G, weight, path, witness_settle_limit=50):
+    """
+    Loads the contraction hierarchy from a file if it exists and matches the graph,
+    otherwise builds it and saves it to that file
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        lane graph or street graph
+    weight : str
+        edge attribute used as cost
+    path : str
+        file path (.npz), e.g. next to the saved graph
+    witness_settle_limit : int
+        see ContractionHierarchy
+
+    Returns
+    -------
+    ContractionHierarchy
+    """
+
+    if os.path.exists(path):
+        try:
+            ch = ContractionHierarchy.load(path, G)
+            if ch.weight == weight:
+                return ch
+        except ValueError:
+            pass
+
+    ch = ContractionHierarchy(G, weight, witness_settle_limit=witness_settle_limit)
+    ch.save(path)
+    return ch
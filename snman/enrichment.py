@@ -1,16 +1,21 @@
 import copy
+import json
+import os
+from hashlib import sha1
+from pathlib import Path
 
 import leuvenmapmatching.matcher.base
 from leuvenmapmatching.matcher.distance import DistanceMatcher
 from leuvenmapmatching.map.inmem import InMemMap
 from leuvenmapmatching import visualization as mmviz
 import shapely as shp
-from statistics import mean
 import pandas as pd
 import geopandas as gpd
 import networkx as nx
 import warnings
-from . import utils, space_allocation, street_graph, io
+import numpy as np
+from . import osmnx_customized as oxc
+from . import utils, space_allocation, street_graph, io, _errors
 from .constants import *
 
 
@@ -20,6 +25,8 @@ def match_linestrings(
         remove_sidetrips=True,
         lanes_key = KEY_LANES_DESCRIPTION,
         modes = None,
+        matches = None,
+        cache_dir = None,
         _save_map=None,
         **distance_matcher_args
 ):
@@ -38,6 +45,16 @@ def match_linestrings(
         data source
     column_configs : list
         a list of dictionaries, see example
+    matches : pd.DataFrame
+        a match table returned by an earlier call of this function or match_linestrings_to_node_pairs(),
+        if provided, the mapmatching will be skipped and only the attributes will be transferred
+    cache_dir : str
+        folder for caching the matched node pairs across runs, see match_linestrings_to_node_pairs()
+
+    Returns
+    -------
+    pd.DataFrame
+        the match table, see match_linestrings_to_node_pairs()
 
     Examples
     --------
@@ -55,13 +72,54 @@ def match_linestrings(
     if len(source) == 0:
         return
 
-    # create empty in-memory map for the mapmatching process
-    map_con = InMemMap("source", use_latlon=False, use_rtree=True, index_edges=True, crs_xy=2056)
+    if matches is None:
+        matches = match_linestrings_to_node_pairs(
+            G, source,
+            remove_short_overlaps=remove_short_overlaps, max_dist2=max_dist2,
+            remove_sidetrips=remove_sidetrips,
+            lanes_key=lanes_key,
+            modes=modes,
+            cache_dir=cache_dir,
+            _save_map=_save_map,
+            **distance_matcher_args
+        )
 
-    # add nodes to the in-memory map
-    # please note that lv works with lat, lon (reverse order)
-    for id, data in G.nodes.items():
-        map_con.add_node(id, (data['y'], data['x']))
+    aggregate_matches(G, source, matches, column_configs)
+
+    return matches
+
+
+def match_linestrings_to_node_pairs(
+        G, source,
+        remove_short_overlaps=True, max_dist2=None,
+        remove_sidetrips=True,
+        lanes_key = KEY_LANES_DESCRIPTION,
+        modes = None,
+        cache_dir = None,
+        _save_map=None,
+        **distance_matcher_args
+):
+    """
+    Match the polylines in a GeoDataFrame onto the graph edges, without transferring any attributes.
+    The resulting match table can be reused with aggregate_matches() for any number of column configs.
+
+    Parameters
+    ----------
+    G : nx.MultiGraph
+        street graph, target
+    source : gpd.GeoDataFrame
+        data source, the matched node pairs will also be saved in its column 'node_pairs'
+    cache_dir : str
+        if provided, the matched node pairs are cached in this folder, keyed by the node coordinates and edges
+        of the graph, the matcher parameters and each source geometry,
+        so that only new or edited source geometries need to be matched again in later runs
+
+    Returns
+    -------
+    pd.DataFrame
+        match table in long format with one row per matched node pair and the columns
+        u, v and source_row, which is the position (not the index label) of the matched row in the source
+    """
 
     # keep only edges accessible to at least one of the provided modes
     if modes:
@@ -69,6 +127,63 @@ def match_linestrings(
     else:
         H = G
 
+    node_pairs = [None] * len(source)
+
+    # take over the node pairs of all geometries that have already been matched in an earlier run
+    if cache_dir:
+        cache_filepath = _mapmatching_cache_filepath(
+            cache_dir, G, H,
+            dict(
+                remove_short_overlaps=remove_short_overlaps, max_dist2=max_dist2,
+                remove_sidetrips=remove_sidetrips, **distance_matcher_args
+            )
+        )
+        cache = _load_mapmatching_cache(cache_filepath)
+        geometry_hashes = [
+            sha1(wkb).hexdigest() for wkb in shp.to_wkb(np.asarray(source.geometry, dtype=object))
+        ]
+        node_pairs = [cache.get(geometry_hash) for geometry_hash in geometry_hashes]
+
+    rows_to_match = [i for i, pairs in enumerate(node_pairs) if pairs is None]
+
+    if len(rows_to_match) > 0:
+
+        matcher = _create_matcher(G, H, _save_map, **distance_matcher_args)
+
+        # submit all remaining source linestrings to the matcher
+        geometries = source.geometry.tolist()
+        for i in rows_to_match:
+            node_pairs[i] = _submit_linestring_to_matcher(
+                matcher,
+                geometries[i],
+                remove_short_overlaps,
+                remove_sidetrips,
+                max_dist2
+            )
+
+        if cache_dir:
+            for i in rows_to_match:
+                cache[geometry_hashes[i]] = node_pairs[i]
+            _save_mapmatching_cache(cache_filepath, cache)
+
+    source['node_pairs'] = pd.Series(node_pairs, index=source.index, dtype=object)
+
+    return _node_pairs_to_match_table(source['node_pairs'])
+
+
+def _create_matcher(G, H, _save_map=None, **distance_matcher_args):
+    """
+    Creates a matcher with an in-memory map consisting of all nodes in G and all edges in H
+    """
+
+    # create empty in-memory map for the mapmatching process
+    map_con = InMemMap("source", use_latlon=False, use_rtree=True, index_edges=True, crs_xy=2056)
+
+    # add nodes to the in-memory map
+    # please note that lv works with lat, lon (reverse order)
+    for id, data in G.nodes.items():
+        map_con.add_node(id, (data['y'], data['x']))
+
     if _save_map:
         I = copy.deepcopy(G)
         I.remove_edges_from(G.edges())
@@ -88,64 +203,144 @@ def match_linestrings(
     if _save_map:
         io.export_street_graph(I, *_save_map)
 
-    # create a matcher
-    matcher = DistanceMatcher(map_con, **distance_matcher_args)
-
-    # submit all source linestrings to the matcher
-    source['node_pairs'] = source.apply(
-        lambda x: _submit_linestring_to_matcher(
-            matcher,
-            x['geometry'],
-            remove_short_overlaps,
-            remove_sidetrips,
-            max_dist2
-        ), axis=1)
-
-    # transfer the attributes as specified in "column_configs"
-    # note that there may be multiple values that will be transferred to a single target edge,
-    # so they need to be aggregated (see next step)
-    for config in column_configs:
-
-        edge_values = {}
-        for index, edge in source.iterrows():
-            value = edge[config['source_column']]
-            node_pairs = edge['node_pairs']
-            if len(node_pairs) < 1:
-                continue
-            for node_pair in node_pairs:
-                u = node_pair[0]
-                v = node_pair[1]
-                if edge_values.get((u, v)) is None:
-                    edge_values[(u, v)] = []
-                edge_values[(u, v)].append(value)
-
-        # aggregate the target data using one of the following functions
-        for uvk, data in G.edges.items():
-            if config['agg'] == 'avg':
-                data[config['target_column'] + '_forward']  = mean(edge_values.get(uvk[:2], [0]))
-                data[config['target_column'] + '_backward'] = mean(edge_values.get(uvk[:2][::-1], [0]))
-            if config['agg'] == 'max':
-                data[config['target_column'] + '_forward']  = max(edge_values.get(uvk[:2], [0]))
-                data[config['target_column'] + '_backward'] = max(edge_values.get(uvk[:2][::-1], [0]))
-            if config['agg'] == 'count':
-                data[config['target_column'] + '_forward']  = len(edge_values.get(uvk[:2], []))
-                data[config['target_column'] + '_backward'] = len(edge_values.get(uvk[:2][::-1], []))
-            if config['agg'] == 'list':
-                data[config['target_column'] + '_forward']  = str(edge_values.get(uvk[:2], []))
-                data[config['target_column'] + '_backward'] = str(edge_values.get(uvk[:2][::-1], []))
-            if config['agg'] == 'add_lanes':
-                forward = utils.flatten_list(edge_values.get(uvk[:2], []))
-                data[config['target_column']].extend(forward)
-                backward = utils.flatten_list(edge_values.get(uvk[:2][::-1], []))
-                backward = space_allocation.reverse_lanes(backward)
-                data[config['target_column']] = backward + data[config['target_column']]
-            if config['agg'] == 'replace_lanes':
-                forward = list(utils.flatten_list(edge_values.get(uvk[:2], [])))
-                backward = list(utils.flatten_list(edge_values.get(uvk[:2][::-1], [])))
-                backward = space_allocation.reverse_lanes(backward)
-                if len(forward+backward) > 0:
-                    data[config['target_column']] = backward + forward
-                    #print(data[config['target_column']])
+    return DistanceMatcher(map_con, **distance_matcher_args)
+
+
+def _mapmatching_cache_filepath(cache_dir, G, H, matcher_parameters):
+    """
+    Returns the path of the cache file for a given graph and set of matcher parameters.
+    The name is a checksum of the node coordinates in G, the edges in H, and the matcher parameters.
+    """
+
+    checksum = sha1()
+    for node, data in sorted(G.nodes.items()):
+        checksum.update(repr((node, data['x'], data['y'])).encode('utf-8'))
+    for u, v in sorted({(u, v) for u, v, k in H.edges(keys=True)}):
+        checksum.update(repr((u, v)).encode('utf-8'))
+    checksum.update(json.dumps(matcher_parameters, sort_keys=True, default=str).encode('utf-8'))
+
+    return Path(cache_dir) / ('mapmatching_' + checksum.hexdigest() + '.json')
+
+
+def _load_mapmatching_cache(cache_filepath):
+    """
+    Loads the cached node pairs as a dictionary {geometry checksum: list of node pairs}
+    """
+
+    if not cache_filepath.is_file():
+        return {}
+
+    cache = json.loads(cache_filepath.read_text(encoding='utf-8'))
+    # json stores the node pairs as lists, convert them back to tuples
+    return {
+        geometry_hash: [tuple(node_pair) for node_pair in node_pairs]
+        for geometry_hash, node_pairs in cache.items()
+    }
+
+
+def _save_mapmatching_cache(cache_filepath, cache):
+    """
+    Saves the cached node pairs, writing to a temporary file first so that an interrupted run
+    does not leave a broken cache file behind
+    """
+
+    cache_filepath.parent.mkdir(parents=True, exist_ok=True)
+    temporary_filepath = cache_filepath.with_suffix('.tmp')
+    temporary_filepath.write_text(json.dumps(cache, default=int), encoding='utf-8')
+    os.replace(temporary_filepath, cache_filepath)
+
+
+def _node_pairs_to_match_table(node_pairs):
+    """
+    Converts a series of matched node pair lists into a long-format match table
+    """
+
+    return pd.DataFrame(
+        [
+            (u, v, source_row)
+            for source_row, pairs in enumerate(node_pairs)
+            for u, v in pairs
+        ],
+        columns=['u', 'v', 'source_row']
+    )
+
+
+def aggregate_matches(G, source, matches, column_configs):
+    """
+    Transfer the attributes as specified in column_configs from the source to the graph edges, based on a match table.
+    Note that there may be multiple values that will be transferred to a single target edge,
+    so they are aggregated using the function specified in each config.
+
+    Parameters
+    ----------
+    G : nx.MultiGraph
+        street graph, target
+    source : gpd.GeoDataFrame
+        data source
+    matches : pd.DataFrame
+        match table, see match_linestrings_to_node_pairs()
+    column_configs : list
+        a list of dictionaries, see match_linestrings()
+
+    Returns
+    -------
+    None
+    """
+
+    aggregation_functions = {
+        'avg': 'mean',
+        'max': 'max',
+        'count': 'size',
+        'list': lambda x: str(x.tolist()),
+        'add_lanes': lambda x: list(utils.flatten_list(x)),
+        'replace_lanes': lambda x: list(utils.flatten_list(x)),
+    }
+    default_values = {
+        'avg': 0,
+        'max': 0,
+        'count': 0,
+        'list': '[]',
+        'add_lanes': [],
+        'replace_lanes': [],
+    }
+
+    # collect the values of all configs in one long table and aggregate them in one pass
+    source_rows = matches['source_row'].to_numpy(dtype=int)
+    table = matches[['u', 'v']].copy()
+    for i, config in enumerate(column_configs):
+        table[i] = source[config['source_column']].to_numpy()[source_rows]
+
+    aggregated = table.groupby(['u', 'v'], sort=False).agg(**{
+        '_' + str(i): (i, aggregation_functions[config['agg']])
+        for i, config in enumerate(column_configs)
+    })
+
+    for i, config in enumerate(column_configs):
+
+        agg = config['agg']
+        target = config['target_column']
+        values = aggregated['_' + str(i)].to_dict()
+        default_value = default_values[agg]
+
+        forward = {uvk: values.get(uvk[:2], default_value) for uvk in G.edges(keys=True)}
+        backward = {uvk: values.get(uvk[:2][::-1], default_value) for uvk in G.edges(keys=True)}
+
+        if agg in {'avg', 'max', 'count', 'list'}:
+            nx.set_edge_attributes(G, forward, target + '_forward')
+            nx.set_edge_attributes(G, backward, target + '_backward')
+
+        elif agg == 'add_lanes':
+            nx.set_edge_attributes(G, {
+                uvk: space_allocation.reverse_lanes(backward[uvk]) + data[target] + forward[uvk]
+                for uvk, data in G.edges.items()
+            }, target)
+
+        elif agg == 'replace_lanes':
+            nx.set_edge_attributes(G, {
+                uvk: space_allocation.reverse_lanes(backward[uvk]) + forward[uvk]
+                for uvk in G.edges(keys=True)
+                if len(forward[uvk] + backward[uvk]) > 0
+            }, target)
 
 
 def _submit_linestring_to_matcher(matcher, geom, remove_short_overlaps, remove_sidetrips, max_distance):
@@ -238,15 +433,79 @@ def match_lane_edits(G, lane_edits, lanes_key=KEY_LANES_DESCRIPTION, **mapmatchi
 def match_parking_spots(
         G, parking_spots,
         parking_space_length=7, parking_space_length_for_one_lane=24,
-        remove_previous_parking=True
+        remove_previous_parking=True,
+        method='mapmatching',
+        max_distance=30,
+        cache_dir=None
 ):
+    """
+    Match parking spots onto the street graph and estimate the number of parking lanes on each edge.
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        street graph
+    parking_spots : gpd.GeoDataFrame
+        parking spots as points, see io.load_parking_spots()
+    parking_space_length : float
+        length of one parking space along the street
+    parking_space_length_for_one_lane : float
+        if there is at least one parking spot per this length, the edge will get at least one parking lane
+    remove_previous_parking : bool
+        remove any existing parking lanes before adding the matched ones
+    method : str
+        - mapmatching: match each parking spot as a zero-length linestring using match_linestrings()
+        - nearest: snap each parking spot to the nearest ground-level edge in a single pass,
+          much faster for large datasets
+    max_distance : float
+        parking spots farther away from any edge will be ignored
+    cache_dir : str
+        folder for caching the mapmatching results, see match_linestrings_to_node_pairs()
+
+    Returns
+    -------
+    None
+    """
+
+    parking_count_key = '_n_parking_spots'
+
+    if method == 'mapmatching':
+        _match_parking_spots_by_mapmatching(G, parking_spots, parking_count_key, max_distance, cache_dir)
+    elif method == 'nearest':
+        _match_parking_spots_by_nearest_edge(G, parking_spots, parking_count_key, max_distance)
+    else:
+        raise _errors.OptionNotImplemented('Method ' + str(method) + ' is not valid')
+
+    for uvk, data in G.edges.items():
+        # please note that the forward/backward distinction is meaningless and completely random in this case
+        parking_count = data.get(parking_count_key + '_forward', 0) + data.get(parking_count_key + '_backward', 0)
+        data['n_parking_spots'] = parking_count
+        length = data['length']
+        parking_space_density = utils.safe_division(parking_count, length)
+        # estimating the number of parking lanes based on the number of parking spots that have been matched
+        n_parking_lanes = round(parking_space_density / (1 / parking_space_length))
+        if n_parking_lanes == 0 and parking_space_density > 1 / parking_space_length_for_one_lane:
+            n_parking_lanes = 1
+
+        if remove_previous_parking:
+            data[KEY_LANES_DESCRIPTION] = space_allocation.filter_lanes_by_modes(
+                data[KEY_LANES_DESCRIPTION],
+                MODES.difference({MODE_CAR_PARKING})
+            )
+
+        data[KEY_LANES_DESCRIPTION].extend([LANETYPE_PARKING_PARALLEL + DIRECTION_BOTH] * n_parking_lanes)
+
+
+def _match_parking_spots_by_mapmatching(G, parking_spots, parking_count_key, max_distance, cache_dir):
+    """
+    a helper for match_parking_spots(), matches the parking spots using the full mapmatching process
+    """
 
     # copy the parking spaces dataset and convert the points into zero-length linestrings
     # that can be matched onto the edges
     parking_spots = copy.deepcopy(parking_spots)
     parking_spots.geometry = parking_spots.geometry.apply(lambda x: shp.LineString([x, x]))
 
-    parking_count_key = '_n_parking_spots'
     column_configs = [
         {'source_column': 'id1', 'target_column': parking_count_key, 'agg': 'count'}
     ]
@@ -260,8 +519,8 @@ def match_parking_spots(
     # match on the ground-level street graph
     match_linestrings(
         H, parking_spots, column_configs, remove_short_overlaps=False,
-        modes=[MODE_PRIVATE_CARS, MODE_TRANSIT],
-        max_dist=30, max_dist_init=30, max_lattice_width=5
+        modes=[MODE_PRIVATE_CARS, MODE_TRANSIT], cache_dir=cache_dir,
+        max_dist=max_distance, max_dist_init=max_distance, max_lattice_width=5
     )
 
     # copy the matched attributes into the original street graph
@@ -272,27 +531,122 @@ def match_parking_spots(
             parking_count_key + _direction
         )
 
-    for uvk, data in G.edges.items():
-        # please note that the forward/backward distinction is meaningless and completely random in this case
-        parking_count = data.get(parking_count_key + '_forward', 0) + data.get(parking_count_key + '_backward', 0)
-        data['n_parking_spots'] = parking_count
-        length = data['length']
-        parking_space_density = utils.safe_division(parking_count, length)
-        # estimating the number of parking lanes based on the number of parking spots that have been matched
-        n_parking_lanes = round(parking_space_density / (1 / parking_space_length))
-        if n_parking_lanes == 0 and parking_space_density > 1 / parking_space_length_for_one_lane:
-            n_parking_lanes = 1
 
-        if remove_previous_parking:
-            data[KEY_LANES_DESCRIPTION] = space_allocation.filter_lanes_by_modes(
-                data[KEY_LANES_DESCRIPTION],
-                MODES.difference({MODE_CAR_PARKING})
-            )
+def _match_parking_spots_by_nearest_edge(G, parking_spots, parking_count_key, max_distance):
+    """
+    a helper for match_parking_spots(), snaps the parking spots to the nearest edge
+    """
 
-        data[KEY_LANES_DESCRIPTION].extend([LANETYPE_PARKING_PARALLEL + DIRECTION_BOTH] * n_parking_lanes)
+    snapped = snap_points_to_edges(
+        G, parking_spots.geometry,
+        modes={MODE_PRIVATE_CARS, MODE_TRANSIT}, layer=0, max_distance=max_distance
+    )
+    snapped = snapped.dropna(subset=['u'])
+
+    counts = snapped.groupby(['u', 'v', 'key', 'left_side']).size()
+
+    for _direction, left_side in [('_forward', False), ('_backward', True)]:
+        # spots on the right side are counted as forward, spots on the left side as backward
+        values = dict.fromkeys(G.edges(keys=True), 0)
+        values.update({
+            (u, v, k): int(n)
+            for (u, v, k, side), n in counts.items()
+            if side == left_side
+        })
+        nx.set_edge_attributes(G, values, parking_count_key + _direction)
+
+
+def snap_points_to_edges(
+        G, points,
+        modes=None, layer=None, max_distance=None,
+        lanes_key=KEY_LANES_DESCRIPTION
+):
+    """
+    Snap each point to the nearest edge of the street graph, using the spatial index cached in the street graph.
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        street graph
+    points : gpd.GeoSeries or list
+        point geometries, in the same crs as the street graph
+    modes : set
+        consider only edges with at least one lane accessible to one of these modes
+    layer : int
+        consider only edges on this layer
+    max_distance : float
+        points farther away from any edge will not be snapped
+    lanes_key : str
+        which lane description should be used for filtering by modes
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per point with the columns u, v, key, distance and left_side,
+        which tells if the point lies to the left of the edge in its digitization direction,
+        u, v and key are None for points that could not be snapped
+    """
 
+    index = points.index if isinstance(points, pd.Series) else None
+    points = np.asarray(points, dtype=object)
+    result = pd.DataFrame(
+        {
+            'u': pd.Series([None] * len(points), dtype=object),
+            'v': pd.Series([None] * len(points), dtype=object),
+            'key': pd.Series([None] * len(points), dtype=object),
+            'distance': np.nan,
+            'left_side': False
+        },
+        index=pd.RangeIndex(len(points))
+    )
 
-def match_public_transit(G, pt_routes):
+    if G.number_of_edges() == 0 or len(points) == 0:
+        result.index = index if index is not None else result.index
+        return result
+
+    # the spatial index is cached in the street graph and reused by later calls,
+    # the filters only select which of its edges are searched
+    spatial_index = oxc.distance.spatial_index(G)
+    mask = None
+    if layer is not None or modes is not None:
+        mask = np.array([
+            (layer is None or data.get('layer') == layer)
+            and (modes is None or len(space_allocation.filter_lanes_by_modes(data.get(lanes_key, []), modes)) > 0)
+            for data in (G.edges[uvk] for uvk in spatial_index.edge_ids)
+        ], dtype=bool)
+
+    edge_idx, distances, position = spatial_index.query_edges(
+        shp.get_x(points), shp.get_y(points), mask=mask, max_distance=max_distance, return_position=True
+    )
+    point_idx = np.flatnonzero(edge_idx >= 0)
+    edge_idx = edge_idx[point_idx]
+    distances = distances[point_idx]
+    position = position[point_idx]
+
+    # find out on which side of the edge each point lies, using the local direction of the edge geometry
+    matched_geometries = spatial_index.edge_geometries[edge_idx]
+    matched_points = points[point_idx]
+    lengths = shp.length(matched_geometries)
+    a = shp.line_interpolate_point(matched_geometries, np.clip(position - 0.5, 0, lengths))
+    b = shp.line_interpolate_point(matched_geometries, np.clip(position + 0.5, 0, lengths))
+    ax, ay, bx, by = shp.get_x(a), shp.get_y(a), shp.get_x(b), shp.get_y(b)
+    px, py = shp.get_x(matched_points), shp.get_y(matched_points)
+    cross_product = (bx - ax) * (py - ay) - (by - ay) * (px - ax)
+
+    matched_edge_ids = spatial_index.edge_ids[edge_idx]
+    result.loc[point_idx, 'u'] = pd.Series([uvk[0] for uvk in matched_edge_ids], index=point_idx, dtype=object)
+    result.loc[point_idx, 'v'] = pd.Series([uvk[1] for uvk in matched_edge_ids], index=point_idx, dtype=object)
+    result.loc[point_idx, 'key'] = pd.Series([uvk[2] for uvk in matched_edge_ids], index=point_idx, dtype=object)
+    result.loc[point_idx, 'distance'] = distances
+    result.loc[point_idx, 'left_side'] = cross_product > 0
+
+    if index is not None:
+        result.index = index
+
+    return result
+
+
+def match_public_transit(G, pt_routes, cache_dir=None):
     """
     Match public transit routes onto the street graph using mapmatching.
 
@@ -302,6 +656,8 @@ def match_public_transit(G, pt_routes):
         street graph
     routes : gpd.GeoDataFrame
         transit routes
+    cache_dir : str
+        folder for caching the mapmatching results, see match_linestrings_to_node_pairs()
 
     Returns
     -------
@@ -317,7 +673,7 @@ def match_public_transit(G, pt_routes):
 
     match_linestrings(
         G, pt_routes, column_configs, remove_short_overlaps=False,
-        modes=(MODE_TRANSIT, MODE_PRIVATE_CARS),
+        modes=(MODE_TRANSIT, MODE_PRIVATE_CARS), cache_dir=cache_dir,
         max_dist=200, max_dist_init=500, max_lattice_width=5
     )
 
@@ -344,24 +700,27 @@ def match_sensors(G, sensors_df):
     None
     """
 
-    s = sensors_df.copy()
-    s['id'] = s.index
-    s = s.set_index(['u', 'v', 'osmid']).sort_index()
-
-    for uvk, data in G.edges.items():
-        u, v, k = uvk
+    sensors = sensors_df[['u', 'v', 'osmid']].assign(id=sensors_df.index)
 
-        i_forward = (u, v, data['osmid'])
-        if i_forward in s.index:
-            data['sensors_forward'] = [s.loc[i_forward]['id']]
-        else:
-            data['sensors_forward'] = []
+    # one row per edge and osmid, merged edges may carry a list of osmids
+    edges = pd.DataFrame(
+        [(u, v, k, data['osmid']) for (u, v, k), data in G.edges.items()],
+        columns=['u', 'v', 'key', 'osmid']
+    ).explode('osmid')
+    edges['osmid'] = edges['osmid'].astype(sensors['osmid'].dtype)
 
-        i_backward = (v, u, data['osmid'])
-        if i_backward in s.index:
-            data['sensors_backward'] = [s.loc[i_backward]['id']]
-        else:
-            data['sensors_backward'] = []
+    for direction, sensor_keys in [('forward', ['u', 'v', 'osmid']), ('backward', ['v', 'u', 'osmid'])]:
+        # join the sensors to the edges in the given direction
+        matched = edges.merge(
+            sensors.rename(columns=dict(zip(sensor_keys, ['u', 'v', 'osmid']))),
+            on=['u', 'v', 'osmid']
+        )
+        sensor_ids = matched.groupby(['u', 'v', 'key'])['id'].agg(list).to_dict()
+        nx.set_edge_attributes(
+            G,
+            {uvk: sensor_ids.get(uvk, []) for uvk in G.edges(keys=True)},
+            'sensors_' + direction
+        )
 
 
 def match_public_transit_by_buffers(G, pt_network):
@@ -383,39 +742,52 @@ def match_public_transit_by_buffers(G, pt_network):
             * ALIGNMENT (tunnel, <None>)
     """
 
-    # Add buffers around the pt routes
-    pt_network_buffers = pt_network.copy()
-    pt_network_buffers.geometry = pt_network_buffers.geometry.buffer(15, resolution=16)
-
-    for edge in G.edges(data=True, keys=True):
-
-        edge_geometry = edge[3]['geometry']
-
-        # Get all pt routes whose buffers intersect with this edge
-        pt_routes = pt_network_buffers[
-            pt_network_buffers.intersects(edge_geometry).tolist()
-            and pt_network_buffers['ALIGNMENT'] != 'tunnel'
-        ].copy()
-
-        if len(pt_routes) == 0:
-            continue
-
-        # Calculate the overlapping length
-        with warnings.catch_warnings():
-            # we suppress warnings due to a known issue in the intersection function
-            # see here: https://github.com/shapely/shapely/issues/1345
-            warnings.simplefilter("ignore")
-            pt_routes['intersection_length_prop'] = [
-                edge_geometry.intersection(pt_route).length / edge_geometry.length if edge_geometry.length != 0 else 0
-                for pt_route in pt_routes.geometry
-            ]
-
-        # Keep only those that overlap over a substantial part
-        pt_routes = pt_routes[pt_routes['intersection_length_prop'] > 0.7]
+    # Add buffers around the pt routes, tunnels are ignored
+    pt_network = pt_network[pt_network['ALIGNMENT'] != 'tunnel']
+    pt_network_buffers = shp.buffer(np.asarray(pt_network.geometry, dtype=object), 15, quad_segs=16)
+
+    edge_ids = list(G.edges(keys=True))
+    edge_geometries = np.array([data['geometry'] for uvk, data in G.edges.items()], dtype=object)
+
+    # Get all pairs of edges and pt routes whose buffers intersect, in a single query
+    tree = shp.STRtree(pt_network_buffers)
+    edge_idx, route_idx = tree.query(edge_geometries, predicate='intersects')
+    order = np.lexsort((route_idx, edge_idx))
+    edge_idx, route_idx = edge_idx[order], route_idx[order]
+
+    # Calculate the overlapping length
+    with warnings.catch_warnings():
+        # we suppress warnings due to a known issue in the intersection function
+        # see here: https://github.com/shapely/shapely/issues/1345
+        warnings.simplefilter("ignore")
+        intersection_lengths = shp.length(
+            shp.intersection(edge_geometries[edge_idx], pt_network_buffers[route_idx])
+        )
+        edge_lengths = shp.length(edge_geometries[edge_idx])
+        intersection_length_prop = np.divide(
+            intersection_lengths, edge_lengths,
+            out=np.zeros(len(edge_idx)), where=edge_lengths != 0
+        )
 
-        edge[3]['pt_routes'] = str(pt_routes.LINIENNUMM.tolist())
+    # Keep only those that overlap over a substantial part
+    keep = intersection_length_prop > 0.7
+    pt_routes = pd.DataFrame({
+        'edge': edge_idx[keep],
+        'LINIENNUMM': pt_network['LINIENNUMM'].to_numpy()[route_idx[keep]],
+        'TYPE': pt_network['TYPE'].to_numpy()[route_idx[keep]],
+    })
+    pt_routes_by_edge = pt_routes.groupby('edge').agg(
+        pt_routes=('LINIENNUMM', lambda x: str(x.tolist())),
         # TODO: Distinguish directions of pt lines
-        edge[3]['pt_tram'] = pt_routes['TYPE'].eq('Tram').any() * 1
-        edge[3]['pt_bus'] = pt_routes['TYPE'].eq('Bus').any() * 1
-        edge[3]['pt_mcrbus'] = pt_routes['TYPE'].eq('Microbus').any() * 1
+        pt_tram=('TYPE', lambda x: x.eq('Tram').any() * 1),
+        pt_bus=('TYPE', lambda x: x.eq('Bus').any() * 1),
+        pt_mcrbus=('TYPE', lambda x: x.eq('Microbus').any() * 1),
+    )
 
+    for attribute, default_value in [('pt_routes', '[]'), ('pt_tram', 0), ('pt_bus', 0), ('pt_mcrbus', 0)]:
+        values = pt_routes_by_edge[attribute].to_dict()
+        nx.set_edge_attributes(
+            G,
+            {uvk: values.get(i, default_value) for i, uvk in enumerate(edge_ids)},
+            attribute
+        )
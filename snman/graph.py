@@ -1,6 +1,10 @@
+from heapq import heappush, heappop
+from itertools import count
 import networkx as nx
+import numpy as np
+import pandas as pd
 from . import osmnx_customized as oxc
-from . import utils
+from . import utils, sparse_graph
 
 
 def weak_neighbors(G, node):
@@ -21,7 +25,7 @@ def weak_neighbors(G, node):
     return set(utils.flatten_list(edges)).difference({node})
 
 
-def keep_only_the_largest_connected_component(G, weak=False):
+def keep_only_the_largest_connected_component(G, weak=False, backend='networkx'):
     """
     Remove all nodes and edges that are disconnected from the largest connected component.
     For directed graphs, strong connectedness will be considered, unless weak=True
@@ -32,13 +36,18 @@ def keep_only_the_largest_connected_component(G, weak=False):
         street graph
     weak : bool
         use weakly connected component in case of a directed graph
+    backend : str
+        'networkx' or 'sparse' for scipy.sparse.csgraph, see sparse_graph.SparseGraph
 
     Returns
     -------
     H : copy of subgraph representing the largest connected component
     """
 
-    if G.is_directed():
+    if backend == 'sparse':
+        S = sparse_graph.SparseGraph(G, weights=())
+        nodes = S.largest_connected_component(connection='weak' if weak else 'strong')
+    elif G.is_directed():
         if weak:
             nodes = max(nx.weakly_connected_components(G), key=len)
         else:
@@ -91,7 +100,7 @@ def safe_remove_edge(G, u, v, k, remove_dangling_nodes=True):
     if not G.has_edge(u, v, k):
         return
 
-    G.remove_edge(u, v, k)
+    oxc.stats.remove_edge(G, u, v, k)
 
     if remove_dangling_nodes:
         for node in [u, v]:
@@ -163,3 +172,279 @@ def apply_function_to_each_node(G, function):
 
     for n, data in G.nodes.items():
         function(G, n)
+
+
+def shortest_path_metrics(G, weight, length_weight='length', sources=None, normalized=True):
+    """
+    Runs one Dijkstra per source node on the given weight and accumulates, in the same sweep:
+
+    * the edge betweenness centrality, identical to nx.edge_betweenness_centrality(G, normalized, weight)
+    * the summed cost of all shortest paths, like in nx.average_shortest_path_length(G, weight)
+    * the summed physical length along these shortest paths,
+      if there are multiple shortest paths between two nodes, the shortest one by length_weight is taken
+
+    The graph is not copied or modified.
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        lane graph or street graph
+    weight : str
+        edge attribute holding the cost, e.g., 'cost_cycling'
+    length_weight : str
+        edge attribute holding the physical length
+    sources : list
+        source nodes, all nodes if None,
+        with a sample of sources, the betweenness centrality is an estimate like with the parameter k in networkx
+    normalized : bool
+        normalize the betweenness centrality by the number of (sampled) node pairs
+
+    Returns
+    -------
+    dict
+        * **edge_betweenness_centrality**: dict {(u, v, k): value}
+        * **sum_cost**: summed cost of all shortest paths
+        * **sum_length**: summed length of all shortest paths
+        * **n_pairs**: number of source/target pairs (source != target) with a path
+        * **n_unreachable_pairs**: number of source/target pairs without a path
+    """
+
+    adjacency = _min_weight_adjacency(G, weight, length_weight)
+    betweenness = {}
+    sum_cost = 0
+    sum_length = 0
+    n_pairs = 0
+
+    if sources is None:
+        sources = list(G.nodes)
+
+    for s in sources:
+        S, P, sigma, D, lengths = _single_source_dijkstra_with_lengths(adjacency, s)
+        sum_cost += sum(D.values())
+        sum_length += sum(lengths.values())
+        n_pairs += len(D) - 1
+        _accumulate_edge_betweenness(betweenness, S, P, sigma)
+
+    n = len(G)
+    if normalized and n > 1 and len(sources) > 0:
+        scale = 1 / (len(sources) * (n - 1))
+        betweenness = {uv: value * scale for uv, value in betweenness.items()}
+
+    # distribute the betweenness of each node pair among the parallel edges with minimal weight
+    edge_betweenness = dict.fromkeys(G.edges(keys=True), 0.0)
+    for (u, v), value in betweenness.items():
+        edges = G[u][v]
+        min_weight = min(data.get(weight, 1) for data in edges.values())
+        keys = [k for k, data in edges.items() if data.get(weight, 1) == min_weight]
+        for k in keys:
+            edge_betweenness[(u, v, k)] = value / len(keys)
+
+    return {
+        'edge_betweenness_centrality': edge_betweenness,
+        'sum_cost': sum_cost,
+        'sum_length': sum_length,
+        'n_pairs': n_pairs,
+        'n_unreachable_pairs': len(sources) * (n - 1) - n_pairs,
+    }
+
+
+def _min_weight_adjacency(G, weight, length_weight):
+    """
+    Returns {u: [(v, weight, length), ...]} using the parallel edge with minimal weight (and then minimal length)
+    """
+
+    adjacency = {}
+    for u, neighbors in G.adjacency():
+        adjacency[u] = []
+        for v, edges in neighbors.items():
+            if G.is_multigraph():
+                edges = edges.values()
+            else:
+                edges = [edges]
+            adjacency[u].append(min(
+                (v, data.get(weight, 1), data.get(length_weight, 1)) for data in edges
+            ))
+    return adjacency
+
+
+def _single_source_dijkstra_with_lengths(adjacency, s):
+    """
+    Dijkstra's algorithm as in networkx' betweenness centrality, also tracking the physical length of the paths
+    """
+
+    S = []
+    # a list for every node, equal-cost edges may also lead back to the source (e.g. with zero costs)
+    P = {v: [] for v in adjacency}
+    sigma = {s: 1.0}
+    D = {}
+    lengths = {}
+    seen = {s: 0}
+    seen_lengths = {s: 0}
+    c = count()
+    Q = []
+    heappush(Q, (0, next(c), s, s))
+    while Q:
+        (dist, _, pred, v) = heappop(Q)
+        if v in D:
+            continue
+        sigma[v] += sigma[pred]
+        S.append(v)
+        D[v] = dist
+        lengths[v] = seen_lengths[v]
+        for w, vw_weight, vw_length in adjacency[v]:
+            vw_dist = dist + vw_weight
+            if w not in D and (w not in seen or vw_dist < seen[w]):
+                seen[w] = vw_dist
+                seen_lengths[w] = lengths[v] + vw_length
+                heappush(Q, (vw_dist, next(c), v, w))
+                sigma[w] = 0.0
+                P[w] = [v]
+            elif vw_dist == seen[w]:
+                sigma[w] += sigma[v]
+                P[w].append(v)
+                if w not in D:
+                    seen_lengths[w] = min(seen_lengths[w], lengths[v] + vw_length)
+    return S, P, sigma, D, lengths
+
+
+def _accumulate_edge_betweenness(betweenness, S, P, sigma):
+    """
+    Brandes' accumulation of edge betweenness for one source, as in networkx
+    """
+
+    delta = dict.fromkeys(S, 0)
+    while S:
+        w = S.pop()
+        coeff = (1 + delta[w]) / sigma[w]
+        for v in P.get(w, []):
+            c = sigma[v] * coeff
+            betweenness[(v, w)] = betweenness.get((v, w), 0.0) + c
+            delta[v] += c
+
+
+def sample_node_pairs(G, n_pairs, seed=0, n_strata_per_axis=4):
+    """
+    Draws a stratified random sample of source/target node pairs, for estimating shortest path statistics
+    on graphs that are too large for calculating all pairs.
+
+    The sources are stratified by their location in a regular grid over the bounding box of all nodes,
+    with a number of pairs proportional to the number of nodes in each cell; the targets are drawn uniformly.
+    The same seed on the same graph always gives the same sample, so it can be shared by all lane graphs
+    derived from a street graph (they use the same node ids), e.g., before and after rebuilding.
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        street graph or lane graph
+    n_pairs : int
+        approximate sample size
+    seed : int
+    n_strata_per_axis : int
+        the grid has n_strata_per_axis x n_strata_per_axis cells
+
+    Returns
+    -------
+    pd.DataFrame
+        with the columns source, target, stratum and stratum_weight (share of all nodes in this stratum)
+    """
+
+    rng = np.random.default_rng(seed)
+    nodes = list(G.nodes)
+    n = len(nodes)
+    if n < 2:
+        return pd.DataFrame(columns=['source', 'target', 'stratum', 'stratum_weight'])
+
+    x = np.array([data['x'] for i, data in G.nodes.items()], dtype=float)
+    y = np.array([data['y'] for i, data in G.nodes.items()], dtype=float)
+
+    def _cell(values):
+        extent = values.max() - values.min()
+        if extent == 0:
+            return np.zeros(len(values), dtype=int)
+        return np.minimum(((values - values.min()) / extent * n_strata_per_axis).astype(int), n_strata_per_axis - 1)
+
+    strata = _cell(x) * n_strata_per_axis + _cell(y)
+
+    sample = []
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        n_stratum = max(1, int(round(n_pairs * len(members) / n)))
+        sources = rng.choice(members, n_stratum, replace=True)
+        # draw the targets from all other nodes
+        targets = rng.integers(0, n - 1, n_stratum)
+        targets = targets + (targets >= sources)
+        for source, target in zip(sources, targets):
+            sample.append((nodes[source], nodes[target], stratum, len(members) / n))
+
+    return pd.DataFrame(sample, columns=['source', 'target', 'stratum', 'stratum_weight'])
+
+
+def contract_parallel_edges(G, weight, other_weights=('length',)):
+    """
+    Collapses all parallel edges of a multigraph into single edges of a simple graph, for faster routing.
+    Shortest paths and betweenness centrality on the contracted graph are exactly the same as on the original
+    graph because networkx also uses only the parallel edge with the minimal weight.
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        e.g., a lane graph
+    weight : str
+        the edge attribute used for routing, e.g., 'cost_cycling'
+    other_weights : tuple
+        further edge attributes for routing, their minimum over the parallel edges is kept as well
+
+    Returns
+    -------
+    nx.DiGraph or nx.Graph
+        with the node ids of G, an edge for each pair of adjacent nodes carrying
+        the weights, the **keys** of the parallel edges with the minimal weight and their **multiplicity**
+    """
+
+    H = nx.DiGraph() if G.is_directed() else nx.Graph()
+    H.graph = G.graph
+    # same node and adjacency order as in G, so that the algorithms process them in the same order
+    H.add_nodes_from(G)
+
+    for u, neighbors in G.adjacency():
+        for v, edges in neighbors.items():
+            if H.has_edge(u, v):
+                continue
+            min_weight = min(data.get(weight, 1) for data in edges.values())
+            keys = [key for key, data in edges.items() if data.get(weight, 1) == min_weight]
+            attributes = {weight: min_weight, 'keys': keys, 'multiplicity': len(keys)}
+            for other_weight in other_weights:
+                attributes[other_weight] = min(data.get(other_weight, 1) for data in edges.values())
+            H.add_edge(u, v, **attributes)
+
+    return H
+
+
+def expand_contracted_edge_values(G, H, values):
+    """
+    Distributes values calculated for the edges of a contracted graph back onto the edges of the original graph,
+    e.g., the edge betweenness centrality: each value is divided equally between the parallel edges with
+    the minimal weight, all other parallel edges get 0, as in networkx for multigraphs
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        original graph
+    H : nx.DiGraph or nx.Graph
+        contracted graph from contract_parallel_edges()
+    values : dict
+        {(u, v): value} for the edges of H
+
+    Returns
+    -------
+    dict
+        {(u, v, key): value} for all edges of G
+    """
+
+    edge_values = dict.fromkeys(G.edges, 0.0)
+    for (u, v), value in values.items():
+        keys = H[u][v]['keys']
+        value = value / len(keys)
+        for key in keys:
+            edge_values[(u, v, key)] = value
+    return edge_values
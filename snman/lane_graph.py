@@ -1,110 +1,54 @@
 import copy
 
 from . import osmnx_customized as oxc
-from . import space_allocation, geometry_tools
+from . import space_allocation, geometry_tools, graph, sparse_graph, utils, _errors
 from .constants import *
 import networkx as nx
+import numpy as np
+import pandas as pd
 
 
-def create_lane_graph(G, lanes_attribute=KEY_LANES_DESCRIPTION):
+LANE_SUMMARY_ATTRIBUTES = ('length', 'width', 'twin_factor', 'primary_mode', 'lanetype', 'osm_highway')
+LANE_NUMERICAL_ATTRIBUTES = {'length', 'width', 'twin_factor', 'bc', 'horizontal_position'} | {'cost_' + mode for mode in MODES}
+
+
+def create_lane_graph(G, lanes_attribute=KEY_LANES_DESCRIPTION, as_arrays=False):
     """
     Creates a new lane graph, derived from the street graph
+
+    All lane edges are first calculated as arrays, with the lane properties decoded once per distinct lane
+    and the costs calculated per mode for all lanes at once, then the graph is built in one go.
+
     Parameters
     ----------
     G : nx.MultiDiGraph
         street graph
     lanes_attribute : str
         which attribute should be used for the lane description
+    as_arrays : bool
+        return only the edges of the lane graph as a dict of numpy arrays (u, v, key and the edge attributes),
+        without building a networkx graph, e.g. as an input for lane_sums()
 
     Returns
     -------
-
+    nx.MultiDiGraph or dict
     """
 
+    columns = _lane_graph_edge_arrays(G, lanes_attribute)
+
+    if as_arrays:
+        return columns
+
     # initialize and copy graph attributes
     L = nx.MultiDiGraph()
     L.graph = G.graph
 
-    for uvk, data in G.edges.items():
-        u, v, k = uvk
-
-        lanes_list = data.get(lanes_attribute)
-        # Reconstruct total width of the lanes
-        total_width = 0
-        for lane in data.get(lanes_attribute, []):
-            lp = space_allocation._lane_properties(lane)
-            total_width += lp.width
-
-        filled_width = 0
-        for i, lane in enumerate(lanes_list):
-
-            lp = space_allocation._lane_properties(lane)
-            reverse = lp.direction in {DIRECTION_BACKWARD, DIRECTION_BACKWARD_OPTIONAL}
-
-            if reverse:
-                lane = space_allocation.reverse_lane(lane)
-                lp = space_allocation._lane_properties(lane)
-
-            attributes = {}
-            length = data['length']
-            slope = data.get('grade', 0)
-            lane_id = '-'.join([str(u), str(v), str(k), str(i)])
-            attributes['length'] = length
-
-            for mode in MODES:
-                cost = space_allocation._calculate_lane_cost(lane, length, slope, mode)
-                attributes['cost_' + mode] = cost
-
-            attributes['u_G'] = u
-            attributes['v_G'] = v
-            attributes['k_G'] = k
-            attributes['lane_id_within_street'] = i
-            attributes['horizontal_position'] = filled_width + lp.width/2 - total_width/2
-
-            attributes['primary_mode'] = lp.primary_mode
-            attributes['lane_id'] = lane_id
-            attributes['lanetype'] = lp.lanetype
-            attributes['direction'] = lp.direction
-            attributes['width'] = lp.width
-            attributes['osm_highway'] = data.get('highway')
-            attributes['maxspeed'] = data.get('maxspeed')
-
-            attributes['fixed'] = lp.direction not in [
-                DIRECTION_BACKWARD_OPTIONAL, DIRECTION_FORWARD_OPTIONAL,
-                DIRECTION_TBD, DIRECTION_TBD_OPTIONAL, DIRECTION_BOTH_OPTIONAL
-            ]
-            attributes['mandatory_lane'] = lp.direction not in [
-                DIRECTION_BACKWARD_OPTIONAL, DIRECTION_FORWARD_OPTIONAL,
-                DIRECTION_TBD_OPTIONAL, DIRECTION_BOTH_OPTIONAL
-            ]
-            attributes['coupled_with_opposite_direction'] = lp.direction in [
-                DIRECTION_BOTH, DIRECTION_BOTH_OPTIONAL
-            ]
-
-            if not reverse:
-                L.add_edge(
-                    u, v, lane_id, **attributes, lane=lane, backward=0, twin_factor=1, instance=1,
-                    geometry=data.get('geometry')
-                )
-            if reverse:
-                L.add_edge(
-                    v, u, lane_id, **attributes, lane=lane, backward=1, twin_factor=1, instance=1,
-                    geometry=geometry_tools.reverse_linestring(data.get('geometry'))
-                )
-            if lp.direction in [
-                DIRECTION_BOTH, DIRECTION_BOTH_OPTIONAL, DIRECTION_TBD, DIRECTION_TBD_OPTIONAL
-            ]:
-                L.add_edge(
-                    u, v, lane_id, **attributes, lane=lane, backward=0, twin_factor=0.5, instance=1,
-                    geometry=data.get('geometry')
-                )
-                L.add_edge(
-                    v, u, lane_id, **attributes,
-                    lane=space_allocation.reverse_lane(lane), backward=1, twin_factor=0.5, instance=2,
-                    geometry=geometry_tools.reverse_linestring(data.get('geometry'))
-                )
-
-            filled_width += lp.width
+    attribute_keys = [key for key in columns.keys() if key not in ('u', 'v', 'key')]
+    L.add_edges_from(
+        (u, v, key, dict(zip(attribute_keys, values)))
+        for u, v, key, *values
+        in zip(*[columns[key].tolist() for key in ['u', 'v', 'key'] + attribute_keys])
+    )
 
     # take over the node attributes from the street graph
     nx.set_node_attributes(L, dict(G.nodes))
@@ -112,8 +56,190 @@ def create_lane_graph(G, lanes_attribute=KEY_LANES_DESCRIPTION):
     return L
 
 
+def _lane_graph_edge_arrays(G, lanes_attribute):
+    """
+    a helper for create_lane_graph, returns the lane graph edges as a dict of arrays, in the order of insertion
+    """
 
-def calculate_stats(L, mode):
+    # one entry per lane of each street
+    edges = list(G.edges(keys=True, data=True))
+    edge_index = []
+    lanes = []
+    lane_id_within_street = []
+    for j, (u, v, k, data) in enumerate(edges):
+        for i, lane in enumerate(data.get(lanes_attribute, [])):
+            edge_index.append(j)
+            lanes.append(lane)
+            lane_id_within_street.append(i)
+
+    edge_index = np.array(edge_index, dtype=np.int64)
+    lane_id_within_street = np.array(lane_id_within_street, dtype=np.int64)
+    n_lanes = len(lanes)
+
+    # decode each distinct lane only once
+    lane_codes, distinct_lanes = pd.factorize(pd.Series(lanes, dtype=object))
+    distinct_properties = [_lane_graph_lane_properties(lane) for lane in distinct_lanes]
+
+    def lane_property(key, dtype=object):
+        values = np.empty(len(distinct_properties), dtype=object)
+        values[:] = [properties[key] for properties in distinct_properties]
+        return values[lane_codes].astype(dtype)
+
+    reverse = lane_property('reverse', bool)
+    twin = lane_property('twin', bool)
+
+    # attributes of the streets, for each lane
+    u_G = np.empty(len(edges), dtype=object)
+    u_G[:] = [edge[0] for edge in edges]
+    v_G = np.empty(len(edges), dtype=object)
+    v_G[:] = [edge[1] for edge in edges]
+    k_G = np.empty(len(edges), dtype=object)
+    k_G[:] = [edge[2] for edge in edges]
+    geometries = np.empty(len(edges), dtype=object)
+    geometries[:] = [edge[3].get('geometry') for edge in edges]
+    highways = np.empty(len(edges), dtype=object)
+    highways[:] = [edge[3].get('highway') for edge in edges]
+    maxspeeds = np.empty(len(edges), dtype=object)
+    maxspeeds[:] = [edge[3].get('maxspeed') for edge in edges]
+    lengths = np.array([edge[3]['length'] for edge in edges], dtype=float)
+    slopes = np.array([edge[3].get('grade', 0) for edge in edges], dtype=float)
+
+    # reverse the street geometries only once, and only where needed
+    reversed_geometries = np.empty(len(edges), dtype=object)
+    needs_reversed_geometry = np.zeros(len(edges), dtype=bool)
+    needs_reversed_geometry[edge_index[reverse | twin]] = True
+    reversed_geometries[needs_reversed_geometry] = [
+        geometry_tools.reverse_linestring(geometry) for geometry in geometries[needs_reversed_geometry]
+    ]
+
+    # position of each lane across the street, the lanes of a street are consecutive
+    widths = lane_property('width', float)
+    horizontal_position = np.empty(n_lanes)
+    boundaries = np.flatnonzero(np.diff(edge_index)) + 1
+    for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, n_lanes]):
+        street_widths = widths[start:end].tolist()
+        total_width = sum(street_widths)
+        filled_width = 0
+        for i, width in enumerate(street_widths):
+            horizontal_position[start + i] = filled_width + width / 2 - total_width / 2
+            filled_width += width
+
+    # costs for each mode, vectorized over all lanes
+    length = lengths[edge_index]
+    # the slope is the same for all lanes of a street
+    slope_vod = np.array([CYCLING_SLOPE_VOD(slope) for slope in slopes], dtype=float)[edge_index]
+    costs = {}
+    for mode in MODES:
+        if mode == MODE_CYCLING:
+            cost = length * (1 + lane_property('cycling_vod', float) + slope_vod)
+        else:
+            cost = length
+        costs[mode] = np.where(lane_property('accessible_' + mode, bool), cost, np.inf)
+
+    # each lane becomes one edge, or two edges in opposite directions if it can be used both ways
+    rows = np.repeat(np.arange(n_lanes), np.where(twin, 2, 1))
+    second = np.zeros(len(rows), dtype=bool)
+    second[1:] = rows[1:] == rows[:-1]
+    backward = reverse[rows] | second
+    street = edge_index[rows]
+
+    # int 1 for single lanes and 0.5 for each direction of a twin lane
+    twin_factors = np.empty(len(rows), dtype=object)
+    twin_factors[:] = 1
+    twin_factors[twin[rows]] = 0.5
+
+    lane_ids = np.empty(n_lanes, dtype=object)
+    lane_ids[:] = [
+        '-'.join([str(u_G[j]), str(v_G[j]), str(k_G[j]), str(i)])
+        for j, i in zip(edge_index, lane_id_within_street)
+    ]
+
+    columns = {
+        'u': np.where(backward, v_G[street], u_G[street]),
+        'v': np.where(backward, u_G[street], v_G[street]),
+        'key': lane_ids[rows],
+        'length': length[rows],
+    }
+    for mode in MODES:
+        columns['cost_' + mode] = costs[mode][rows]
+    columns.update({
+        'u_G': u_G[street],
+        'v_G': v_G[street],
+        'k_G': k_G[street],
+        'lane_id_within_street': lane_id_within_street[rows],
+        'horizontal_position': horizontal_position[rows],
+    })
+    columns.update({
+        'primary_mode': lane_property('primary_mode')[rows],
+        'lane_id': lane_ids[rows],
+        'lanetype': lane_property('lanetype')[rows],
+        'direction': lane_property('direction')[rows],
+        'width': lane_property('width')[rows],
+        'osm_highway': highways[street],
+        'maxspeed': maxspeeds[street],
+        'fixed': lane_property('fixed', bool)[rows],
+        'mandatory_lane': lane_property('mandatory_lane', bool)[rows],
+        'coupled_with_opposite_direction': lane_property('coupled_with_opposite_direction', bool)[rows],
+        'lane': np.where(second, lane_property('twin_lane')[rows], lane_property('lane')[rows]),
+        'backward': backward.astype(int),
+        'twin_factor': twin_factors,
+        'instance': np.where(second, 2, 1),
+        'geometry': np.where(backward, reversed_geometries[street], geometries[street]),
+    })
+
+    return columns
+
+
+def _lane_graph_lane_properties(lane):
+    """
+    a helper for create_lane_graph, decodes a lane description into the properties of its lane graph edges
+    """
+
+    lp = space_allocation._lane_properties(lane)
+    reverse = lp.direction in {DIRECTION_BACKWARD, DIRECTION_BACKWARD_OPTIONAL}
+
+    if reverse:
+        lane = space_allocation.reverse_lane(lane)
+        lp = space_allocation._lane_properties(lane)
+
+    twin = lp.direction in [
+        DIRECTION_BOTH, DIRECTION_BOTH_OPTIONAL, DIRECTION_TBD, DIRECTION_TBD_OPTIONAL
+    ]
+
+    properties = {
+        'lane': lane,
+        'twin_lane': space_allocation.reverse_lane(lane) if twin else None,
+        'reverse': reverse,
+        'twin': twin,
+        'primary_mode': lp.primary_mode,
+        'lanetype': lp.lanetype,
+        'direction': lp.direction,
+        'width': lp.width,
+        'cycling_vod': lp.cycling_vod,
+        'fixed': lp.direction not in [
+            DIRECTION_BACKWARD_OPTIONAL, DIRECTION_FORWARD_OPTIONAL,
+            DIRECTION_TBD, DIRECTION_TBD_OPTIONAL, DIRECTION_BOTH_OPTIONAL
+        ],
+        'mandatory_lane': lp.direction not in [
+            DIRECTION_BACKWARD_OPTIONAL, DIRECTION_FORWARD_OPTIONAL,
+            DIRECTION_TBD_OPTIONAL, DIRECTION_BOTH_OPTIONAL
+        ],
+        'coupled_with_opposite_direction': lp.direction in [
+            DIRECTION_BOTH, DIRECTION_BOTH_OPTIONAL
+        ],
+    }
+
+    # same conditions as in space_allocation._calculate_lane_cost, for the forward direction
+    for mode in MODES:
+        properties['accessible_' + mode] = (
+            mode in lp.modes
+            and lp.direction in {DIRECTION_FORWARD}.union(ALTERNATIVE_DIRECTIONS.get(DIRECTION_FORWARD, set()))
+        )
+
+    return properties
+
+
+def calculate_stats(L, mode, engine='networkx', sample_pairs=None, contract=False, bc_sources=100):
     """
     Calculates a set of standardized measures for a lane graph:
 
@@ -142,6 +268,27 @@ def calculate_stats(L, mode):
         lane graph
     mode : str
         for which mode should the stats be calculated, see constants.MODES
+    engine : str
+        - networkx: betweenness centrality and both average shortest paths are calculated separately by networkx
+        - single_sweep: all of them are calculated in one Dijkstra sweep, see graph.shortest_path_metrics(),
+          which takes about a third of the time; note that **avg_shortest_path_km** is then the length
+          along the shortest paths by cost, which only makes a difference for cycling
+        - sparse: the average shortest paths are calculated by scipy.sparse.csgraph, see sparse_graph.SparseGraph,
+          the betweenness centrality by networkx, the results are the same as with networkx
+    sample_pairs : pd.DataFrame
+        a sample of node pairs from graph.sample_node_pairs(),
+        if provided, the engine is ignored and the shortest path statistics are estimated from the sample:
+        the average shortest paths come with standard errors (**avg_shortest_path_vod_km_se**,
+        **avg_shortest_path_km_se**), the betweenness centrality is estimated from some of the sampled sources,
+        and the costs per pair are returned as **_sample**, see stats.compare_sampled_metrics()
+    contract : bool
+        for the engines networkx and sparse, route on a graph where the parallel lanes are contracted
+        into single edges, see graph.contract_parallel_edges(), which gives exactly the same results
+    bc_sources : int
+        only with sample_pairs, the maximal number of sampled sources (drawn at random, but always the same ones
+        for the same sample) used to estimate the betweenness centrality, which needs a full Dijkstra per source;
+        None for all sampled sources, 0 to skip the betweenness centrality (**avg_betweenness_centrality_norm**
+        is then np.nan)
 
     Returns
     -------
@@ -149,117 +296,235 @@ def calculate_stats(L, mode):
 
     """
 
-    L = copy.deepcopy(L)
+    sampled_stats = {}
+
+    if sample_pairs is not None:
+        sample = _evaluate_sample_pairs(L, mode, sample_pairs)
+        # the metrics are only written into a (shallow) copy, to be returned as '_L'
+        L = L.copy()
+        sources = sample['source'].unique()
+        if bc_sources is not None and bc_sources < len(sources):
+            sources = sources[np.sort(np.random.default_rng(0).choice(len(sources), bc_sources, replace=False))]
+        if bc_sources == 0:
+            nx.set_edge_attributes(L, np.nan, 'bc')
+        else:
+            metrics = graph.shortest_path_metrics(L, 'cost_' + mode, 'length', sources=list(sources))
+            nx.set_edge_attributes(L, metrics['edge_betweenness_centrality'], 'bc')
+        avg_shortest_path_vod, avg_shortest_path_vod_se = utils.stratified_mean(
+            sample['cost'], sample['stratum'], sample['stratum_weight']
+        )
+        avg_shortest_path, avg_shortest_path_se = utils.stratified_mean(
+            sample['length'], sample['stratum'], sample['stratum_weight']
+        )
+        sampled_stats = {
+            '_sample': sample,
+            'n_sample_pairs': len(sample),
+            'avg_shortest_path_vod_km_se': round(avg_shortest_path_vod_se / 1000, 3),
+            'avg_shortest_path_km_se': round(avg_shortest_path_se / 1000, 3),
+        }
+
+    elif engine == 'networkx':
+        L = copy.deepcopy(L)
+        routing_graph = graph.contract_parallel_edges(L, 'cost_' + mode) if contract else L
+        # set betweenness centrality
+        bc = nx.edge_betweenness_centrality(routing_graph, normalized=True, weight='cost_'+mode)
+        if contract:
+            bc = graph.expand_contracted_edge_values(L, routing_graph, bc)
+        nx.set_edge_attributes(L, bc, 'bc')
+        avg_shortest_path_vod = nx.average_shortest_path_length(routing_graph, 'cost_' + mode)
+        avg_shortest_path = nx.average_shortest_path_length(routing_graph, 'length')
+
+    elif engine == 'single_sweep':
+        metrics = graph.shortest_path_metrics(L, 'cost_' + mode, 'length')
+        if metrics['n_unreachable_pairs'] > 0:
+            raise nx.NetworkXError('Graph is not strongly connected.')
+        # the metrics are only written into a (shallow) copy, to be returned as '_L'
+        L = L.copy()
+        nx.set_edge_attributes(L, metrics['edge_betweenness_centrality'], 'bc')
+        n_pairs = len(L) * (len(L) - 1)
+        avg_shortest_path_vod = metrics['sum_cost'] / n_pairs if n_pairs > 0 else 0
+        avg_shortest_path = metrics['sum_length'] / n_pairs if n_pairs > 0 else 0
+
+    elif engine == 'sparse':
+        L = copy.deepcopy(L)
+        routing_graph = graph.contract_parallel_edges(L, 'cost_' + mode) if contract else L
+        # set betweenness centrality
+        bc = nx.edge_betweenness_centrality(routing_graph, normalized=True, weight='cost_'+mode)
+        if contract:
+            bc = graph.expand_contracted_edge_values(L, routing_graph, bc)
+        nx.set_edge_attributes(L, bc, 'bc')
+        S = sparse_graph.SparseGraph(routing_graph, weights=('cost_' + mode, 'length'))
+        n_pairs = len(L) * (len(L) - 1)
+        sum_cost, n_unreachable_cost = S.sum_of_distances('cost_' + mode)
+        sum_length, n_unreachable_length = S.sum_of_distances('length')
+        if n_unreachable_cost > 0 or n_unreachable_length > 0:
+            raise nx.NetworkXError('Graph is not strongly connected.')
+        avg_shortest_path_vod = sum_cost / n_pairs if n_pairs > 0 else 0
+        avg_shortest_path = sum_length / n_pairs if n_pairs > 0 else 0
+
+    else:
+        raise _errors.OptionNotImplemented('Engine ' + str(engine) + ' is not valid')
 
     # calculate the approximate area as a convex hull of all nodes
     points_gpd = oxc.graph_to_gdfs(L, edges=False)
     area_km2 = points_gpd.geometry.unary_union.convex_hull.area / pow(1000, 2)
 
-    # set betweenness centrality
-    nx.set_edge_attributes(L, nx.edge_betweenness_centrality(L, normalized=True, weight='cost_'+mode), 'bc')
+    arrays = edge_arrays(L, ('length', 'width', 'twin_factor', 'primary_mode', 'bc'))
+    all_lanes = lane_sums(arrays).loc['total']
+    primary_mode_lanes = lane_sums(arrays, mask=arrays['primary_mode'] == mode).loc['total']
 
-    return {
-        '_L': copy.deepcopy(L),
+    stats = {
+        '_L': L,
         '_mode': mode,
         'usable_N_nodes': len(L.nodes),
-        'usable_N_edges':
-            round(
-                sum(
-                    [
-                        1 * e['twin_factor']
-                        for uvk, e
-                        in L.edges.items()
-                    ]
-                ),
-                3
-            ),
+        'usable_N_edges': round(float(all_lanes['n_edges']), 3),
         'convex_hull_km2': area_km2,
-        'usable_lane_km':
-            round(
-                sum(
-                    [
-                        e['length'] * e['twin_factor']
-                        for uvk, e
-                        in L.edges.items()
-                        if e['width'] > 0
-                    ]
-                ) / 1000,
-                3
-            ),
-        'usable_lane_surface_km2':
-            round(
-                sum(
-                    [
-                        e['length'] * e['width'] * e['twin_factor']
-                        for uvk, e
-                        in L.edges.items()
-                    ]
-                ) / pow(1000, 2),
-                3
-            ),
-        'as_primary_mode_lane_km':
-            round(
-                sum(
-                    [
-                        e['length'] * e['twin_factor'] * (e['primary_mode'] == mode)
-                        for uvk, e
-                        in L.edges.items()
-                        if e['width'] > 0
-                    ]
-                ) / 1000,
-                3
-            ),
-        'as_primary_mode_lane_surface_km2':
-            round(
-                sum(
-                    [
-                        e['length'] * e['width'] * e['twin_factor'] * (e['primary_mode'] == mode)
-                        for uvk, e
-                        in L.edges.items()
-                    ]
-                ) / pow(1000, 2),
-                3
-            ),
-        'as_primary_mode_lane_surface_km2':
-            round(
-                sum(
-                    [
-                        e['length'] * e['width'] * e['twin_factor'] * (e['primary_mode'] == mode)
-                        for uvk, e
-                        in L.edges.items()
-                    ]
-                ) / pow(1000, 2),
-                3
-            ),
+        'usable_lane_km': round(float(all_lanes['lane_km']), 3),
+        'usable_lane_surface_km2': round(float(all_lanes['lane_surface_km2']), 3),
+        'as_primary_mode_lane_km': round(float(primary_mode_lanes['lane_km']), 3),
+        'as_primary_mode_lane_surface_km2': round(float(primary_mode_lanes['lane_surface_km2']), 3),
         'avg_betweenness_centrality_norm':
             round(
-                sum(
-                    [
-                        e['bc'] * e['twin_factor']
-                        for uvk, e
-                        in L.edges.items()
-                    ]
-                ) /
-                sum(
-                    [
-                        e['twin_factor']
-                        for uvk, e
-                        in L.edges.items()
-                    ]
-                ),
+                float(np.sum(arrays['bc'] * arrays['twin_factor']) / np.sum(arrays['twin_factor'])),
                 5
             ),
         'avg_shortest_path_vod_km':
             round(
-                nx.average_shortest_path_length(L, 'cost_' + mode) / 1000,
+                avg_shortest_path_vod / 1000,
                 3
             ),
         'avg_shortest_path_km':
             round(
-                nx.average_shortest_path_length(L, 'length') / 1000,
+                avg_shortest_path / 1000,
                 3
             ),
     }
+    stats.update(sampled_stats)
+
+    return stats
+
+
+def edge_arrays(L, attributes=LANE_SUMMARY_ATTRIBUTES):
+    """
+    Extracts edge attributes of a lane graph into numpy arrays, all in the order of L.edges,
+    as an input for lane_sums() or other vectorized calculations
+
+    Parameters
+    ----------
+    L : nx.MultiDiGraph
+        lane graph
+    attributes : tuple
+        edge attributes to be extracted, numerical ones (see LANE_NUMERICAL_ATTRIBUTES) become float arrays,
+        all others object arrays, missing values become np.nan or None
+
+    Returns
+    -------
+    dict
+        attribute -> np.ndarray
+    """
+
+    edges = [data for u, v, data in L.edges(data=True)]
+    arrays = {}
+    for attribute in attributes:
+        if attribute in LANE_NUMERICAL_ATTRIBUTES:
+            arrays[attribute] = np.fromiter(
+                (data.get(attribute, np.nan) for data in edges), dtype=float, count=len(edges)
+            )
+        else:
+            values = np.empty(len(edges), dtype=object)
+            values[:] = [data.get(attribute) for data in edges]
+            arrays[attribute] = values
+    return arrays
+
+
+def lane_sums(arrays, by=None, mask=None):
+    """
+    Sums up the lanes of a lane graph, e.g., the lane km by lanetype:
+
+        * **n_edges**: number of lanes, lanes in both directions count once
+        * **lane_km**: length of the lanes with a width > 0
+        * **lane_surface_km2**: surface of the lanes
+
+    Parameters
+    ----------
+    arrays : dict or nx.MultiDiGraph
+        edge attributes from edge_arrays(), must include length, width, twin_factor and the attribute in by,
+        or a lane graph to extract them from
+    by : str
+        edge attribute to group by, e.g., 'lanetype', 'primary_mode' or 'osm_highway',
+        if None, a single row 'total' is returned
+    mask : np.ndarray
+        only sum up the lanes where the mask is True, e.g., arrays['primary_mode'] == MODE_CYCLING
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+
+    if isinstance(arrays, nx.Graph):
+        arrays = edge_arrays(arrays, ('length', 'width', 'twin_factor') + ((by,) if by else ()))
+
+    length = np.asarray(arrays['length'], dtype=float)
+    width = np.asarray(arrays['width'], dtype=float)
+    twin_factor = np.asarray(arrays['twin_factor'], dtype=float)
+    if mask is None:
+        mask = np.ones(len(length), dtype=bool)
+
+    if by is None:
+        codes = np.zeros(len(length), dtype=int)
+        groups = ['total']
+    else:
+        codes, groups = pd.factorize(arrays[by])
+        groups = list(groups)
+        if (codes < 0).any():
+            # missing values form their own group
+            codes = np.where(codes < 0, len(groups), codes)
+            groups.append(None)
+
+    codes = codes[mask]
+    n_groups = len(groups)
+    return pd.DataFrame(
+        {
+            'n_edges': np.bincount(codes, weights=twin_factor[mask], minlength=n_groups),
+            'lane_km':
+                np.bincount(codes, weights=(length * twin_factor * (width > 0))[mask], minlength=n_groups) / 1000,
+            'lane_surface_km2':
+                np.bincount(codes, weights=(length * width * twin_factor)[mask], minlength=n_groups) / pow(1000, 2),
+        },
+        index=pd.Index(groups, name=by)
+    )
+
+
+def _evaluate_sample_pairs(L, mode, sample_pairs, max_matrix_entries=10_000_000):
+    """
+    Calculates the shortest path cost and length for each sampled node pair,
+    pairs with a node outside the lane graph or without a path are left out;
+    the sources are searched from in chunks, so that each distance matrix (sources x nodes)
+    has at most max_matrix_entries entries
+    """
+
+    S = sparse_graph.SparseGraph(L, weights=('cost_' + mode, 'length'))
+    chunk_size = max(1, max_matrix_entries // max(len(S.nodes), 1))
+    sample = sample_pairs[
+        sample_pairs['source'].isin(S.node_index.keys())
+        & sample_pairs['target'].isin(S.node_index.keys())
+    ].copy()
+
+    sample['cost'] = np.inf
+    sample['length'] = np.inf
+    sources = sample['source'].unique()
+
+    # run the shortest paths in chunks of sources to limit the memory
+    for start in range(0, len(sources), chunk_size):
+        chunk = sources[start:start + chunk_size]
+        in_chunk = sample['source'].isin(chunk).to_numpy()
+        rows = sample.loc[in_chunk, 'source'].map({source: i for i, source in enumerate(chunk)}).to_numpy()
+        columns = S.indices(sample.loc[in_chunk, 'target'])
+        for weight, column in [('cost_' + mode, 'cost'), ('length', 'length')]:
+            distances = S.distances(weight, sources=chunk)
+            sample.loc[in_chunk, column] = distances[rows, columns]
+
+    return sample[np.isfinite(sample['cost']) & np.isfinite(sample['length'])]
 
 
 def get_street_lanes(L, u_G, v_G, k_G, direction=None):
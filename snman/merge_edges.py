@@ -1,4 +1,5 @@
 import networkx as nx
+from . import osmnx_customized as oxc
 from . import graph, geometry_tools, utils, street_graph, space_allocation
 from. constants import *
 from shapely import geometry, ops
@@ -262,7 +263,7 @@ def _merge_given_consecutive_edges(G, edge_chain, distinction_attributes):
         # Create a new merged edge
         u = edge_subchain[0][0]
         v = edge_subchain[-1][1]
-        G.add_edge(u, v, **merged_data)
+        oxc.stats.add_edge(G, u, v, **merged_data)
 
         # Delete the old edges
         for edge in edge_subchain:
@@ -314,9 +315,9 @@ def reconstruct_consecutive_edges(G):
             this_data = copy.copy(data)
             this_data['geometry'] = shapely.LineString((points[i], points[i+1]))
             this_data['length'] = None
-            G.add_edge(nodes[i], nodes[i+1], **this_data)
+            oxc.stats.add_edge(G, nodes[i], nodes[i+1], **this_data)
 
-        G.remove_edge(u, v, k)
+        oxc.stats.remove_edge(G, u, v, k)
 
 
 def reset_intermediate_nodes(G):
@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+from . import accessibility, sparse_graph, _errors
+
+
+def od_cost_matrix(
+        G, origins, destinations,
+        weights=('length',), return_paths=False, max_distance=None, max_cost=np.inf, chunk_size=500, S=None
+):
+    """
+    Travel costs between all origins and all destinations, e.g. zone centroids for a demand model.
+    Origins and destinations are snapped to the nodes once, then the costs for each weight are calculated
+    with one Dijkstra run per distinct origin node, in chunks, using scipy.sparse.csgraph.
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        street graph or lane graph, the nodes need x and y coordinates
+    origins : gpd.GeoDataFrame or gpd.GeoSeries
+        in the same crs as the graph
+    destinations : gpd.GeoDataFrame or gpd.GeoSeries
+        in the same crs as the graph
+    weights : tuple
+        edge attributes used as costs, e.g. 'length' or, for a lane graph, 'cost_cycling', 'cost_private_cars'
+    return_paths : bool
+        also return the shortest paths as positions of their edges in the returned list of edges
+    max_distance : float
+        origins and destinations farther away from any node will not be snapped, their costs are np.nan
+    max_cost : float
+        do not search beyond this cost, pairs further apart get np.inf
+    chunk_size : int
+        number of origin nodes searched from at once, to limit the memory
+    S : sparse_graph.SparseGraph
+        compiled graph with the weights, to reuse it across calls
+
+    Returns
+    -------
+    dict
+        * **origins**, **destinations**: the index of the origins and destinations
+        * **origin_nodes**, **destination_nodes**: the node each of them is snapped to, None if not snapped
+        * **costs**: for each weight, a matrix (origins x destinations)
+        * **paths**: only if return_paths=True, for each weight, the paths in compressed form:
+          the edges of the path between origin i and destination j are
+          edges[offsets[i * n_destinations + j]:offsets[i * n_destinations + j + 1]]
+        * **edges**: only if return_paths=True, the edge ids (u, v, key) that the paths refer to
+    """
+
+    if S is None:
+        S = sparse_graph.SparseGraph(G, weights=weights)
+
+    origin_nodes = accessibility.snap_pois_to_nodes(G, origins, max_distance=max_distance)['node']
+    destination_nodes = accessibility.snap_pois_to_nodes(G, destinations, max_distance=max_distance)['node']
+
+    # matrix indices, -1 for origins and destinations that could not be snapped
+    origin_indices = np.array(
+        [S.node_index[node] if node is not None else -1 for node in origin_nodes], dtype=np.int64
+    )
+    destination_indices = np.array(
+        [S.node_index[node] if node is not None else -1 for node in destination_nodes], dtype=np.int64
+    )
+    # search only once from each distinct origin node
+    source_indices, origin_rows = np.unique(origin_indices[origin_indices >= 0], return_inverse=True)
+    snapped_origins = np.flatnonzero(origin_indices >= 0)
+    snapped_destinations = np.flatnonzero(destination_indices >= 0)
+
+    result = {
+        'origins': np.asarray(origin_nodes.index),
+        'destinations': np.asarray(destination_nodes.index),
+        'origin_nodes': origin_nodes.to_numpy(),
+        'destination_nodes': destination_nodes.to_numpy(),
+        'costs': {},
+    }
+    if return_paths:
+        result['paths'] = {}
+        result['edges'] = S.edges
+
+    for weight in weights:
+        costs = np.full((len(origin_indices), len(destination_indices)), np.nan)
+        paths = [[np.array([], dtype=np.int64)] * len(destination_indices) for i in range(len(origin_indices))]
+
+        for start in range(0, len(source_indices), chunk_size):
+            chunk = source_indices[start:start + chunk_size]
+            distances = S.distances(
+                weight, sources=[S.nodes[i] for i in chunk], return_predecessors=return_paths, limit=max_cost
+            )
+            if return_paths:
+                distances, predecessors = distances
+
+            in_chunk = (origin_rows >= start) & (origin_rows < start + chunk_size)
+            for origin, row in zip(snapped_origins[in_chunk], origin_rows[in_chunk] - start):
+                costs[origin, snapped_destinations] = distances[row, destination_indices[snapped_destinations]]
+                if return_paths:
+                    for destination in snapped_destinations:
+                        paths[origin][destination] = S.edge_path(
+                            weight, predecessors[row], destination_indices[destination]
+                        )
+
+        result['costs'][weight] = costs
+        if return_paths:
+            paths = [path for origin_paths in paths for path in origin_paths]
+            result['paths'][weight] = {
+                'offsets': np.concatenate([[0], np.cumsum([len(path) for path in paths])]).astype(np.int64),
+                'edges': np.concatenate(paths) if len(paths) > 0 else np.array([], dtype=np.int64),
+            }
+
+    return result
+
+
+def od_matrix_to_dataframe(od_matrix):
+    """
+    Converts the result of od_cost_matrix() into a long table with one row per origin-destination pair
+    and a column for the costs of each weight, e.g. for saving it with export_od_matrix()
+
+    Parameters
+    ----------
+    od_matrix : dict
+        result of od_cost_matrix()
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+
+    n_origins = len(od_matrix['origins'])
+    n_destinations = len(od_matrix['destinations'])
+    df = pd.DataFrame({
+        'origin': np.repeat(od_matrix['origins'], n_destinations),
+        'destination': np.tile(od_matrix['destinations'], n_origins),
+    })
+    for weight, costs in od_matrix['costs'].items():
+        df[weight] = costs.ravel()
+    return df
+
+
+def export_od_matrix(od_matrix, path):
+    """
+    Saves the result of od_cost_matrix(), either as a compressed numpy archive (.npz) with the matrices
+    and paths as they are, or as a long table in a Parquet file (.parquet, requires pyarrow or fastparquet)
+
+    Parameters
+    ----------
+    od_matrix : dict
+        result of od_cost_matrix()
+    path : str
+        file path ending with .npz or .parquet
+
+    Returns
+    -------
+    None
+    """
+
+    if path.endswith('.npz'):
+        arrays = {
+            'origins': od_matrix['origins'],
+            'destinations': od_matrix['destinations'],
+        }
+        for weight, costs in od_matrix['costs'].items():
+            arrays['costs_' + weight] = costs
+        for weight, paths in od_matrix.get('paths', {}).items():
+            arrays['path_offsets_' + weight] = paths['offsets']
+            arrays['path_edges_' + weight] = paths['edges']
+        if 'edges' in od_matrix:
+            arrays['edges'] = np.array([str(edge) for edge in od_matrix['edges']])
+        np.savez_compressed(path, **arrays)
+
+    elif path.endswith('.parquet'):
+        od_matrix_to_dataframe(od_matrix).to_parquet(path)
+
+    else:
+        raise _errors.OptionNotImplemented('File format of ' + str(path) + ' is not valid, use .npz or .parquet')
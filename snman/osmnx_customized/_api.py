@@ -6,8 +6,10 @@ from .bearing import plot_orientation
 from .distance import k_shortest_paths
 from .distance import nearest_edges
 from .distance import nearest_nodes
+from .distance import spatial_index
 from .distance import shortest_path
 from .elevation import add_edge_grades
+from .elevation import add_edge_grades_raster
 from .elevation import add_node_elevations_google
 from .elevation import add_node_elevations_raster
 from .folium import plot_graph_folium
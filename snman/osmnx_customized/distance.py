@@ -1,17 +1,16 @@
 """Calculate distances and shortest paths and find nearest node/edge(s) to point(s)."""
 
+import hashlib
 import itertools
 import multiprocessing as mp
 
 import networkx as nx
 import numpy as np
 import pandas as pd
-from rtree.index import Index as RTreeIndex
-from shapely.geometry import Point
+import shapely
 
 from . import projection
 from . import utils
-from . import utils_geo
 from . import utils_graph
 
 # scipy is optional dependency for projected nearest-neighbor search
@@ -28,6 +27,9 @@ except ImportError:  # pragma: no cover
 
 EARTH_RADIUS_M = 6_371_009
 
+# graph attribute that holds the cached spatial index
+SPATIAL_INDEX_KEY = "_spatial_index"
+
 
 def great_circle_vec(lat1, lng1, lat2, lng2, earth_radius=EARTH_RADIUS_M):
     """
@@ -159,6 +161,402 @@ def add_edge_lengths(G, precision=3, edges=None):
     return G
 
 
+class SpatialIndex:
+    """
+    Spatial index over a graph's nodes and edges for batched nearest queries.
+
+    The node coordinates, edge IDs and edge geometries are copied from the
+    graph when the index is created, the search trees are built lazily on the
+    first query and kept for the following ones. Queries can be restricted to
+    a subset of the nodes or edges with a boolean mask, e.g. the edges on one
+    layer or accessible to one mode, a search tree is built and kept for each
+    distinct mask. The index can be pickled, e.g. to pass it to worker
+    processes, the search trees are left out and rebuilt there when needed.
+
+    Use `spatial_index` to get the index cached in the graph rather than
+    creating a new one each time.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        graph to index, edges without a geometry get a straight line between
+        their nodes
+    """
+
+    # number of search trees for distinct masks to keep at most
+    max_trees = 16
+
+    def __init__(self, G):
+        self.crs = G.graph["crs"]
+        self.projected = projection.is_projected(self.crs)
+        self.node_ids, self.node_xy = _index_nodes(G)
+        self.edge_ids, self.edge_geometries = _index_edges(G, self.node_ids, self.node_xy)
+        self.node_fingerprint = _fingerprint_nodes(self.crs, self.node_ids, self.node_xy)
+        self.edge_fingerprint = _fingerprint_edges(self.edge_ids, self.edge_geometries)
+        self._trees = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_trees"] = dict()
+        return state
+
+    def _tree(self, kind, mask, build):
+        """
+        Get a search tree from the cache or build and cache it.
+
+        Parameters
+        ----------
+        kind : tuple
+            what the tree indexes, e.g. ("nodes",) or ("vertices", interpolate)
+        mask : numpy.ndarray or None
+            boolean mask of the nodes or edges to index, None for all
+        build : function
+            builds the tree from the positions of the nodes or edges to index
+
+        Returns
+        -------
+        tree, positions : tuple
+        """
+        key = kind if mask is None else kind + (np.packbits(mask).tobytes(),)
+        if key not in self._trees:
+            if len(self._trees) >= self.max_trees:
+                self._trees.pop(next(iter(self._trees)))
+            n = len(self.node_ids) if kind[0] == "nodes" else len(self.edge_ids)
+            positions = np.arange(n) if mask is None else np.flatnonzero(mask)
+            self._trees[key] = build(positions), positions
+        return self._trees[key]
+
+    def _point_tree(self, xy):
+        """
+        Build a k-d tree, or a ball tree if unprojected, over points.
+
+        Parameters
+        ----------
+        xy : numpy.ndarray
+            points' x and y coordinates
+
+        Returns
+        -------
+        tree : scipy.spatial.cKDTree or sklearn.neighbors.BallTree
+        """
+        if self.projected:
+            if cKDTree is None:  # pragma: no cover
+                raise ImportError("scipy must be installed to search a projected graph")
+            return cKDTree(xy)
+        else:
+            if BallTree is None:  # pragma: no cover
+                raise ImportError("scikit-learn must be installed to search an unprojected graph")
+            # haversine requires lat, lng coords in radians
+            return BallTree(np.deg2rad(xy[:, ::-1]), metric="haversine")
+
+    def _query_point_tree(self, tree, X, Y, max_distance):
+        """
+        Query the nearest point in a tree built by `_point_tree`.
+
+        Returns
+        -------
+        pos, dist : tuple
+            positions in the tree, -1 if none is within `max_distance`, and
+            distances, NaN if none is within `max_distance`
+        """
+        if tree is None:
+            return np.full(len(X), -1), np.full(len(X), np.nan)
+        if self.projected:
+            upper_bound = np.inf if max_distance is None else max_distance
+            dist, pos = tree.query(np.array([X, Y]).T, k=1, distance_upper_bound=upper_bound)
+        else:
+            dist, pos = tree.query(np.deg2rad(np.array([Y, X]).T), k=1)
+            dist = dist[:, 0] * EARTH_RADIUS_M  # convert radians -> meters
+            pos = pos[:, 0]
+        found = np.isfinite(dist)
+        if max_distance is not None:
+            found &= dist <= max_distance
+        return np.where(found, pos, -1), np.where(found, dist, np.nan)
+
+    def query_nodes(self, X, Y, mask=None, max_distance=None):
+        """
+        Find the nearest node to each of several points.
+
+        Parameters
+        ----------
+        X : list or numpy.ndarray
+            points' x (longitude) coordinates, in same CRS/units as graph
+        Y : list or numpy.ndarray
+            points' y (latitude) coordinates, in same CRS/units as graph
+        mask : numpy.ndarray
+            boolean mask over `node_ids` of the nodes to consider, None for
+            all nodes
+        max_distance : float
+            points farther away from any node are not matched
+
+        Returns
+        -------
+        pos, dist : tuple of numpy.ndarray
+            positions of the nearest nodes in `node_ids`, -1 for the points
+            that were not matched, and the distances, in meters if the graph
+            is unprojected, NaN for the points that were not matched
+        """
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        tree, positions = self._tree(
+            ("nodes",),
+            mask,
+            lambda positions: self._point_tree(self.node_xy[positions]) if len(positions) else None,
+        )
+        pos, dist = self._query_point_tree(tree, X, Y, max_distance)
+        found = pos >= 0
+        pos[found] = positions[pos[found]]
+        return pos, dist
+
+    def query_edges(
+        self, X, Y, mask=None, max_distance=None, interpolate=None, return_position=False
+    ):
+        """
+        Find the nearest edge to each of several points.
+
+        If `interpolate` is None, search the edge geometries with an STRtree,
+        which is exact and uses the euclidean distance in the graph's units.
+        Otherwise, search points interpolated along the edges with a k-d tree,
+        or a ball tree for haversine distances if the graph is unprojected.
+
+        Parameters
+        ----------
+        X : list or numpy.ndarray
+            points' x (longitude) coordinates, in same CRS/units as graph
+        Y : list or numpy.ndarray
+            points' y (latitude) coordinates, in same CRS/units as graph
+        mask : numpy.ndarray
+            boolean mask over `edge_ids` of the edges to consider, None for
+            all edges
+        max_distance : float
+            points farther away from any edge are not matched
+        interpolate : float
+            spacing distance between interpolated points, in same units as
+            graph. smaller values generate more points.
+        return_position : bool
+            also return the position of the point projected onto the edge, as
+            distance from the start of the edge geometry
+
+        Returns
+        -------
+        pos, dist or pos, dist, position : tuple of numpy.ndarray
+            positions of the nearest edges in `edge_ids`, -1 for the points
+            that were not matched, the distances and the positions along the
+            edges, NaN for the points that were not matched
+        """
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+
+        if interpolate is None:
+            tree, positions = self._tree(
+                ("edges",),
+                mask,
+                lambda positions: shapely.STRtree(self.edge_geometries[positions]),
+            )
+            pos = np.full(len(X), -1)
+            dist = np.full(len(X), np.nan)
+            if len(positions) > 0 and len(X) > 0:
+                (point_idx, edge_idx), distances = tree.query_nearest(
+                    shapely.points(X, Y),
+                    max_distance=max_distance,
+                    return_distance=True,
+                    all_matches=False,
+                )
+                pos[point_idx] = positions[edge_idx]
+                dist[point_idx] = distances
+
+        else:
+            (tree, vertex_edges), positions = self._tree(
+                ("vertices", interpolate), mask, self._build_vertex_tree(interpolate)
+            )
+            pos, dist = self._query_point_tree(tree, X, Y, max_distance)
+            found = pos >= 0
+            pos[found] = vertex_edges[pos[found]]
+
+        if not return_position:
+            return pos, dist
+
+        position = np.full(len(X), np.nan)
+        found = pos >= 0
+        position[found] = shapely.line_locate_point(
+            self.edge_geometries[pos[found]], shapely.points(X[found], Y[found])
+        )
+        return pos, dist, position
+
+    def _build_vertex_tree(self, interpolate):
+        """
+        Make a function that builds the tree of interpolated edge points.
+
+        Parameters
+        ----------
+        interpolate : float
+            spacing distance between interpolated points
+
+        Returns
+        -------
+        build : function
+            builds the tree and the edge position of each of its points from
+            the positions of the edges to index
+        """
+
+        def build(positions):
+            geoms = self.edge_geometries[positions]
+            # same spacing as utils_geo.interpolate_points
+            num_vert = np.maximum(np.round(shapely.length(geoms) / interpolate), 1).astype(int)
+            vertex_edges = np.repeat(positions, num_vert + 1)
+            starts = np.repeat(np.cumsum(num_vert + 1) - num_vert - 1, num_vert + 1)
+            n = np.arange(len(vertex_edges)) - starts
+            points = shapely.line_interpolate_point(
+                np.repeat(geoms, num_vert + 1), n / np.repeat(num_vert, num_vert + 1), normalized=True
+            )
+            xy = shapely.get_coordinates(points)
+            return (self._point_tree(xy) if len(xy) else None), vertex_edges
+
+        return build
+
+
+def _index_nodes(G):
+    """
+    Get the node IDs and coordinates of a graph as arrays.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+
+    Returns
+    -------
+    node_ids, node_xy : tuple of numpy.ndarray
+    """
+    node_ids = np.empty(len(G), dtype=object)
+    node_ids[:] = list(G.nodes)
+    node_xy = np.array([(data["x"], data["y"]) for _, data in G.nodes(data=True)], dtype=float)
+    return node_ids, node_xy.reshape(-1, 2)
+
+
+def _index_edges(G, node_ids, node_xy):
+    """
+    Get the edge IDs and geometries of a graph as arrays.
+
+    Edges without a geometry get a straight line between their nodes, like
+    in `utils_graph.graph_to_gdfs`.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+    node_ids : numpy.ndarray
+        node IDs, see `_index_nodes`
+    node_xy : numpy.ndarray
+        node coordinates, see `_index_nodes`
+
+    Returns
+    -------
+    edge_ids, edge_geometries : tuple of numpy.ndarray
+    """
+    uvkg = [(u, v, k, geom) for u, v, k, geom in G.edges(keys=True, data="geometry")]
+    edge_ids = np.empty(len(uvkg), dtype=object)
+    edge_ids[:] = [(u, v, k) for u, v, k, _ in uvkg]
+    edge_geometries = np.empty(len(uvkg), dtype=object)
+    edge_geometries[:] = [geom for _, _, _, geom in uvkg]
+
+    missing = np.flatnonzero(pd.isna(edge_geometries))
+    if len(missing) > 0:
+        node_pos = {node: pos for pos, node in enumerate(node_ids)}
+        u_xy = node_xy[[node_pos[uvkg[i][0]] for i in missing]]
+        v_xy = node_xy[[node_pos[uvkg[i][1]] for i in missing]]
+        edge_geometries[missing] = shapely.linestrings(np.stack([u_xy, v_xy], axis=1))
+    return edge_ids, edge_geometries
+
+
+def _fingerprint_nodes(crs, node_ids, node_xy):
+    """
+    Hash the CRS, node IDs and node coordinates of a graph.
+
+    The hash of string IDs differs between processes, there an index that was
+    pickled with its graph is rebuilt once.
+
+    Returns
+    -------
+    fingerprint : string
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((crs, hash(tuple(node_ids)))).encode())
+    h.update(np.ascontiguousarray(node_xy).tobytes())
+    return h.hexdigest()
+
+
+def _fingerprint_edges(edge_ids, edge_geometries):
+    """
+    Hash the edge IDs and edge geometries' coordinates of a graph.
+
+    Returns
+    -------
+    fingerprint : string
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(hash(tuple(edge_ids))).encode())
+    h.update(shapely.get_num_coordinates(edge_geometries).tobytes())
+    h.update(shapely.get_coordinates(edge_geometries).tobytes())
+    return h.hexdigest()
+
+
+def spatial_index(G, validate=True, edges=True):
+    """
+    Get the graph's spatial index, cached in its graph attributes.
+
+    The index is created on the first call and kept in `G.graph`. Later calls
+    return the same index with its search trees as long as the graph's nodes,
+    edges and geometries have not changed, otherwise a new index replaces it.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        graph to index
+    validate : bool
+        if True, check if the cached index still matches the graph, which
+        costs one pass over its nodes and edges. if False, use the cached
+        index without checking, e.g. in a loop that does not modify the graph
+    edges : bool
+        if False, check only the nodes, which is enough for node queries
+
+    Returns
+    -------
+    index : SpatialIndex
+    """
+    cached = G.graph.get(SPATIAL_INDEX_KEY)
+    if cached is not None and not validate:
+        return cached
+
+    if cached is not None:
+        node_ids, node_xy = _index_nodes(G)
+        if cached.node_fingerprint == _fingerprint_nodes(G.graph["crs"], node_ids, node_xy) and (
+            not edges
+            or cached.edge_fingerprint == _fingerprint_edges(*_index_edges(G, node_ids, node_xy))
+        ):
+            return cached
+
+    index = SpatialIndex(G)
+    G.graph[SPATIAL_INDEX_KEY] = index
+    return index
+
+
+def invalidate_spatial_index(G):
+    """
+    Remove the cached spatial index from the graph's attributes.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+
+    Returns
+    -------
+    None
+    """
+    G.graph.pop(SPATIAL_INDEX_KEY, None)
+
+
 def nearest_nodes(G, X, Y, return_dist=False):
     """
     Find the nearest node to a point or to each of several points.
@@ -171,7 +569,8 @@ def nearest_nodes(G, X, Y, return_dist=False):
     neighbor search, which requires that scipy is installed as an optional
     dependency. If it is unprojected, this uses a ball tree for haversine
     nearest neighbor search, which requires that scikit-learn is installed as
-    an optional dependency.
+    an optional dependency. The tree is cached in the graph, see
+    `spatial_index`, so repeated calls on an unchanged graph reuse it.
 
     Parameters
     ----------
@@ -201,25 +600,11 @@ def nearest_nodes(G, X, Y, return_dist=False):
 
     if np.isnan(X).any() or np.isnan(Y).any():  # pragma: no cover
         raise ValueError("`X` and `Y` cannot contain nulls")
-    nodes = utils_graph.graph_to_gdfs(G, edges=False, node_geometry=False)[["x", "y"]]
-
-    if projection.is_projected(G.graph["crs"]):
-        # if projected, use k-d tree for euclidean nearest-neighbor search
-        if cKDTree is None:  # pragma: no cover
-            raise ImportError("scipy must be installed to search a projected graph")
-        dist, pos = cKDTree(nodes).query(np.array([X, Y]).T, k=1)
-        nn = nodes.index[pos]
 
-    else:
-        # if unprojected, use ball tree for haversine nearest-neighbor search
-        if BallTree is None:  # pragma: no cover
-            raise ImportError("scikit-learn must be installed to search an unprojected graph")
-        # haversine requires lat, lng coords in radians
-        nodes_rad = np.deg2rad(nodes[["y", "x"]])
-        points_rad = np.deg2rad(np.array([Y, X]).T)
-        dist, pos = BallTree(nodes_rad, metric="haversine").query(points_rad, k=1)
-        dist = dist[:, 0] * EARTH_RADIUS_M  # convert radians -> meters
-        nn = nodes.index[pos[:, 0]]
+    # the index and its tree are cached in the graph for subsequent calls
+    index = spatial_index(G, edges=False)
+    pos, dist = index.query_nodes(X, Y)
+    nn = index.node_ids[pos]
 
     # convert results to correct types for return
     nn = nn.tolist()
@@ -242,11 +627,10 @@ def nearest_edges(G, X, Y, interpolate=None, return_dist=False):
     edge to that point. If `X` and `Y` are lists of coordinate values, this
     will return the nearest edge to each point.
 
-    If `interpolate` is None, search for the nearest edge to each point, one
-    at a time, using an r-tree and minimizing the euclidean distances from the
-    point to the possible matches. For accuracy, use a projected graph and
-    points. This method is precise and also fastest if searching for few
-    points relative to the graph's size.
+    If `interpolate` is None, search for the nearest edge to each point using
+    an STRtree of the edge geometries and the euclidean distances from the
+    points to the edges. For accuracy, use a projected graph and points. This
+    method is precise.
 
     For a faster method if searching for many points relative to the graph's
     size, use the `interpolate` argument to interpolate points along the edges
@@ -256,6 +640,9 @@ def nearest_edges(G, X, Y, interpolate=None, return_dist=False):
     for haversine nearest neighbor search, which requires that scikit-learn is
     installed as an optional dependency.
 
+    The trees are cached in the graph, see `spatial_index`, so repeated calls
+    on an unchanged graph reuse them.
+
     Parameters
     ----------
     G : networkx.MultiDiGraph
@@ -287,51 +674,11 @@ def nearest_edges(G, X, Y, interpolate=None, return_dist=False):
 
     if np.isnan(X).any() or np.isnan(Y).any():  # pragma: no cover
         raise ValueError("`X` and `Y` cannot contain nulls")
-    geoms = utils_graph.graph_to_gdfs(G, nodes=False)["geometry"]
-
-    # if no interpolation distance was provided
-    if interpolate is None:
-
-        # build the r-tree spatial index by position for subsequent iloc
-        rtree = RTreeIndex()
-        for pos, bounds in enumerate(geoms.bounds.values):
-            rtree.insert(pos, bounds)
 
-        # use r-tree to find possible nearest neighbors, one point at a time,
-        # then minimize euclidean distance from point to the possible matches
-        ne_dist = list()
-        for xy in zip(X, Y):
-            dists = geoms.iloc[list(rtree.nearest(xy, num_results=10))].distance(Point(xy))
-            ne_dist.append((dists.idxmin(), dists.min()))
-        ne, dist = zip(*ne_dist)
-
-    # otherwise, if interpolation distance was provided
-    else:
-
-        # interpolate points along edges to index with k-d tree or ball tree
-        uvk_xy = list()
-        for uvk, geom in zip(geoms.index, geoms.values):
-            uvk_xy.extend((uvk, xy) for xy in utils_geo.interpolate_points(geom, interpolate))
-        labels, xy = zip(*uvk_xy)
-        vertices = pd.DataFrame(xy, index=labels, columns=["x", "y"])
-
-        if projection.is_projected(G.graph["crs"]):
-            # if projected, use k-d tree for euclidean nearest-neighbor search
-            if cKDTree is None:  # pragma: no cover
-                raise ImportError("scipy must be installed to search a projected graph")
-            dist, pos = cKDTree(vertices).query(np.array([X, Y]).T, k=1)
-            ne = vertices.index[pos]
-
-        else:
-            # if unprojected, use ball tree for haversine nearest-neighbor search
-            if BallTree is None:  # pragma: no cover
-                raise ImportError("scikit-learn must be installed to search an unprojected graph")
-            # haversine requires lat, lng coords in radians
-            vertices_rad = np.deg2rad(vertices[["y", "x"]])
-            points_rad = np.deg2rad(np.array([Y, X]).T)
-            dist, pos = BallTree(vertices_rad, metric="haversine").query(points_rad, k=1)
-            dist = dist[:, 0] * EARTH_RADIUS_M  # convert radians -> meters
-            ne = vertices.index[pos[:, 0]]
+    # the index and its trees are cached in the graph for subsequent calls
+    index = spatial_index(G)
+    pos, dist = index.query_edges(X, Y, interpolate=interpolate)
+    ne = index.edge_ids[pos]
 
     # convert results to correct types for return
     ne = list(ne)
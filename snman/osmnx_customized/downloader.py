@@ -1,12 +1,16 @@
 """Interact with the OSM APIs."""
 
 import datetime as dt
+import gzip
 import json
 import logging as lg
 import re
 import socket
+import sqlite3
 import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from hashlib import sha1
 from pathlib import Path
 from urllib.parse import urlparse
@@ -24,6 +28,9 @@ from ._errors import CacheOnlyModeInterrupt
 # capture getaddrinfo function to use original later after mutating it
 _original_getaddrinfo = socket.getaddrinfo
 
+# name of the cache database file in settings.cache_folder
+_CACHE_DB_FILENAME = "cache.sqlite"
+
 
 def _get_osm_filter(network_type):
     """
@@ -107,15 +114,119 @@ def _get_osm_filter(network_type):
     return osm_filter
 
 
+def _cache_connection():
+    """
+    Open the SQLite database of the cache, creating it if it doesn't exist.
+
+    Returns
+    -------
+    connection : sqlite3.Connection
+    """
+    cache_folder = Path(settings.cache_folder)
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(cache_folder / _CACHE_DB_FILENAME, timeout=60)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, url TEXT, created REAL, last_access REAL, bytes INTEGER, data BLOB)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+    return connection
+
+
+def _cache_key(url):
+    """
+    Hash a URL to get its key in the cache.
+
+    sha1 digest is 160 bits = 20 bytes = 40 hexadecimal characters, the same
+    as the file names of the former one-file-per-response cache.
+
+    Parameters
+    ----------
+    url : string
+        the URL of the request
+
+    Returns
+    -------
+    string
+    """
+    return sha1(url.encode("utf-8")).hexdigest()
+
+
+def _store_in_cache(connection, key, url, response_text, created=None):
+    """
+    Compress a JSON response text and store it in the cache database.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    key : string
+        the cache key of the URL
+    url : string
+        the URL of the request, None if unknown
+    response_text : string
+        the JSON response as text
+    created : float
+        creation time as unix timestamp, now if None
+
+    Returns
+    -------
+    None
+    """
+    now = time.time()
+    data = gzip.compress(response_text.encode("utf-8"), compresslevel=6)
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, url, created, last_access, bytes, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, url, now if created is None else created, now, len(data), data),
+        )
+
+
+def _evict_from_cache(connection):
+    """
+    Delete expired responses and, if the cache is too large, the least recently used ones.
+
+    Uses settings.cache_ttl and settings.cache_max_size.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+
+    Returns
+    -------
+    None
+    """
+    with connection:
+        if settings.cache_ttl is not None:
+            connection.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - settings.cache_ttl,)
+            )
+
+        if settings.cache_max_size is not None:
+            total_size = connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()[0]
+            if total_size > settings.cache_max_size:
+                evict = []
+                for key, size in connection.execute(
+                    "SELECT key, bytes FROM responses ORDER BY last_access"
+                ).fetchall():
+                    if total_size <= settings.cache_max_size:
+                        break
+                    evict.append((key,))
+                    total_size -= size
+                connection.executemany("DELETE FROM responses WHERE key = ?", evict)
+                utils.log(f"Evicted {len(evict)} responses from the cache")
+
+
 def _save_to_cache(url, response_json, sc):
     """
-    Save a HTTP response JSON object to a file in the cache folder.
+    Save a HTTP response JSON object to the cache database.
 
-    Function calculates the checksum of url to generate the cache file's name.
+    Function calculates the checksum of url to generate the cache key.
     If the request was sent to server via POST instead of GET, then URL should
-    be a GET-style representation of request. Response is only saved to a
-    cache file if settings.use_cache is True, response_json is not None, and
-    sc = 200.
+    be a GET-style representation of request. Response is only saved to the
+    cache if settings.use_cache is True, response_json is not None, and
+    sc = 200. Afterwards, expired and least recently used responses are
+    evicted according to settings.cache_ttl and settings.cache_max_size.
 
     Users should always pass OrderedDicts instead of dicts of parameters into
     request functions, so the parameters remain in the same order each time,
@@ -145,25 +256,18 @@ def _save_to_cache(url, response_json, sc):
             utils.log("Did not save to cache because response_json is None")
 
         else:
-            # create the folder on the disk if it doesn't already exist
-            cache_folder = Path(settings.cache_folder)
-            cache_folder.mkdir(parents=True, exist_ok=True)
-
-            # hash the url to make the filename succinct but unique
-            # sha1 digest is 160 bits = 20 bytes = 40 hexadecimal characters
-            filename = sha1(url.encode("utf-8")).hexdigest() + ".json"
-            cache_filepath = cache_folder / filename
-
-            # dump to json, and save to file
-            cache_filepath.write_text(json.dumps(response_json), encoding="utf-8")
-            utils.log(f'Saved response to cache file "{cache_filepath}"')
+            with closing(_cache_connection()) as connection:
+                _store_in_cache(connection, _cache_key(url), url, json.dumps(response_json))
+                _evict_from_cache(connection)
+            utils.log(f'Saved response to cache "{_cache_key(url)}"')
 
 
 def _url_in_cache(url):
     """
-    Determine if a URL's response exists in the cache.
+    Determine if a URL's response exists in the cache and has not expired.
 
-    Calculates the checksum of url to determine the cache file's name.
+    Responses still stored as a file of the former one-file-per-response
+    cache are moved into the cache database.
 
     Parameters
     ----------
@@ -172,15 +276,17 @@ def _url_in_cache(url):
 
     Returns
     -------
-    filepath : pathlib.Path
-        path to cached response for url if it exists, otherwise None
+    key : string
+        cache key of the url if its response exists, otherwise None
     """
-    # hash the url to generate the cache filename
-    filename = sha1(url.encode("utf-8")).hexdigest() + ".json"
-    filepath = Path(settings.cache_folder) / filename
+    key = _cache_key(url)
+    with closing(_cache_connection()) as connection:
+        _migrate_cache_file(connection, Path(settings.cache_folder) / (key + ".json"), url)
+        row = connection.execute("SELECT created FROM responses WHERE key = ?", (key,)).fetchone()
 
-    # if this file exists in the cache, return its full path
-    return filepath if filepath.is_file() else None
+    if row is None or (settings.cache_ttl is not None and row[0] < time.time() - settings.cache_ttl):
+        return None
+    return key
 
 
 def _retrieve_from_cache(url, check_remark=False):
@@ -204,20 +310,77 @@ def _retrieve_from_cache(url, check_remark=False):
     if settings.use_cache:
 
         # return cached response for this url if exists, otherwise return None
-        cache_filepath = _url_in_cache(url)
-        if cache_filepath is not None:
-            response_json = json.loads(cache_filepath.read_text(encoding="utf-8"))
+        key = _url_in_cache(url)
+        if key is not None:
+            with closing(_cache_connection()) as connection:
+                with connection:
+                    row = connection.execute("SELECT data FROM responses WHERE key = ?", (key,)).fetchone()
+                    connection.execute(
+                        "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+                    )
+            if row is None:
+                return None
+            response_json = json.loads(gzip.decompress(row[0]))
 
             # return None if check_remark is True and there is a server
             # remark in the cached response
             if check_remark and "remark" in response_json:
-                utils.log(f'Found remark, so ignoring cache file "{cache_filepath}"')
+                utils.log(f'Found remark, so ignoring cached response "{key}"')
                 return None
 
-            utils.log(f'Retrieved response from cache file "{cache_filepath}"')
+            utils.log(f'Retrieved response from cache "{key}"')
             return response_json
 
 
+def _migrate_cache_file(connection, filepath, url=None):
+    """
+    Move a response file of the former one-file-per-response cache into the cache database.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    filepath : pathlib.Path
+        the JSON file, named by the cache key
+    url : string
+        the URL of the request, if known
+
+    Returns
+    -------
+    bool
+        True if the file existed and was migrated
+    """
+    if not filepath.is_file():
+        return False
+    _store_in_cache(
+        connection, filepath.stem, url, filepath.read_text(encoding="utf-8"), created=filepath.stat().st_mtime
+    )
+    filepath.unlink()
+    return True
+
+
+def migrate_cache_folder():
+    """
+    Move all responses of the former one-file-per-response cache into the cache database.
+
+    The JSON files in settings.cache_folder are compressed into the database
+    and deleted, keeping their modification time as creation time.
+    Afterwards, expired and least recently used responses are evicted
+    according to settings.cache_ttl and settings.cache_max_size.
+
+    Returns
+    -------
+    int
+        number of migrated responses
+    """
+    n_migrated = 0
+    with closing(_cache_connection()) as connection:
+        for filepath in sorted(Path(settings.cache_folder).glob("*.json")):
+            n_migrated += _migrate_cache_file(connection, filepath)
+        _evict_from_cache(connection)
+    utils.log(f"Migrated {n_migrated} responses into the cache database")
+    return n_migrated
+
+
 def _get_http_headers(user_agent=None, referer=None, accept_language=None):
     """
     Update the default requests HTTP headers with OSMnx info.
@@ -396,6 +559,39 @@ def _get_pause(base_endpoint, recursive_delay=5, default_duration=60):
     return pause
 
 
+def _get_rate_limit(base_endpoint):
+    """
+    Get the number of slots per client from the Overpass API status endpoint.
+
+    Parameters
+    ----------
+    base_endpoint : string
+        base Overpass API endpoint (without "/status" at the end)
+
+    Returns
+    -------
+    rate_limit : int
+        number of requests the server runs at the same time for this client,
+        None if the server does not limit the rate or if rate limiting is
+        disabled in settings.overpass_rate_limit, 1 if the status is unknown
+    """
+    if not settings.overpass_rate_limit:
+        return None
+
+    url = base_endpoint.rstrip("/") + "/status"
+    try:
+        response = requests.get(url, headers=_get_http_headers(), **settings.requests_kwargs)
+        lines = response.text.split("\n")
+        rate_limit = int([line for line in lines if line.startswith("Rate limit:")][0].split(":")[1])
+
+    except Exception:  # pragma: no cover
+        utils.log(f"Unable to get the rate limit from {url}", level=lg.ERROR)
+        return 1
+
+    # a rate limit of 0 means that the server does not limit the rate
+    return rate_limit if rate_limit > 0 else None
+
+
 def _make_overpass_settings():
     """
     Make settings string to send in Overpass query.
@@ -411,7 +607,7 @@ def _make_overpass_settings():
     return settings.overpass_settings.format(timeout=settings.timeout, maxsize=maxsize)
 
 
-def _make_overpass_polygon_coord_strs(polygon):
+def _make_overpass_polygon_coord_strs(polygon, max_query_area_size=None):
     """
     Subdivide query polygon and return list of coordinate strings.
 
@@ -423,6 +619,9 @@ def _make_overpass_polygon_coord_strs(polygon):
     ----------
     polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
         geographic boundaries to fetch the OSM geometries within
+    max_query_area_size : int
+        maximum area for any sub-polygon in meters, if None, use
+        settings.max_query_area_size
 
     Returns
     -------
@@ -430,7 +629,7 @@ def _make_overpass_polygon_coord_strs(polygon):
         list of exterior coordinate strings for smaller sub-divided polygons
     """
     geometry_proj, crs_proj = projection.project_geometry(polygon)
-    gpcs = utils_geo._consolidate_subdivide_geometry(geometry_proj)
+    gpcs = utils_geo._consolidate_subdivide_geometry(geometry_proj, max_query_area_size)
     geometry, _ = projection.project_geometry(gpcs, crs=crs_proj, to_latlong=True)
     polygon_coord_strs = utils_geo._get_polygons_coordinates(geometry)
     utils.log(f"Requesting data within polygon from API in {len(polygon_coord_strs)} request(s)")
@@ -508,7 +707,7 @@ def _create_overpass_query(polygon_coord_str, tags):
     return query
 
 
-def _osm_network_download(polygon, network_type, custom_filter):
+def _osm_network_download(polygon, network_type, custom_filter, max_workers=None):
     """
     Retrieve networked ways and nodes within boundary from the Overpass API.
 
@@ -518,8 +717,13 @@ def _osm_network_download(polygon, network_type, custom_filter):
         boundary to fetch the network ways/nodes within
     network_type : string
         what type of street network to get if custom_filter is None
-    custom_filter : string
-        a custom ways filter to be used instead of the network_type presets
+    custom_filter : string or list
+        a custom ways filter to be used instead of the network_type presets,
+        or a list of them
+    max_workers : int
+        number of requests sent at the same time, if None, use
+        settings.overpass_max_workers. if greater than 1, the download is
+        tiled, see _osm_network_download_concurrent
 
     Returns
     -------
@@ -533,34 +737,40 @@ def _osm_network_download(polygon, network_type, custom_filter):
     else:
         osm_filter = _get_osm_filter(network_type)
 
-    response_jsons = []
+    if type(osm_filter) is list:
+        statements = osm_filter
+    else:
+        statements = [osm_filter]
 
-    # create overpass settings string
-    overpass_settings = _make_overpass_settings()
+    if max_workers is None:
+        max_workers = settings.overpass_max_workers
 
-    # subdivide query polygon to get list of sub-divided polygon coord strings
-    polygon_coord_strs = _make_overpass_polygon_coord_strs(polygon)
+    if max_workers > 1:
+        response_jsons = _osm_network_download_concurrent(polygon, statements, max_workers)
 
-    # pass each polygon exterior coordinates in the list to the API, one at a
-    # time. The '>' makes it recurse so we get ways and the ways' nodes.
-    for polygon_coord_str in polygon_coord_strs:
-
-        if type(custom_filter) is list:
-            statements = custom_filter
-        else:
-            statements = [custom_filter]
-        statements_string = ''
-        for statement in statements:
-            statement_string = f"way{statement}(poly:'{polygon_coord_str}')"
-            statements_string = statements_string + statement_string + ';>;'
-
-        query_str = f"{overpass_settings};({statements_string});out;"
-        #print(query_str)
-        response_json = overpass_request(data={"data": query_str})
-        response_jsons.append(response_json)
-    utils.log(
-        f"Got all network data within polygon from API in {len(polygon_coord_strs)} request(s)"
-    )
+    else:
+        response_jsons = []
+
+        # create overpass settings string
+        overpass_settings = _make_overpass_settings()
+
+        # subdivide query polygon to get list of sub-divided polygon coord strings
+        polygon_coord_strs = _make_overpass_polygon_coord_strs(polygon)
+
+        # pass each polygon exterior coordinates in the list to the API, one at a
+        # time. The '>' makes it recurse so we get ways and the ways' nodes.
+        for polygon_coord_str in polygon_coord_strs:
+            statements_string = ''
+            for statement in statements:
+                statement_string = f"way{statement}(poly:'{polygon_coord_str}')"
+                statements_string = statements_string + statement_string + ';>;'
+
+            query_str = f"{overpass_settings};({statements_string});out;"
+            response_json = overpass_request(data={"data": query_str})
+            response_jsons.append(response_json)
+        utils.log(
+            f"Got all network data within polygon from API in {len(polygon_coord_strs)} request(s)"
+        )
 
     if settings.cache_only_mode:  # pragma: no cover
         raise CacheOnlyModeInterrupt("settings.cache_only_mode=True")
@@ -568,6 +778,90 @@ def _osm_network_download(polygon, network_type, custom_filter):
     return response_jsons
 
 
+def _osm_network_download_concurrent(polygon, statements, max_workers):
+    """
+    Retrieve networked ways and nodes within boundary with concurrent requests.
+
+    Split the polygon into tiles of at most settings.overpass_tile_area_size,
+    send one request per tile and filter statement through a pool of at most
+    max_workers threads, and no more than the server's rate limit, then merge
+    the responses into one without duplicate nodes and ways. Each request
+    still waits for a free slot on the server, see _get_pause.
+
+    Parameters
+    ----------
+    polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        boundary to fetch the network ways/nodes within
+    statements : list
+        ways filters, one request per tile is made for each of them
+    max_workers : int
+        maximum number of requests sent at the same time
+
+    Returns
+    -------
+    response_jsons : list
+        list with the merged JSON response
+    """
+    overpass_settings = _make_overpass_settings()
+    polygon_coord_strs = _make_overpass_polygon_coord_strs(polygon, settings.overpass_tile_area_size)
+
+    # one query per tile and statement, in a fixed order so that merging is
+    # deterministic and each query hits the cache on later runs
+    queries = [
+        f"{overpass_settings};(way{statement}(poly:'{polygon_coord_str}');>;);out;"
+        for polygon_coord_str in polygon_coord_strs
+        for statement in statements
+    ]
+
+    rate_limit = _get_rate_limit(settings.overpass_endpoint)
+    if rate_limit is not None:
+        max_workers = min(max_workers, rate_limit)
+    max_workers = max(min(max_workers, len(queries)), 1)
+
+    utils.log(f"Requesting {len(queries)} tile(s) from API with {max_workers} worker(s)")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        response_jsons = list(
+            executor.map(lambda query: overpass_request(data={"data": query}), queries)
+        )
+    utils.log(f"Got all network data within polygon from API in {len(queries)} request(s)")
+
+    return _merge_overpass_responses(response_jsons)
+
+
+def _merge_overpass_responses(response_jsons):
+    """
+    Merge Overpass JSON responses into one, de-duplicating elements.
+
+    Nodes and ways of neighbouring tiles or overlapping filters are returned
+    more than once. Only the first occurrence of each element (by type and
+    ID) is kept, in the order of the responses.
+
+    Parameters
+    ----------
+    response_jsons : list
+        list of JSON responses from the Overpass server
+
+    Returns
+    -------
+    response_jsons : list
+        list with a single merged JSON response, empty if there were none
+    """
+    if len(response_jsons) == 0:
+        return []
+
+    elements = dict()
+    n_elements = 0
+    for response_json in response_jsons:
+        for element in response_json["elements"]:
+            elements.setdefault((element["type"], element["id"]), element)
+            n_elements += 1
+
+    utils.log(f"Merged {n_elements:,} elements into {len(elements):,} unique elements")
+    merged = {key: value for key, value in response_jsons[0].items() if key != "elements"}
+    merged["elements"] = list(elements.values())
+    return [merged]
+
+
 def _osm_geometries_download(polygon, tags):
     print('osm_geometries_download')
     """
@@ -774,8 +1068,7 @@ def overpass_request(data, pause=None, error_pause=60):
 
     else:
         # if this URL is not already in the cache, pause, then request it
-        if pause is None:
-            this_pause = _get_pause(base_endpoint)
+        this_pause = _get_pause(base_endpoint) if pause is None else pause
         utils.log(f"Pausing {this_pause} seconds before making HTTP POST request")
         time.sleep(this_pause)
 
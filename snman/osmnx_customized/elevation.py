@@ -8,19 +8,24 @@ from pathlib import Path
 import networkx as nx
 import numpy as np
 import pandas as pd
-import geopandas as gpd
+import pyproj
 import requests
+import shapely
 
 from . import downloader
+from . import settings
 from . import utils
-from . import utils_graph
 
 # rasterio and gdal are optional dependencies for raster querying
 try:
     import rasterio
+    from rasterio.windows import Window
+except ImportError:  # pragma: no cover
+    rasterio = Window = None
+try:
     from osgeo import gdal
 except ImportError:  # pragma: no cover
-    rasterio = gdal = None
+    gdal = None
 
 
 def _query_raster(nodes, filepath, band):
@@ -55,9 +60,10 @@ def add_node_elevations_raster(G, filepath, band=1, cpus=None, graph_crs=2056, r
     If `filepath` is a list of paths, this will generate a virtual raster
     composed of the files at those paths as an intermediate step.
 
-    See also the `add_edge_grades` function.
+    See also the `add_edge_grades` and `add_edge_grades_raster` functions.
 
-    snman.oxc: added custom raster_crs
+    snman.oxc: added custom raster_crs, with cpus=1 the raster is read window
+    by window and the values are cached, see `_sample_raster_cached`
 
     Parameters
     ----------
@@ -79,37 +85,27 @@ def add_node_elevations_raster(G, filepath, band=1, cpus=None, graph_crs=2056, r
     G : networkx.MultiDiGraph
         graph with node elevation attributes
     """
-    if rasterio is None or gdal is None:  # pragma: no cover
-        raise ImportError("gdal and rasterio must be installed to query raster files")
+    if rasterio is None:  # pragma: no cover
+        raise ImportError("rasterio must be installed to query raster files")
 
     if cpus is None:
         cpus = mp.cpu_count()
     cpus = min(cpus, mp.cpu_count())
     utils.log(f"Attaching elevations with {cpus} CPUs...")
 
-    # if a list of filepaths is passed, compose them all as a virtual raster
-    # use the sha1 hash of the filepaths list as the vrt filename
-    if not isinstance(filepath, (str, Path)):
-        filepaths = [str(p) for p in filepath]
-        sha = sha1(str(filepaths).encode("utf-8")).hexdigest()
-        filepath = f"./.osmnx_{sha}.vrt"
-        gdal.BuildVRT(filepath, filepaths).FlushCache()
+    filepath = _raster_filepath(filepath)
 
-    # convert the x and y coordinates of the nodes to match the raster image and then extract them
-    nodes = utils_graph.graph_to_gdfs(G, edges=False, node_geometry=False)
-    nodes = gpd.GeoDataFrame(
-        nodes, geometry=gpd.points_from_xy(nodes.x, nodes.y), crs=graph_crs
-    )
-    nodes = nodes.to_crs(raster_crs)
-    nodes.x = nodes.geometry.x
-    nodes.y = nodes.geometry.y
-    nodes = nodes[["x", "y"]]
-    print(nodes)
+    # convert the x and y coordinates of the nodes to match the raster image
+    node_ids = list(G.nodes)
+    x = np.array([data["x"] for node, data in G.nodes(data=True)], dtype=float)
+    y = np.array([data["y"] for node, data in G.nodes(data=True)], dtype=float)
+    x, y = pyproj.Transformer.from_crs(graph_crs, raster_crs, always_xy=True).transform(x, y)
 
     if cpus == 1:
-        elevs = dict(_query_raster(nodes, filepath, band))
+        elevs = dict(zip(node_ids, _sample_raster_cached(x, y, filepath, band, raster_crs)))
     else:
         # divide nodes into equal-sized chunks for multiprocessing
+        nodes = pd.DataFrame({"x": x, "y": y}, index=node_ids)
         size = int(np.ceil(len(nodes) / cpus))
         args = ((nodes.iloc[i : i + size], filepath, band) for i in range(0, len(nodes), size))
         pool = mp.Pool(cpus)
@@ -125,6 +121,316 @@ def add_node_elevations_raster(G, filepath, band=1, cpus=None, graph_crs=2056, r
     return G
 
 
+def _raster_filepath(filepath):
+    """
+    Get the path of a raster, or of a virtual raster composed of several.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path or list of strings/Paths
+        path (or list of paths) to the raster file(s)
+
+    Returns
+    -------
+    filepath : string or pathlib.Path
+    """
+    # if a list of filepaths is passed, compose them all as a virtual raster
+    # use the sha1 hash of the filepaths list as the vrt filename
+    if not isinstance(filepath, (str, Path)):
+        if gdal is None:  # pragma: no cover
+            raise ImportError("gdal must be installed to query several raster files")
+        filepaths = [str(p) for p in filepath]
+        sha = sha1(str(filepaths).encode("utf-8")).hexdigest()
+        filepath = f"./.osmnx_{sha}.vrt"
+        gdal.BuildVRT(filepath, filepaths).FlushCache()
+    return filepath
+
+
+def _sample_raster(x, y, filepath, band=1, tile_size=512):
+    """
+    Sample a raster at many coordinates, reading it window by window.
+
+    The coordinates are grouped by tiles of tile_size x tile_size pixels and
+    each tile is read only once, as the smallest window covering its points.
+
+    Parameters
+    ----------
+    x : numpy.array
+        x coordinates in the raster's CRS
+    y : numpy.array
+        y coordinates in the raster's CRS
+    filepath : string or pathlib.Path
+        path to the raster file or VRT to query
+    band : int
+        which raster band to query
+    tile_size : int
+        width and height of the tiles in pixels
+
+    Returns
+    -------
+    values : numpy.array
+        raster values, nan outside of the raster and for nodata
+    """
+    values = np.full(len(x), np.nan)
+    if len(x) == 0:
+        return values
+
+    with rasterio.open(filepath) as raster:
+        rows, cols = rasterio.transform.rowcol(raster.transform, x, y)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        inside = np.flatnonzero((rows >= 0) & (rows < raster.height) & (cols >= 0) & (cols < raster.width))
+
+        # group the points by tile
+        n_tile_cols = int(np.ceil(raster.width / tile_size))
+        tiles = (rows[inside] // tile_size) * n_tile_cols + cols[inside] // tile_size
+        order = np.argsort(tiles, kind="stable")
+        inside, tiles = inside[order], tiles[order]
+        boundaries = np.flatnonzero(np.diff(tiles)) + 1
+
+        for points in np.split(inside, boundaries):
+            if len(points) == 0:
+                continue
+            row_min, col_min = rows[points].min(), cols[points].min()
+            window = Window(
+                col_min, row_min, cols[points].max() - col_min + 1, rows[points].max() - row_min + 1
+            )
+            data = raster.read(band, window=window)
+            tile_values = data[rows[points] - row_min, cols[points] - col_min].astype(float)
+            if raster.nodata is not None:
+                tile_values[data[rows[points] - row_min, cols[points] - col_min] == raster.nodata] = np.nan
+            values[points] = tile_values
+
+    return values
+
+
+def _elevation_cache_filepath(filepath, band, decimals):
+    """
+    Get the path of the on-disk cache of sampled values for a raster.
+
+    The name depends on the raster's path, size and modification time, the
+    band, and the rounding of the coordinates, so that a changed raster gets
+    a new cache.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to the raster file or VRT
+    band : int
+        raster band
+    decimals : int
+        decimal places the coordinates are rounded to
+
+    Returns
+    -------
+    cache_filepath : pathlib.Path
+    """
+    stat = Path(filepath).stat()
+    key = f"{Path(filepath).resolve()}|{stat.st_size}|{stat.st_mtime}|{band}|{decimals}"
+    sha = sha1(key.encode("utf-8")).hexdigest()
+    return Path(settings.cache_folder) / f"elevation_{sha}.npz"
+
+
+def _sample_raster_cached(x, y, filepath, band=1, raster_crs=4326, decimals=None, tile_size=512):
+    """
+    Sample a raster at coordinates rounded to some decimals, with a disk cache.
+
+    The coordinates are rounded and each distinct rounded coordinate is
+    sampled only once. If settings.use_cache is True, the sampled values are
+    kept in a cache file in settings.cache_folder, keyed by the rounded
+    coordinates, so that repeated runs only read the raster for new
+    coordinates.
+
+    Parameters
+    ----------
+    x : numpy.array
+        x coordinates in the raster's CRS
+    y : numpy.array
+        y coordinates in the raster's CRS
+    filepath : string or pathlib.Path
+        path to the raster file or VRT to query
+    band : int
+        which raster band to query
+    raster_crs : int
+        CRS of the raster file, to choose the default decimals
+    decimals : int
+        decimal places to round the coordinates to, if None, 6 for a
+        geographic CRS (about 0.1 meters) and 1 otherwise
+    tile_size : int
+        width and height of the tiles read at once, in pixels
+
+    Returns
+    -------
+    values : numpy.array
+        raster values, nan outside of the raster and for nodata
+    """
+    if decimals is None:
+        decimals = 6 if pyproj.CRS.from_user_input(raster_crs).is_geographic else 1
+
+    # integer keys of the rounded coordinates, and the distinct ones
+    scale = 10**decimals
+    keys = pd.DataFrame(
+        {
+            "x": np.round(np.asarray(x, dtype=float) * scale).astype(np.int64),
+            "y": np.round(np.asarray(y, dtype=float) * scale).astype(np.int64),
+        }
+    )
+    distinct = keys.drop_duplicates(ignore_index=True)
+
+    cache = pd.DataFrame({"x": np.array([], dtype=np.int64), "y": np.array([], dtype=np.int64), "value": []})
+    cache_filepath = None
+    if settings.use_cache:
+        cache_filepath = _elevation_cache_filepath(filepath, band, decimals)
+        if cache_filepath.is_file():
+            with np.load(cache_filepath) as f:
+                cache = pd.DataFrame({"x": f["x"], "y": f["y"], "value": f["value"]})
+
+    distinct = distinct.merge(cache, on=["x", "y"], how="left", indicator=True)
+    missing = (distinct["_merge"] == "left_only").to_numpy()
+    utils.log(f"Sampling {missing.sum():,} of {len(distinct):,} distinct coordinates from raster")
+
+    if missing.any():
+        distinct.loc[missing, "value"] = _sample_raster(
+            distinct["x"].to_numpy()[missing] / scale,
+            distinct["y"].to_numpy()[missing] / scale,
+            filepath,
+            band,
+            tile_size,
+        )
+        if cache_filepath is not None:
+            cache = pd.concat([cache, distinct.loc[missing, ["x", "y", "value"]]], ignore_index=True)
+            cache_filepath.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(
+                cache_filepath,
+                x=cache["x"].to_numpy(dtype=np.int64),
+                y=cache["y"].to_numpy(dtype=np.int64),
+                value=cache["value"].to_numpy(dtype=float),
+            )
+
+    values = keys.merge(distinct[["x", "y", "value"]], on=["x", "y"], how="left")["value"]
+    return values.to_numpy(dtype=float)
+
+
+def add_edge_grades_raster(
+    G,
+    filepath,
+    spacing=10,
+    band=1,
+    graph_crs=2056,
+    raster_crs=4326,
+    decimals=None,
+    tile_size=512,
+    precision=3,
+):
+    """
+    Add grade attributes to each edge from elevations sampled along it.
+
+    Unlike `add_edge_grades`, which only uses the elevations of the end nodes,
+    the elevation is sampled from the raster at regular distances along each
+    edge's geometry, so that edges over hills or through dips get meaningful
+    grades. Sampled values are cached on disk by rounded coordinates, see
+    `_sample_raster_cached`.
+
+    Adds the attributes, in the direction of the edge from u to v:
+
+    * `grade`: the rise from the first to the last sample over the length
+    * `grade_max`: the steepest uphill grade between two samples
+    * `grade_mean`: the total ascent over the length, i.e. the mean uphill grade
+
+    and `grade_max_reverse` and `grade_mean_reverse` for the direction from v
+    to u.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph, projected to graph_crs, with geometries on the edges
+        that are not straight lines
+    filepath : string or pathlib.Path or list of strings/Paths
+        path (or list of paths) to the raster file(s) to query
+    spacing : float
+        maximal distance between the samples along an edge, in graph_crs units
+    band : int
+        which raster band to query
+    graph_crs : int
+        CRS of the graph geometries
+    raster_crs : int
+        CRS of the raster file
+    decimals : int
+        decimal places to round the coordinates in raster_crs to for caching,
+        see `_sample_raster_cached`
+    tile_size : int
+        width and height of the raster windows read at once, in pixels
+    precision : int
+        decimal precision to round grade values
+
+    Returns
+    -------
+    G : networkx.MultiDiGraph
+        graph with edge grade attributes
+    """
+    if rasterio is None:  # pragma: no cover
+        raise ImportError("rasterio must be installed to query raster files")
+
+    filepath = _raster_filepath(filepath)
+    uvk = list(G.edges(keys=True))
+    if len(uvk) == 0:
+        return G
+
+    # edge geometries, straight lines between the nodes where missing
+    geometries = np.empty(len(uvk), dtype=object)
+    geometries[:] = [
+        data["geometry"]
+        if data.get("geometry") is not None
+        else shapely.LineString([(G.nodes[u]["x"], G.nodes[u]["y"]), (G.nodes[v]["x"], G.nodes[v]["y"])])
+        for u, v, data in G.edges(data=True)
+    ]
+    lengths = shapely.length(geometries)
+
+    # equally spaced samples along each edge, at least at both ends
+    n_segments = np.maximum(np.ceil(lengths / spacing), 1).astype(np.int64)
+    n_samples = n_segments + 1
+    edge_of_sample = np.repeat(np.arange(len(uvk)), n_samples)
+    first_sample = np.concatenate([[0], np.cumsum(n_samples)[:-1]])
+    sample_number = np.arange(len(edge_of_sample)) - first_sample[edge_of_sample]
+    distances = sample_number * (lengths / n_segments)[edge_of_sample]
+    points = shapely.line_interpolate_point(geometries[edge_of_sample], distances)
+
+    # sample the elevations in the raster's CRS
+    x, y = pyproj.Transformer.from_crs(graph_crs, raster_crs, always_xy=True).transform(
+        shapely.get_x(points), shapely.get_y(points)
+    )
+    elevations = _sample_raster_cached(x, y, filepath, band, raster_crs, decimals, tile_size)
+
+    # rises between consecutive samples of the same edge
+    rises = np.diff(elevations)
+    is_segment = np.ones(len(rises), dtype=bool)
+    is_segment[first_sample[1:] - 1] = False
+    rises = rises[is_segment]
+    first_segment = first_sample - np.arange(len(uvk))
+    segment_lengths = np.repeat(lengths / n_segments, n_segments)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        segment_grades = np.where(segment_lengths > 0, rises / segment_lengths, 0)
+        net_rise = elevations[first_sample + n_segments] - elevations[first_sample]
+        grades = {
+            "grade": np.where(lengths > 0, net_rise / lengths, 0),
+            "grade_max": np.maximum.reduceat(segment_grades, first_segment),
+            "grade_max_reverse": np.maximum.reduceat(-segment_grades, first_segment),
+            "grade_mean": np.where(
+                lengths > 0, np.add.reduceat(np.maximum(rises, 0), first_segment) / lengths, 0
+            ),
+            "grade_mean_reverse": np.where(
+                lengths > 0, np.add.reduceat(np.maximum(-rises, 0), first_segment) / lengths, 0
+            ),
+        }
+
+    for name, values in grades.items():
+        nx.set_edge_attributes(G, dict(zip(uvk, values.round(precision) + 0.0)), name=name)
+
+    utils.log(f"Added grade attributes to all edges from {len(points):,} elevation samples.")
+    return G
+
+
 def add_node_elevations_google(
     G, api_key, max_locations_per_batch=350, pause_duration=0, precision=3
 ):  # pragma: no cover
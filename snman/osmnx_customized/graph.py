@@ -4,6 +4,7 @@ import itertools
 import warnings
 
 import networkx as nx
+import numpy as np
 from shapely.geometry import MultiPolygon
 from shapely.geometry import Polygon
 
@@ -508,10 +509,22 @@ def graph_from_polygon(
     return G
 
 
-def graph_from_xml(filepath, bidirectional=False, simplify=True, simplify_strict=True, retain_all=False):
+def graph_from_xml(
+    filepath,
+    bidirectional=False,
+    simplify=True,
+    simplify_strict=True,
+    retain_all=False,
+    custom_filter=None,
+    polygon=None,
+):
     """
     Create a graph from data in a .osm formatted XML file.
 
+    The file is read as a stream and only the ways matching custom_filter
+    and polygon are kept, so large extracts can be read with memory
+    proportional to the resulting network.
+
     Parameters
     ----------
     filepath : string or pathlib.Path
@@ -523,13 +536,21 @@ def graph_from_xml(filepath, bidirectional=False, simplify=True, simplify_strict
     retain_all : bool
         if True, return the entire graph even if it is not connected.
         otherwise, retain only the largest weakly connected component.
+    custom_filter : string or list
+        Overpass way filter(s) to select the ways, e.g. snman's OSM_FILTER.
+        if None, use all ways in the file
+    polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        if not None, use only the ways with at least one node within this
+        boundary, in lat-lng
 
     Returns
     -------
     G : networkx.MultiDiGraph
     """
-    # transmogrify file of OSM XML data into JSON
-    response_jsons = [osm_xml._overpass_json_from_file(filepath)]
+    # stream the network of the OSM XML file into JSON
+    response_jsons = [
+        osm_xml._overpass_json_from_file_streaming(filepath, osm_filter=custom_filter, polygon=polygon)
+    ]
 
     # create graph using this response JSON
     G = _create_graph(response_jsons, bidirectional=bidirectional, retain_all=retain_all)
@@ -547,8 +568,8 @@ def _create_graph(response_jsons, retain_all=False, bidirectional=False, one_edg
     Create a networkx MultiDiGraph from Overpass API responses.
 
     Adds length attributes in meters (great-circle distance between endpoints)
-    to all of the graph's (pre-simplified, straight-line) edges via the
-    `distance.add_edge_lengths` function.
+    to all of the graph's (pre-simplified, straight-line) edges, like the
+    `distance.add_edge_lengths` function, while adding the edges.
 
     Parameters
     ----------
@@ -586,12 +607,14 @@ def _create_graph(response_jsons, retain_all=False, bidirectional=False, one_edg
         nodes.update(nodes_temp)
         paths.update(paths_temp)
 
-    # add each osm node to the graph
-    for node, data in nodes.items():
-        G.add_node(node, **data)
+    # add all osm nodes to the graph at once
+    G.add_nodes_from(nodes.items())
 
-    # add each osm way (ie, a path of edges) to the graph
-    _add_paths(G, paths.values(), bidirectional=bidirectional, one_edge_per_direction=one_edge_per_direction)
+    # add all osm ways (ie, paths of edges) to the graph at once, with the
+    # length (great-circle distance between nodes) attribute of each edge
+    _add_paths(
+        G, paths.values(), bidirectional=bidirectional, one_edge_per_direction=one_edge_per_direction, nodes=nodes
+    )
 
     # retain only the largest connected component if retain_all is False
     if not retain_all:
@@ -599,10 +622,6 @@ def _create_graph(response_jsons, retain_all=False, bidirectional=False, one_edg
 
     utils.log(f"Created graph with {len(G)} nodes and {len(G.edges)} edges")
 
-    # add length (great-circle distance between nodes) attribute to each edge
-    if len(G.edges) > 0:
-        G = distance.add_edge_lengths(G)
-
     return G
 
 
@@ -747,10 +766,15 @@ def _is_path_reversed(path, reversed_values):
         return False
 
 
-def _add_paths(G, paths, bidirectional=False, one_edge_per_direction=True):
+def _add_paths(G, paths, bidirectional=False, one_edge_per_direction=True, nodes=None, precision=3):
     """
     Add a list of paths to the graph as edges.
 
+    All edges are added with a single `add_edges_from` call, in the same order
+    and with the same keys as when adding them path by path. If the nodes are
+    given, the edges' lengths are calculated for all edges at once from the
+    nodes' coordinates, like in `distance.add_edge_lengths`.
+
     Parameters
     ----------
     G : networkx.MultiDiGraph
@@ -759,6 +783,14 @@ def _add_paths(G, paths, bidirectional=False, one_edge_per_direction=True):
         list of paths' tag:value attribute data dicts
     bidirectional : bool
         if True, create bi-directional edges for one-way streets
+    one_edge_per_direction : bool
+        if True, add a reversed edge for each edge of paths that are not
+        one-way
+    nodes : dict
+        if not None, the osm nodes' attribute dicts with x and y coordinates
+        used to add length attributes (in meters) to the edges
+    precision : int
+        decimal precision to round lengths
 
     Returns
     -------
@@ -771,17 +803,20 @@ def _add_paths(G, paths, bidirectional=False, one_edge_per_direction=True):
     oneway_values = {"yes", "true", "1", "-1", "reverse", "T", "F"}
     reversed_values = {"-1", "reverse", "T"}
 
+    path_nodes = []
+    path_attrs = []
+    path_both_ways = []
     for path in paths:
 
         # extract/remove the ordered list of nodes from this path element so
         # we don't add it as a superfluous attribute to the edge later
-        nodes = path.pop("nodes")
+        nodes_of_path = path.pop("nodes")
 
         # reverse the order of nodes in the path if this path is both one-way
         # and only allows travel in the opposite direction of nodes' order
         is_one_way = _is_path_one_way(path, bidirectional, oneway_values)
         if is_one_way and _is_path_reversed(path, reversed_values):
-            nodes.reverse()
+            nodes_of_path.reverse()
 
         # set the oneway attribute, but only if when not forcing all edges to
         # oneway with the all_oneway setting. With the all_oneway setting, you
@@ -789,15 +824,60 @@ def _add_paths(G, paths, bidirectional=False, one_edge_per_direction=True):
         if not settings.all_oneway:
             path["oneway"] = is_one_way
 
-        # zip path nodes to get (u, v) tuples like [(0,1), (1,2), (2,3)].
-        edges = list(zip(nodes[:-1], nodes[1:]))
-
-        # add all the edge tuples and give them the path's tag:value attrs
-        path["reversed"] = False
-        G.add_edges_from(edges, **path)
-
-        # if the path is NOT one-way, reverse direction of each edge and add
-        # this path going the opposite direction too
-        if not is_one_way and one_edge_per_direction:
-            path["reversed"] = True
-            G.add_edges_from([(v, u) for u, v in edges], **path)
+        path_nodes.append(nodes_of_path)
+        path_attrs.append(path)
+        # if the path is NOT one-way, its edges are also added in the opposite
+        # direction
+        path_both_ways.append(not is_one_way and one_edge_per_direction)
+
+    # all path nodes in one array: the edges (u, v) are the consecutive pairs
+    # within each path, like zip(nodes[:-1], nodes[1:])
+    n_path_nodes = np.array([len(nodes_of_path) for nodes_of_path in path_nodes], dtype=np.int64)
+    n_path_edges = np.maximum(n_path_nodes - 1, 0)
+    all_nodes = np.array(list(itertools.chain.from_iterable(path_nodes)), dtype=object)
+    is_last = np.zeros(len(all_nodes), dtype=bool)
+    is_last[np.cumsum(n_path_nodes)[n_path_nodes > 0] - 1] = True
+    u_pos = np.flatnonzero(~is_last)
+    v_pos = u_pos + 1
+    edge_path = np.repeat(np.arange(len(path_nodes)), n_path_edges)
+
+    # per path, first its edges in the direction of travel, then reversed
+    both_ways = np.array(path_both_ways, dtype=bool)[edge_path]
+    is_reversed = np.concatenate([np.zeros(len(edge_path), dtype=bool), np.ones(both_ways.sum(), dtype=bool)])
+    edge_index = np.concatenate([np.arange(len(edge_path)), np.flatnonzero(both_ways)])
+    order = np.lexsort((edge_index, is_reversed, edge_path[edge_index]))
+    is_reversed, edge_index = is_reversed[order], edge_index[order]
+    u = np.where(is_reversed, v_pos[edge_index], u_pos[edge_index])
+    v = np.where(is_reversed, u_pos[edge_index], v_pos[edge_index])
+
+    if nodes is not None and len(edge_index) > 0:
+        node_index = {node: i for i, node in enumerate(nodes)}
+        y = np.array([data["y"] for data in nodes.values()], dtype=float)
+        x = np.array([data["x"] for data in nodes.values()], dtype=float)
+        try:
+            positions = np.array([node_index[node] for node in all_nodes], dtype=np.int64)
+        except KeyError:  # pragma: no cover
+            raise KeyError("some edges missing nodes, possibly due to input data clipping issue")
+
+        # calculate great circle distances, round, and fill nulls with zeros
+        pu, pv = positions[u], positions[v]
+        lengths = distance.great_circle_vec(y[pu], x[pu], y[pv], x[pv]).round(precision)
+        lengths[np.isnan(lengths)] = 0
+    else:
+        lengths = None
+
+    # one attribute dict per path and direction, copied for each edge
+    attrs = [
+        ({**path, "reversed": False}, {**path, "reversed": True})
+        for path in path_attrs
+    ]
+    edge_attrs = [attrs[p][r] for p, r in zip(edge_path[edge_index].tolist(), is_reversed.tolist())]
+    if lengths is not None:
+        edge_attrs = [{**data, "length": length} for data, length in zip(edge_attrs, lengths)]
+    edges = zip(all_nodes[u].tolist(), all_nodes[v].tolist(), edge_attrs)
+
+    # add all the edge tuples and give them the path's tag:value attrs
+    G.add_edges_from(edges)
+
+    if lengths is not None:
+        utils.log("Added length attributes to graph edges")
@@ -8,6 +8,7 @@ import networkx as nx
 import pandas as pd
 from shapely import wkt
 
+from . import distance
 from . import settings
 from . import utils
 from . import utils_graph
@@ -155,6 +156,9 @@ def save_graphml(G, filepath=None, gephi=False, encoding="utf-8"):
         # make a copy to not mutate original graph object caller passed in
         G = G.copy()
 
+    # the cached spatial index can be rebuilt and is not saved
+    G.graph.pop(distance.SPATIAL_INDEX_KEY, None)
+
     # stringify all the graph attribute values
     for attr, value in G.graph.items():
         G.graph[attr] = str(value)
@@ -236,6 +240,10 @@ def load_graphml(
         "bearing": float,
         "grade": float,
         "grade_abs": float,
+        "grade_max": float,
+        "grade_max_reverse": float,
+        "grade_mean": float,
+        "grade_mean_reverse": float,
         "length": float,
         "oneway": _convert_bool_string,
         "osmid": int,
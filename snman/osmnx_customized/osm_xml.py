@@ -1,6 +1,7 @@
 """Read/write .osm formatted XML files."""
 
 import bz2
+import re
 import xml.sax
 from pathlib import Path
 from xml.etree import ElementTree as etree
@@ -8,6 +9,7 @@ from xml.etree import ElementTree as etree
 import networkx as nx
 import numpy as np
 import pandas as pd
+import shapely
 
 from . import settings
 from . import utils
@@ -75,19 +77,269 @@ def _overpass_json_from_file(filepath):
     OSMContentHandler object
     """
 
-    def _opener(filepath):
-        if filepath.suffix == ".bz2":
-            return bz2.BZ2File(filepath)
-        else:
-            # assume an unrecognized file extension is just XML
-            return filepath.open(mode="rb")
-
-    with _opener(Path(filepath)) as f:
+    with _open_osm_xml(filepath) as f:
         handler = _OSMContentHandler()
         xml.sax.parse(f, handler)
         return handler.object
 
 
+def _open_osm_xml(filepath):
+    """
+    Open an OSM XML file for reading, decompressing it if it ends with .bz2.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to file containing OSM XML data
+
+    Returns
+    -------
+    file object
+    """
+    filepath = Path(filepath)
+    if filepath.suffix == ".bz2":
+        return bz2.BZ2File(filepath)
+    else:
+        # assume an unrecognized file extension is just XML
+        return filepath.open(mode="rb")
+
+
+def _iter_osm_xml(filepath, names):
+    """
+    Iterate over the top-level elements of an OSM XML file without keeping them.
+
+    Each element is cleared from the parsed tree once it has been yielded, so
+    memory does not grow with the file size.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to file containing OSM XML data
+    names : set
+        element names to yield, e.g. {"node"} or {"way"}
+
+    Yields
+    ------
+    element : xml.etree.ElementTree.Element
+    """
+    with _open_osm_xml(filepath) as f:
+        root = None
+        for event, element in etree.iterparse(f, events=("start", "end")):
+            if root is None:
+                root = element
+            elif event == "end" and element.tag in {"node", "way", "relation"}:
+                if element.tag in names:
+                    yield element
+                # drop the finished element and all its children from the tree
+                root.clear()
+
+
+def _parse_way_filter(osm_filter):
+    """
+    Parse Overpass QL way filters into lists of tag conditions.
+
+    Supports the conditions used in Overpass way filters such as
+    `["highway"]["area"!~"yes"]["service"="alley"][!"access"]`, optionally
+    case-insensitive with `,i`.
+
+    Parameters
+    ----------
+    osm_filter : string or list
+        a way filter or a list of them, like custom_filter in graph_from_polygon
+
+    Returns
+    -------
+    filters : list
+        one list of (key, operator, value) conditions per way filter, where
+        operator is one of "exists", "not exists", "=", "!=", "~", "!~" and
+        value is a compiled regex for "~" and "!~"
+    """
+    if not isinstance(osm_filter, list):
+        osm_filter = [osm_filter]
+
+    pattern = re.compile(r'\[\s*(!?)\s*"([^"]+)"\s*(?:(!=|!~|=|~)\s*"([^"]*)"\s*(,\s*i)?)?\s*\]')
+    filters = []
+    for statement in osm_filter:
+        statement = statement.strip()
+        conditions = []
+        position = 0
+        for match in pattern.finditer(statement):
+            if statement[position:match.start()].strip() != "":
+                raise ValueError(f'Unable to parse the way filter "{statement}"')
+            position = match.end()
+
+            negation, key, operator, value, case_insensitive = match.groups()
+            if operator is None:
+                conditions.append((key, "not exists" if negation else "exists", None))
+            elif operator in {"~", "!~"}:
+                flags = re.IGNORECASE if case_insensitive else 0
+                conditions.append((key, operator, re.compile(value, flags)))
+            else:
+                conditions.append((key, operator, value))
+
+        if statement[position:].strip() != "":
+            raise ValueError(f'Unable to parse the way filter "{statement}"')
+        filters.append(conditions)
+
+    return filters
+
+
+def _tags_match_filter(tags, filters):
+    """
+    Determine if a way's tags match any of the parsed way filters.
+
+    Like in Overpass, negated conditions ("!=", "!~") also match if the key is
+    missing.
+
+    Parameters
+    ----------
+    tags : dict
+        the way's tags
+    filters : list
+        parsed way filters, see _parse_way_filter
+
+    Returns
+    -------
+    bool
+    """
+    for conditions in filters:
+        for key, operator, value in conditions:
+            tag = tags.get(key)
+            if operator == "exists":
+                matches = tag is not None
+            elif operator == "not exists":
+                matches = tag is None
+            elif operator == "=":
+                matches = tag == value
+            elif operator == "!=":
+                matches = tag != value
+            elif operator == "~":
+                matches = tag is not None and value.search(tag) is not None
+            else:
+                matches = tag is None or value.search(tag) is None
+            if not matches:
+                break
+        else:
+            return True
+    return False
+
+
+def _overpass_json_from_file_streaming(filepath, osm_filter=None, polygon=None):
+    """
+    Read the network from an OSM XML file into Overpass-like JSON, streaming.
+
+    Unlike _overpass_json_from_file, the file is parsed element by element
+    with iterparse and only the ways matching the filter and the polygon, with
+    their nodes, are kept, so memory is proportional to the retained network
+    (plus the ids of the nodes within the polygon) rather than the file.
+    Because nodes precede the ways in OSM XML, the file is read up to three
+    times: once for the ids of the nodes within the polygon, once for the ways
+    and once for the nodes these ways reference. Only the tags in
+    settings.useful_tags_way and settings.useful_tags_node are kept, relations
+    are skipped.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to file containing OSM XML data
+    osm_filter : string or list
+        Overpass way filter(s) like custom_filter in graph_from_polygon, e.g.
+        snman's OSM_FILTER. if None, keep all ways and all nodes, like
+        _overpass_json_from_file
+    polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        if not None, keep only the ways with at least one node within this
+        boundary (in lat-lng), with all of their nodes, like an Overpass query
+
+    Returns
+    -------
+    response_json : dict
+    """
+    filters = None if osm_filter is None else _parse_way_filter(osm_filter)
+    keep_all_nodes = filters is None and polygon is None
+
+    # first pass: the ids of the nodes within the polygon
+    nodes_inside = None
+    if polygon is not None:
+        nodes_inside = _node_ids_within_polygon(filepath, polygon)
+
+    # second pass: ways matching the filter with any node within the polygon
+    ways = []
+    for element in _iter_osm_xml(filepath, {"way"}):
+        tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+        if filters is not None and not _tags_match_filter(tags, filters):
+            continue
+        way_nodes = [int(nd.get("ref")) for nd in element.iter("nd")]
+        if nodes_inside is not None and nodes_inside.isdisjoint(way_nodes):
+            continue
+        ways.append(
+            {
+                "type": "way",
+                "id": int(element.get("id")),
+                "nodes": way_nodes,
+                "tags": {k: v for k, v in tags.items() if k in settings.useful_tags_way},
+            }
+        )
+    nodes_inside = None
+    node_ids = {node_id for way in ways for node_id in way["nodes"]}
+
+    # third pass: the nodes of these ways
+    nodes = []
+    for element in _iter_osm_xml(filepath, {"node"}):
+        node_id = int(element.get("id"))
+        if keep_all_nodes or node_id in node_ids:
+            tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+            nodes.append(
+                {
+                    "type": "node",
+                    "id": node_id,
+                    "lat": float(element.get("lat")),
+                    "lon": float(element.get("lon")),
+                    "tags": {k: v for k, v in tags.items() if k in settings.useful_tags_node},
+                }
+            )
+
+    utils.log(f"Read {len(nodes):,} nodes and {len(ways):,} ways from {filepath}")
+    return {"elements": nodes + ways}
+
+
+def _node_ids_within_polygon(filepath, polygon, chunk_size=100000):
+    """
+    Read the ids of the nodes of an OSM XML file within a polygon, streaming.
+
+    The coordinates are tested in chunks, so only the ids of the nodes within
+    the polygon are kept in memory.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to file containing OSM XML data
+    polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        boundary in lat-lng
+    chunk_size : int
+        number of nodes tested at once
+
+    Returns
+    -------
+    node_ids : set
+    """
+    shapely.prepare(polygon)
+    node_ids = set()
+    ids, lons, lats = [], [], []
+    for element in _iter_osm_xml(filepath, {"node"}):
+        ids.append(int(element.get("id")))
+        lons.append(float(element.get("lon")))
+        lats.append(float(element.get("lat")))
+        if len(ids) >= chunk_size:
+            inside = shapely.intersects_xy(polygon, lons, lats)
+            node_ids.update(node_id for node_id, is_inside in zip(ids, inside) if is_inside)
+            ids, lons, lats = [], [], []
+    if len(ids) > 0:
+        inside = shapely.intersects_xy(polygon, lons, lats)
+        node_ids.update(node_id for node_id, is_inside in zip(ids, inside) if is_inside)
+
+    return node_ids
+
+
 def save_graph_xml(
     data,
     filepath=None,
@@ -0,0 +1,239 @@
+"""Serve recorded Overpass API responses from a local HTTP server."""
+
+import gzip
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from . import downloader
+from . import settings
+
+
+class OverpassReplayServer:
+    """
+    Local stand-in for the Overpass API that replays recorded responses.
+
+    It answers POST requests to `/api/interpreter` with the recorded response
+    of the query, or with 404 if the query was not recorded, and GET requests
+    to `/api/status` with a slot status like the Overpass API, so that the
+    whole download-to-graph path can be tested and benchmarked offline:
+
+        with OverpassReplayServer(recordings, latency=0.5) as server:
+            settings.overpass_endpoint = server.endpoint
+            settings.use_cache = False
+            G = graph_from_polygon(polygon)
+
+    Parameters
+    ----------
+    recordings : dict
+        Overpass query string -> JSON response, see load_recordings and
+        recordings_from_cache
+    rate_limit : int
+        number of slots per client announced by the status endpoint, 0 for
+        no rate limit
+    latency : float
+        seconds to wait before answering a query, to simulate the server
+    host : string
+        address to listen on
+    port : int
+        port to listen on, 0 for any free port
+    """
+
+    def __init__(self, recordings, rate_limit=2, latency=0, host="127.0.0.1", port=0):
+        self.recordings = dict(recordings)
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.n_requests = 0
+        self.n_running = 0
+        self.max_running = 0
+        self.unknown_queries = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        """Base endpoint to use as settings.overpass_endpoint."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _status_text(self):
+        with self._lock:
+            free_slots = max(self.rate_limit - self.n_running, 0)
+        lines = [
+            "Connected as: 2130706433",
+            f"Current time: {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}",
+            f"Rate limit: {self.rate_limit}",
+        ]
+        # the status line is what downloader._get_pause reads
+        if self.rate_limit == 0 or free_slots > 0:
+            lines.append(f"{free_slots if self.rate_limit > 0 else 1} slots available now.")
+        lines.append("Currently running queries (pid, space limit, time limit, start time):")
+        return "\n".join(lines) + "\n"
+
+    def _replay(self, query):
+        with self._lock:
+            self.n_requests += 1
+            self.n_running += 1
+            self.max_running = max(self.max_running, self.n_running)
+        try:
+            time.sleep(self.latency)
+            response_json = self.recordings.get(query)
+            if response_json is None:
+                with self._lock:
+                    self.unknown_queries.append(query)
+            return response_json
+        finally:
+            with self._lock:
+                self.n_running -= 1
+
+
+def _make_handler(server):
+    """
+    Make the request handler class bound to a replay server.
+
+    Parameters
+    ----------
+    server : OverpassReplayServer
+        the replay server that holds the recordings
+
+    Returns
+    -------
+    handler : class
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def _respond(self, sc, body, content_type):
+            body = body.encode("utf-8")
+            self.send_response(sc)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path.rstrip("/").endswith("/status"):
+                self._respond(200, server._status_text(), "text/plain")
+            else:
+                self._respond(404, "Not found", "text/plain")
+
+        def do_POST(self):
+            if not urlparse(self.path).path.rstrip("/").endswith("/interpreter"):
+                self._respond(404, "Not found", "text/plain")
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("utf-8")
+            query = parse_qs(body).get("data", [""])[0]
+            response_json = server._replay(query)
+            if response_json is None:
+                self._respond(404, "Query not recorded", "text/plain")
+            else:
+                self._respond(200, json.dumps(response_json), "application/json")
+
+        def log_message(self, format, *args):
+            pass
+
+    return _Handler
+
+
+def recordings_from_cache(cache_folder=None):
+    """
+    Collect the Overpass responses stored in the cache as recordings.
+
+    Run a download once against the real server with settings.use_cache=True
+    to record its responses. Responses migrated from old cache files with
+    downloader.migrate_cache_folder are skipped, because their URL is unknown.
+
+    Parameters
+    ----------
+    cache_folder : string or pathlib.Path
+        folder of the cache database, if None, use settings.cache_folder
+
+    Returns
+    -------
+    recordings : dict
+        Overpass query string -> JSON response
+    """
+    if cache_folder is None:
+        cache_folder = settings.cache_folder
+    filepath = Path(cache_folder) / downloader._CACHE_DB_FILENAME
+
+    recordings = dict()
+    if not filepath.is_file():
+        return recordings
+
+    # responses migrated from the old cache files have no url, so they cannot be replayed
+    with closing(sqlite3.connect(filepath)) as connection:
+        rows = connection.execute("SELECT url, data FROM responses WHERE url IS NOT NULL").fetchall()
+    for url, data in rows:
+        url = urlparse(url)
+        if url.path.rstrip("/").endswith("/interpreter"):
+            query = parse_qs(url.query).get("data", [None])[0]
+            if query is not None:
+                recordings[query] = json.loads(gzip.decompress(data).decode("utf-8"))
+    return recordings
+
+
+def save_recordings(recordings, filepath):
+    """
+    Save recordings to a gzipped JSON file.
+
+    Parameters
+    ----------
+    recordings : dict
+        Overpass query string -> JSON response
+    filepath : string or pathlib.Path
+        path to the .json.gz file
+
+    Returns
+    -------
+    None
+    """
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(filepath, "wt", encoding="utf-8") as f:
+        json.dump(recordings, f)
+
+
+def load_recordings(filepath):
+    """
+    Load recordings from a gzipped JSON file.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to the .json.gz file
+
+    Returns
+    -------
+    recordings : dict
+        Overpass query string -> JSON response
+    """
+    with gzip.open(filepath, "rt", encoding="utf-8") as f:
+        return json.load(f)
@@ -11,8 +11,13 @@ bidirectional_network_types : list
     Network types for which a fully bidirectional graph will be created.
     Default is `["walk"]`.
 cache_folder : string or pathlib.Path
-    Path to folder in which to save/load HTTP response cache. Default is
-    `"./cache"`.
+    Path to folder in which to save/load HTTP response cache. The responses
+    are stored gzip-compressed in a single SQLite file `cache.sqlite` in this
+    folder. Default is `"./cache"`.
+cache_max_size : int
+    Maximum total size of the compressed responses in the cache, in bytes.
+    When exceeded, the least recently used responses are evicted. If None,
+    the cache size is not limited. Default is `None`.
 cache_only_mode : bool
     If True, download network data from Overpass then raise a
     `CacheOnlyModeInterrupt` error for user to catch. This prevents graph
@@ -21,6 +26,9 @@ cache_only_mode : bool
     only query Overpass one request at a time) then using the local cache to
     quickly build many graphs simultaneously with multiprocessing. Default is
     `False`.
+cache_ttl : int
+    Time to live of cached responses in seconds, older responses are ignored
+    and evicted. If None, cached responses never expire. Default is `None`.
 data_folder : string or pathlib.Path
     Path to folder in which to save/load graph files by default. Default is
     `"./data"`.
@@ -90,6 +98,13 @@ osm_xml_way_tags : list
 overpass_endpoint : string
     The base API url to use for overpass queries. Default is
     `"https://overpass-api.de/api"`.
+overpass_max_workers : int
+    Number of Overpass requests sent at the same time when downloading a
+    network. If greater than 1, the query polygon is split into tiles of at
+    most `overpass_tile_area_size`, each tile and filter statement is sent as
+    its own request through a pool of at most this many workers (and no more
+    than the server's rate limit), and the responses are merged. Default is
+    `1`, which sends one request per sub-divided polygon, one at a time.
 overpass_rate_limit : bool
     If True, check the Overpass server status endpoint for how long to
     pause before making request. Necessary if server uses slot management,
@@ -101,6 +116,10 @@ overpass_settings : string
     {maxsize} values are set dynamically by OSMnx when used.
     To query, for example, historical OSM data as of a certain date:
     `'[out:json][timeout:90][date:"2019-10-28T19:20:00Z"]'`. Use with caution.
+overpass_tile_area_size : int
+    Maximum area of the tiles in meters for concurrent downloads, see
+    `overpass_max_workers`. If None, use `max_query_area_size`. Default is
+    `None`.
 requests_kwargs : dict
     Optional keyword args to pass to the requests package when connecting
     to APIs, for example to configure authentication or provide a path to
@@ -128,7 +147,9 @@ import logging as lg
 all_oneway = False
 bidirectional_network_types = ["walk"]
 cache_folder = "./cache"
+cache_max_size = None
 cache_only_mode = False
+cache_ttl = None
 data_folder = "./data"
 default_accept_language = "en"
 default_access = '["access"!~"private"]'
@@ -151,8 +172,10 @@ osm_xml_node_tags = ["highway"]
 osm_xml_way_attrs = ["id", "timestamp", "uid", "user", "version", "changeset"]
 osm_xml_way_tags = ["highway", "lanes", "maxspeed", "name", "oneway"]
 overpass_endpoint = "https://overpass-api.de/api"
+overpass_max_workers = 1
 overpass_rate_limit = True
 overpass_settings = "[out:json][timeout:{timeout}]{maxsize}"
+overpass_tile_area_size = None
 requests_kwargs = dict()
 timeout = 180
 use_cache = True
@@ -1,12 +1,15 @@
 """Simplify, correct, and consolidate network topology."""
 
+import itertools
 import logging as lg
 
 import geopandas as gpd
 import networkx as nx
+import numpy as np
+import pandas as pd
+import shapely
 from shapely.geometry import LineString
 from shapely.geometry import MultiPolygon
-from shapely.geometry import Point
 from shapely.geometry import Polygon
 
 from . import stats
@@ -93,73 +96,66 @@ def _is_endpoint(G, node, strict=True):
         return False
 
 
-def _build_path(G, endpoint, endpoint_successor, endpoints):
+def _find_endpoints(G, strict=True):
     """
-    Build a path of nodes from one endpoint node to next endpoint node.
+    Find the true endpoints of edges for all nodes at once.
+
+    Array version of `_is_endpoint`, applying the same rules to all nodes
+    with degree and neighbor counts computed from the edge arrays.
 
     Parameters
     ----------
     G : networkx.MultiDiGraph
         input graph
-    endpoint : int
-        the endpoint node from which to start the path
-    endpoint_successor : int
-        the successor of endpoint through which the path to the next endpoint
-        will be built
-    endpoints : set
-        the set of all nodes in the graph that are endpoints
+    strict : bool
+        if False, allow nodes to be end points even if they fail all other rules
+        but have edges with different OSM IDs
 
     Returns
     -------
-    path : list
-        the first and last items in the resulting path list are endpoint
-        nodes, and all other items are interstitial nodes that can be removed
-        subsequently
+    nodes, u, v, is_endpoint : tuple
+        list of the nodes, arrays of the edges' node positions in this list,
+        and a boolean array telling for each node if it is an endpoint
     """
-    # start building path from endpoint node through its successor
-    path = [endpoint, endpoint_successor]
-
-    # for each successor of the endpoint's successor
-    for successor in G.successors(endpoint_successor):
-        if successor not in path:
-            # if this successor is already in the path, ignore it, otherwise add
-            # it to the path
-            path.append(successor)
-            while successor not in endpoints:
-                # find successors (of current successor) not in path
-                successors = [n for n in G.successors(successor) if n not in path]
-
-                # 99%+ of the time there will be only 1 successor: add to path
-                if len(successors) == 1:
-                    successor = successors[0]
-                    path.append(successor)
-
-                # handle relatively rare cases or OSM digitization quirks
-                elif len(successors) == 0:
-                    if endpoint in G.successors(successor):
-                        # we have come to the end of a self-looping edge, so
-                        # add first node to end of path to close it and return
-                        return path + [endpoint]
-                    else:  # pragma: no cover
-                        # this can happen due to OSM digitization error where
-                        # a one-way street turns into a two-way here, but
-                        # duplicate incoming one-way edges are present
-                        utils.log(
-                            f"Unexpected simplify pattern handled near {successor}", level=lg.WARN
-                        )
-                        return path
-                else:  # pragma: no cover
-                    # if successor has >1 successors, then successor must have
-                    # been an endpoint because you can go in 2 new directions.
-                    # this should never occur in practice
-                    raise Exception(f"Unexpected simplify pattern failed near {successor}")
+    nodes = list(G.nodes)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    n = len(nodes)
+    edges = list(G.edges(keys=True, data="osmid"))
+    u = np.array([node_index[edge[0]] for edge in edges], dtype=np.int64)
+    v = np.array([node_index[edge[1]] for edge in edges], dtype=np.int64)
+
+    out_degree = np.bincount(u, minlength=n)
+    in_degree = np.bincount(v, minlength=n)
+    degree = in_degree + out_degree
+
+    # distinct neighbors, counting both directions of each edge
+    pairs = np.unique(np.concatenate([u * n + v, v * n + u]))
+    n_neighbors = np.bincount(pairs // n, minlength=n)
+
+    # rule 1: self-loops
+    is_endpoint = np.zeros(n, dtype=bool)
+    is_endpoint[u[u == v]] = True
+
+    # rule 2: no incoming or no outgoing edges
+    is_endpoint |= (out_degree == 0) | (in_degree == 0)
+
+    # rule 3: not 2 neighbors and a degree of 2 or 4
+    is_endpoint |= ~((n_neighbors == 2) & ((degree == 2) | (degree == 4)))
+
+    # traffic signals
+    is_endpoint |= np.array(
+        [data.get("highway") == "traffic_signals" for node, data in G.nodes(data=True)], dtype=bool
+    )
 
-            # if this successor is an endpoint, we've completed the path
-            return path
+    # rule 4: in non-strict mode, incident edges with different OSM IDs
+    if not strict and len(edges) > 0:
+        osmids = [edge[3] for edge in edges]
+        osmid_codes = pd.factorize(pd.Series(osmids + osmids, dtype=object))[0] + 1
+        n_codes = osmid_codes.max() + 1
+        node_osmids = np.unique(np.concatenate([u, v]) * n_codes + osmid_codes)
+        is_endpoint |= np.bincount(node_osmids // n_codes, minlength=n) > 1
 
-    # if endpoint_successor has no successors not already in the path, return
-    # the current path: this is usually due to a digitization quirk on OSM
-    return path
+    return nodes, u, v, is_endpoint
 
 
 def _get_paths_to_simplify(G, strict=True):
@@ -167,7 +163,9 @@ def _get_paths_to_simplify(G, strict=True):
     Generate all the paths to be simplified between endpoint nodes.
 
     The path is ordered from the first endpoint, through the interstitial nodes,
-    to the second endpoint.
+    to the second endpoint. Paths are generated in the same order, and handle
+    the same digitization quirks, as when walking them node by node in the
+    graph, but the walk only uses the two neighbors of each interstitial node.
 
     Parameters
     ----------
@@ -182,17 +180,69 @@ def _get_paths_to_simplify(G, strict=True):
     path_to_simplify : list
     """
     # first identify all the nodes that are endpoints
-    endpoints = set([n for n in G.nodes if _is_endpoint(G, n, strict=strict)])
+    nodes, u, v, is_endpoint = _find_endpoints(G, strict=strict)
+    endpoints = set([nodes[i] for i in np.flatnonzero(is_endpoint)])
     utils.log(f"Identified {len(endpoints)} edge endpoints")
 
+    # interstitial nodes have exactly two neighbors: for each of them, the two
+    # neighbors and whether there is an edge towards each of them
+    n = len(nodes)
+    pairs = np.unique(np.concatenate([u * n + v, v * n + u]))
+    pairs = pairs[~is_endpoint[pairs // n]]
+    neighbor_a = np.full(n, -1, dtype=np.int64)
+    neighbor_b = np.full(n, -1, dtype=np.int64)
+    neighbor_a[pairs[0::2] // n] = pairs[0::2] % n
+    neighbor_b[pairs[1::2] // n] = pairs[1::2] % n
+    directed = np.unique(u * n + v)
+    interstitial = np.flatnonzero(~is_endpoint)
+    to_a = np.zeros(n, dtype=bool)
+    to_b = np.zeros(n, dtype=bool)
+    to_a[interstitial] = np.isin(interstitial * n + neighbor_a[interstitial], directed)
+    to_b[interstitial] = np.isin(interstitial * n + neighbor_b[interstitial], directed)
+    neighbor_a, neighbor_b, to_a, to_b = neighbor_a.tolist(), neighbor_b.tolist(), to_a.tolist(), to_b.tolist()
+    is_endpoint = is_endpoint.tolist()
+    node_index = {node: i for i, node in enumerate(nodes)}
+
     # for each endpoint node, look at each of its successor nodes
     for endpoint in endpoints:
+        e = node_index[endpoint]
         for successor in G.successors(endpoint):
-            if successor not in endpoints:
-                # if endpoint node's successor is not an endpoint, build path
-                # from the endpoint node, through the successor, and on to the
-                # next endpoint node
-                yield _build_path(G, endpoint, successor, endpoints)
+            s = node_index[successor]
+            if is_endpoint[s]:
+                continue
+
+            # if endpoint node's successor is not an endpoint, build path from
+            # the endpoint node, through the successor, and on to the next
+            # endpoint node
+            path = [e, s]
+            while True:
+                # the neighbor we did not come from, if there is an edge to it
+                if neighbor_a[s] == path[-2]:
+                    following, has_edge = neighbor_b[s], to_b[s]
+                else:
+                    following, has_edge = neighbor_a[s], to_a[s]
+
+                if has_edge and following != e:
+                    path.append(following)
+                    s = following
+                    if is_endpoint[s]:
+                        break
+
+                elif has_edge and len(path) > 2:
+                    # we have come to the end of a self-looping edge, so add
+                    # first node to end of path to close it
+                    path.append(e)
+                    break
+
+                else:
+                    if len(path) > 2:  # pragma: no cover
+                        # this can happen due to OSM digitization error where
+                        # a one-way street turns into a two-way here, but
+                        # duplicate incoming one-way edges are present
+                        utils.log(f"Unexpected simplify pattern handled near {nodes[s]}", level=lg.WARN)
+                    break
+
+            yield [nodes[i] for i in path]
 
 
 def simplify_graph(G, strict=True, remove_rings=True):
@@ -233,12 +283,20 @@ def simplify_graph(G, strict=True, remove_rings=True):
     # define edge segment attributes to sum upon edge simplification
     attrs_to_sum = {"length", "travel_time"}
 
-    # make a copy to not mutate original graph object caller passed in
-    G = G.copy()
     initial_node_count = len(G)
     initial_edge_count = len(G.edges)
     all_nodes_to_remove = []
     all_edges_to_add = []
+    all_paths = []
+
+    # the data of the first edge between each pair of nodes, and the number of
+    # edges between them
+    first_edges = dict()
+    edge_counts = dict()
+    for u, v, key, data in G.edges(keys=True, data=True):
+        edge_counts[u, v] = edge_counts.get((u, v), 0) + 1
+        if key == 0:
+            first_edges[u, v] = data
 
     # generate each path that needs to be simplified
     for path in _get_paths_to_simplify(G, strict=strict):
@@ -251,13 +309,13 @@ def simplify_graph(G, strict=True, remove_rings=True):
             # there should rarely be multiple edges between interstitial nodes
             # usually happens if OSM has duplicate ways digitized for just one
             # street... we will keep only one of the edges (see below)
-            edge_count = G.number_of_edges(u, v)
+            edge_count = edge_counts.get((u, v), 0)
             if edge_count != 1:
                 utils.log(f"Found {edge_count} edges between {u} and {v} when simplifying")
 
             # get edge between these nodes: if multiple edges exist between
             # them (see above), we retain only one in the simplified graph
-            edge_data = G.edges[u, v, 0]
+            edge_data = first_edges[u, v]
             for attr in edge_data:
                 if attr in path_attributes:
                     # if this key already exists in the dict, append it to the
@@ -281,32 +339,50 @@ def simplify_graph(G, strict=True, remove_rings=True):
                 # otherwise, if there are multiple values, keep one of each
                 path_attributes[attr] = list(set(path_attributes[attr]))
 
-        # construct the new consolidated edge's geometry for this path
-        path_attributes["geometry"] = LineString(
-            [Point((G.nodes[node]["x"], G.nodes[node]["y"])) for node in path]
-        )
-
         # add the nodes and edge to their lists for processing at the end
+        all_paths.append(path)
         all_nodes_to_remove.extend(path[1:-1])
-        all_edges_to_add.append(
-            {"origin": path[0], "destination": path[-1], "attr_dict": path_attributes}
+        all_edges_to_add.append((path[0], path[-1], path_attributes))
+
+    # construct the new consolidated edges' geometries for all paths at once
+    if len(all_paths) > 0:
+        node_coords = {node: (data["x"], data["y"]) for node, data in G.nodes(data=True)}
+        coords = np.array(
+            [node_coords[node] for node in itertools.chain.from_iterable(all_paths)], dtype=float
         )
+        indices = np.repeat(np.arange(len(all_paths)), [len(path) for path in all_paths])
+        geometries = shapely.linestrings(coords, indices=indices)
+        for edge, geometry in zip(all_edges_to_add, geometries):
+            edge[2]["geometry"] = geometry
+
+    # make a new graph to not mutate original graph object caller passed in,
+    # without the interstitial nodes between the new edges: the nodes and
+    # edges are in the same order as in a copy of the graph from which these
+    # nodes are removed
+    nodes_to_remove = set(all_nodes_to_remove)
+    H = G.__class__()
+    H.graph.update(G.graph)
+    H.add_nodes_from((node, data) for node, data in G.nodes(data=True) if node not in nodes_to_remove)
+    H.add_edges_from(
+        (u, v, key, data)
+        for u, v, key, data in G.edges(keys=True, data=True)
+        if u not in nodes_to_remove and v not in nodes_to_remove
+    )
+    G = H
 
     # for each edge to add in the list we assembled, create a new edge between
     # the origin and destination
-    for edge in all_edges_to_add:
-        G.add_edge(edge["origin"], edge["destination"], **edge["attr_dict"])
-
-    # finally remove all the interstitial nodes between the new edges
-    G.remove_nodes_from(set(all_nodes_to_remove))
+    G.add_edges_from(all_edges_to_add)
 
     if remove_rings:
         # remove any connected components that form a self-contained ring
         # without any endpoints
+        nodes, _, _, is_endpoint = _find_endpoints(G)
+        endpoints = set([nodes[i] for i in np.flatnonzero(is_endpoint)])
         wccs = nx.weakly_connected_components(G)
         nodes_in_rings = set()
         for wcc in wccs:
-            if not any(_is_endpoint(G, n) for n in wcc):
+            if wcc.isdisjoint(endpoints):
                 nodes_in_rings.update(wcc)
         G.remove_nodes_from(nodes_in_rings)
 
@@ -278,8 +278,23 @@ def count_streets_per_node(G, nodes=None):
         counts of how many physical streets connect to each node, with keys =
         node ids and values = counts
     """
-    if nodes is None:
-        nodes = G.nodes
+    if nodes is not None:
+        # count only around the requested nodes instead of over all edges
+        streets_per_node = dict()
+        for node in nodes:
+            if node not in G:
+                streets_per_node[node] = 0
+                continue
+            neighbors = set(G.adj[node])
+            if G.is_directed():
+                neighbors.update(G.pred[node])
+            streets_per_node[node] = sum(
+                2 * _pair_street_count(G, node, node) if nbr == node else _pair_street_count(G, node, nbr)
+                for nbr in neighbors
+            )
+        return streets_per_node
+
+    nodes = G.nodes
 
     # get one copy of each self-loop edge, because bi-directional self-loops
     # appear twice in the undirected graph (u,v,0 and u,v,1 where u=v), but
@@ -307,6 +322,122 @@ def count_streets_per_node(G, nodes=None):
     return streets_per_node
 
 
+def _pair_street_count(G, u, v):
+    """
+    Count the physical streets between two nodes, as count_streets_per_node.
+
+    Edges in both directions with the same key are one street, and all
+    self-loops of a node are one street.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+    u : int
+        node ID
+    v : int
+        node ID
+
+    Returns
+    -------
+    count : int
+    """
+    if u == v:
+        return int(G.has_edge(u, u))
+    keys = set(G.adj[u].get(v, {}))
+    if G.is_directed():
+        keys.update(G.pred[u].get(v, {}))
+    return len(keys)
+
+
+def _shift_street_count(G, u, v, delta):
+    """
+    Add the change in streets between two nodes to their street_count.
+
+    Nodes without a street_count attribute are left without it.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+    u : int
+        node ID
+    v : int
+        node ID
+    delta : int
+        change in the number of streets between u and v
+
+    Returns
+    -------
+    None
+    """
+    if delta == 0:
+        return
+    # a self-loop counts twice for its node, like an ordinary street
+    for node in (u, v):
+        if node in G and G.nodes[node].get("street_count") is not None:
+            G.nodes[node]["street_count"] += delta
+
+
+def add_edge(G, u, v, key=None, **attr):
+    """
+    Add an edge to the graph and update the street_count of its nodes.
+
+    Use this instead of `G.add_edge` to keep the `street_count` attributes up
+    to date without recounting the whole graph, see `count_streets_per_node`.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph, modified in place
+    u : int
+        origin node ID
+    v : int
+        destination node ID
+    key : int
+        edge key, if None, the lowest unused key
+    attr : dict
+        edge attributes
+
+    Returns
+    -------
+    key : int
+        the key of the added edge
+    """
+    before = _pair_street_count(G, u, v)
+    key = G.add_edge(u, v, key=key, **attr)
+    _shift_street_count(G, u, v, _pair_street_count(G, u, v) - before)
+    return key
+
+
+def remove_edge(G, u, v, key=None):
+    """
+    Remove an edge from the graph and update the street_count of its nodes.
+
+    Use this instead of `G.remove_edge` to keep the `street_count` attributes
+    up to date without recounting the whole graph, see
+    `count_streets_per_node`.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph, modified in place
+    u : int
+        origin node ID
+    v : int
+        destination node ID
+    key : int
+        edge key, if None, remove the most recently added edge between u and v
+
+    Returns
+    -------
+    None
+    """
+    before = _pair_street_count(G, u, v)
+    G.remove_edge(u, v, key=key)
+    _shift_street_count(G, u, v, _pair_street_count(G, u, v) - before)
+
+
 def basic_stats(G, area=None, clean_int_tol=None):
     """
     Calculate basic descriptive geometric and topological measures of a graph.
@@ -1,9 +1,20 @@
 import copy, math
+import functools
+import inspect
+import json
+import os
+from hashlib import sha1
+from pathlib import Path
 import networkx as nx
 import geopandas as gpd
-from . import utils, distribution, space_allocation, hierarchy, street_graph, graph, io, merge_edges, lane_graph
+import numpy as np
+import scipy.sparse
+import shapely
+from scipy.sparse import csgraph
+from . import utils, distribution, space_allocation, hierarchy, street_graph, graph, io, merge_edges, lane_graph, _errors
 from .constants import *
 from . import osmnx_customized as oxc
+from ._version import __version__
 
 
 def link_elimination(L, verbose=False):
@@ -529,7 +540,7 @@ def multi_set_given_lanes(
         data[target_lanes_attribute] = target_lanes
 
 
-def is_strongly_connected_plus(L, weight, node_inclusion, exclude_edges=()):
+def is_strongly_connected_plus(L, weight, node_inclusion, exclude_edges=(), backend='networkx'):
     """
     Checks if the lane graph would still fulfill the 'strongly connected' requirement after removing a set of edges.
     A helper function for the built-in, as well as any custom helper function.
@@ -540,12 +551,17 @@ def is_strongly_connected_plus(L, weight, node_inclusion, exclude_edges=()):
     weight
     node_inclusion
     exclude_edges
+    backend : str
+        'networkx' or 'sparse' for scipy.sparse.csgraph, which avoids copying the lane graph
 
     Returns
     -------
 
     """
 
+    if backend == 'sparse':
+        return _is_strongly_connected_plus_sparse(L, weight, node_inclusion, exclude_edges)
+
     # read from L and delete from M
     M = copy.deepcopy(L)
 
@@ -573,15 +589,109 @@ def is_strongly_connected_plus(L, weight, node_inclusion, exclude_edges=()):
     return nx.is_strongly_connected(M)
 
 
+def _is_strongly_connected_plus_sparse(L, weight, node_inclusion, exclude_edges):
+    """
+    The same as is_strongly_connected_plus() but using scipy.sparse.csgraph
+    """
+
+    return _is_strongly_connected_plus_sparse_batch(L, weight, node_inclusion, [exclude_edges])[0]
+
+
+def is_strongly_connected_plus_batch(L, weight, node_inclusion, exclude_edge_sets, backend='networkx'):
+    """
+    The same as is_strongly_connected_plus() for several alternative sets of edges to exclude,
+    each of them tested on its own against the same lane graph.
+
+    Parameters
+    ----------
+    L
+    weight
+    node_inclusion
+    exclude_edge_sets : list
+        a list of edge lists, one connectivity check for each of them
+    backend : str
+        'networkx' or 'sparse', with 'sparse', the lane graph is compiled only once for all checks
+
+    Returns
+    -------
+    list
+        a bool for each set of excluded edges
+    """
+
+    if backend == 'sparse':
+        return _is_strongly_connected_plus_sparse_batch(L, weight, node_inclusion, exclude_edge_sets)
+
+    return [
+        is_strongly_connected_plus(L, weight, node_inclusion, exclude_edges=exclude_edges, backend=backend)
+        for exclude_edges in exclude_edge_sets
+    ]
+
+
+def _is_strongly_connected_plus_sparse_batch(L, weight, node_inclusion, exclude_edge_sets):
+    """
+    The same as is_strongly_connected_plus_batch() but using scipy.sparse.csgraph
+    """
+
+    nodes = list(L.nodes)
+    node_index = {node: i for i, node in enumerate(nodes)}
+
+    # exclude edges based on their weight
+    edges = [uvk for uvk, data in L.edges.items() if data.get(weight) != math.inf]
+    edge_index = {uvk: i for i, uvk in enumerate(edges)}
+
+    # exclude nodes based on a given attribute, if they have no edges left
+    has_edges = np.zeros(len(nodes), dtype=bool)
+    for u, v, k in edges:
+        has_edges[node_index[u]] = True
+        has_edges[node_index[v]] = True
+    included = has_edges | np.array([data.get(node_inclusion, False) == True for i, data in L.nodes.items()], dtype=bool)
+
+    if not included.any():
+        raise nx.NetworkXPointlessConcept('Connectivity is undefined for the null graph.')
+
+    included_index = np.cumsum(included) - 1
+    u = np.array([included_index[node_index[uvk[0]]] for uvk in edges], dtype=np.int64)
+    v = np.array([included_index[node_index[uvk[1]]] for uvk in edges], dtype=np.int64)
+    n = int(included.sum())
+
+    results = []
+    for exclude_edges in exclude_edge_sets:
+        exclude_edges = set(exclude_edges)
+
+        # exclude edges based on an optional list
+        if not exclude_edges.issubset(edge_index):
+            raise nx.NetworkXError('The edges ' + str(exclude_edges.difference(edges)) + ' are not in the graph')
+        keep = np.ones(len(edges), dtype=bool)
+        keep[[edge_index[uvk] for uvk in exclude_edges]] = False
+
+        # count the strongly connected components among the included nodes
+        matrix = scipy.sparse.csr_matrix((np.ones(int(keep.sum())), (u[keep], v[keep])), shape=(n, n))
+        n_components, labels = csgraph.connected_components(matrix, directed=True, connection='strong')
+        results.append(n_components == 1)
+
+    return results
+
+
 def _remove_car_lanes(
         L, L_existing,
         G, width_attribute,
-        verbose
+        verbose,
+        backend='networkx',
+        contract=False,
+        batch_size=1
 ):
     """
     a helper for multi_rebuild(), takes care of the car lanes removal
+
+    In each iteration, the batch_size candidates with the highest priority are checked against the same lane graph,
+    then the removable ones are removed together, at most one per street, and those that cannot be removed are fixed.
+    If removing them together would break the strong connectivity, only the first one is removed.
+    With batch_size=1, only one candidate is checked per iteration.
     """
 
+    if batch_size < 1:
+        raise _errors.OptionNotImplemented('batch_size=' + str(batch_size) + ' is not valid')
+
     i = 1
     while True:
 
@@ -590,7 +700,12 @@ def _remove_car_lanes(
         i += 1
 
         # calculate betweenness centrality
-        bc = nx.edge_betweenness_centrality(L, weight='cost_' + MODE_PRIVATE_CARS)
+        if contract:
+            H = graph.contract_parallel_edges(L, 'cost_' + MODE_PRIVATE_CARS, other_weights=())
+            bc = nx.edge_betweenness_centrality(H, weight='cost_' + MODE_PRIVATE_CARS)
+            bc = graph.expand_contracted_edge_values(L, H, bc)
+        else:
+            bc = nx.edge_betweenness_centrality(L, weight='cost_' + MODE_PRIVATE_CARS)
         nx.set_edge_attributes(L, bc, 'bc_' + MODE_PRIVATE_CARS)
 
         # calculate excess width (how much wider are the new lanes than the old ones)
@@ -622,42 +737,65 @@ def _remove_car_lanes(
             )
         )
 
-        removal_candidate_car = removal_candidates_car[-1]
-        remove_edge_uvk = removal_candidate_car[0]
-        remove_edge_data = removal_candidate_car[1]
+        # check the candidates with the highest priority, from the end of the list
+        batch = []
+        for remove_edge_uvk, remove_edge_data in removal_candidates_car[:-batch_size - 1:-1]:
 
-        remove_edge_uvks_to_test = [remove_edge_uvk]
-        opposite_edge_uvk = (remove_edge_uvk[1], remove_edge_uvk[0], remove_edge_uvk[2])
+            remove_edge_uvks_to_test = [remove_edge_uvk]
+            opposite_edge_uvk = (remove_edge_uvk[1], remove_edge_uvk[0], remove_edge_uvk[2])
 
-        # add connected edges that would need to be removed as well
-        if remove_edge_data['coupled_with_opposite_direction']:
-            remove_edge_uvks_to_test.append(opposite_edge_uvk)
+            # add connected edges that would need to be removed as well
+            if remove_edge_data['coupled_with_opposite_direction']:
+                remove_edge_uvks_to_test.append(opposite_edge_uvk)
+
+            # is the last direction of a mandatory lane with direction tbd?
+            is_last_direction_of_mandatory_lane = \
+                remove_edge_data['mandatory_lane'] == True \
+                and not L.has_edge(*opposite_edge_uvk)
+
+            batch.append((remove_edge_uvk, remove_edge_data, remove_edge_uvks_to_test, is_last_direction_of_mandatory_lane))
 
         # is still strongly connected?
-        is_strongly_connected = is_strongly_connected_plus(
+        are_strongly_connected = is_strongly_connected_plus_batch(
             L, 'cost_private_cars', 'needs_access_by_private_cars',
-            exclude_edges=remove_edge_uvks_to_test
+            [remove_edge_uvks_to_test for _, _, remove_edge_uvks_to_test, _ in batch],
+            backend=backend
         )
 
-        # is the last direction of a mandatory lane with direction tbd?
-        is_last_direction_of_mandatory_lane = \
-            remove_edge_data['mandatory_lane'] == True \
-            and not L.has_edge(*opposite_edge_uvk)
+        # select the removable candidates, at most one per street so that the excess widths stay valid
+        to_remove = []
+        streets = set()
+        for (remove_edge_uvk, remove_edge_data, remove_edge_uvks_to_test, is_last_direction_of_mandatory_lane), \
+                is_strongly_connected in zip(batch, are_strongly_connected):
 
-        if is_strongly_connected and not is_last_direction_of_mandatory_lane:
+            if is_strongly_connected and not is_last_direction_of_mandatory_lane:
+                street = (remove_edge_data['u_G'], remove_edge_data['v_G'], remove_edge_data['k_G'])
+                if street not in streets:
+                    streets.add(street)
+                    to_remove.append((remove_edge_uvk, remove_edge_uvks_to_test))
 
+            else:
+                # removing other lanes never makes this one removable, so it can be fixed right away
+                if verbose:
+                    print(remove_edge_uvk, is_strongly_connected, is_last_direction_of_mandatory_lane)
+                L.edges[remove_edge_uvk]['fixed'] = True
+                L.edges[remove_edge_uvk]['twin_factor'] = 1
+                if verbose:
+                    print('fixed', remove_edge_uvk)
+
+        # verify that the removals together keep the lane graph strongly connected, otherwise roll back to the first
+        if len(to_remove) > 1 and not is_strongly_connected_plus(
+            L, 'cost_private_cars', 'needs_access_by_private_cars',
+            exclude_edges=list({uvk for _, uvks_to_test in to_remove for uvk in uvks_to_test}),
+            backend=backend
+        ):
+            to_remove = to_remove[:1]
+
+        for remove_edge_uvk, _ in to_remove:
             L.remove_edge(*remove_edge_uvk)
             if verbose:
                 print('removed', remove_edge_uvk)
 
-        else:
-            if verbose:
-                print(remove_edge_uvk, is_strongly_connected, is_last_direction_of_mandatory_lane)
-            L.edges[remove_edge_uvk]['fixed'] = True
-            L.edges[remove_edge_uvk]['twin_factor'] = 1
-            if verbose:
-                print('fixed', remove_edge_uvk)
-
 
 def _remove_parking(
         L, L_existing,
@@ -712,7 +850,8 @@ def _remove_parking(
 def _remove_cycling_lanes(
         L, L_existing,
         G, width_attribute,
-        verbose
+        verbose,
+        backend='networkx'
 ):
     """
     a helper for multi_rebuild(), takes care of cycling lanes removal
@@ -756,7 +895,8 @@ def _remove_cycling_lanes(
         # is still strongly connected?
         sc = is_strongly_connected_plus(
             L, 'cost_cycling', 'needs_access_by_cycling',
-            exclude_edges={remove_edge_uvk}
+            exclude_edges={remove_edge_uvk},
+            backend=backend
         )
 
         if sc:
@@ -870,7 +1010,10 @@ def _adjust_non_traffic(
 def multi_rebuild(
         L, L_existing,
         G, width_attribute,
-        verbose=False
+        verbose=False,
+        backend='networkx',
+        contract=False,
+        batch_size=1
 ):
     """
     Default rebuilding function based on a heuristic of removing links from a lane graph.
@@ -889,6 +1032,15 @@ def multi_rebuild(
     width_attribute: str
         the attribute key to find the width of each street in the street graph
     verbose: bool
+    backend: str
+        'networkx' or 'sparse', for the connectivity checks, see is_strongly_connected_plus(),
+        use functools.partial to pass it through multi_rebuild_regions()
+    contract: bool
+        calculate the betweenness centrality on a graph where the parallel lanes are contracted
+        into single edges, see graph.contract_parallel_edges(), which gives exactly the same results
+    batch_size: int
+        number of car lane removal candidates checked per iteration, see _remove_car_lanes(),
+        larger batches need fewer iterations but may give slightly different results than the default of 1
 
     Returns
     -------
@@ -897,7 +1049,9 @@ def multi_rebuild(
 
     if verbose:
         print('---- removing car lanes ------')
-    _remove_car_lanes(L, L_existing, G, width_attribute, verbose)
+    _remove_car_lanes(
+        L, L_existing, G, width_attribute, verbose, backend=backend, contract=contract, batch_size=batch_size
+    )
 
     if verbose:
         print('---- removing parking ------')
@@ -905,7 +1059,7 @@ def multi_rebuild(
 
     if verbose:
         print('---- removing cycling lanes ------')
-    _remove_cycling_lanes(L, L_existing, G, width_attribute, verbose)
+    _remove_cycling_lanes(L, L_existing, G, width_attribute, verbose, backend=backend)
 
     if verbose:
         print('---- merging transit lanes with car lanes ------')
@@ -965,6 +1119,7 @@ def multi_rebuild_regions(
         export_L=None, export_H=None,
         export_when=None,
         verbose=False,
+        cache_dir=None,
 ):
     """
     Process each rebuilding region. By default, the redesign process is defined by the built-in functions
@@ -972,6 +1127,9 @@ def multi_rebuild_regions(
 
     However, they can be overridden by custom functions to generate alternative design scenarios.
 
+    With a cache_dir, the rebuilt lanes of each region are cached, so that rerunning a scenario after
+    editing some regions recomputes only the regions whose inputs have changed.
+
     Parameters
     ----------
     G: nx.GeoDataFrame
@@ -999,6 +1157,11 @@ def multi_rebuild_regions(
         the attribute where the resulting lanes will be stored
     verbose: bool
         for debugging
+    cache_dir: str
+        if given, the folder where the rebuilt lanes of each region are cached, keyed by a checksum of the
+        region's subgraph with all its attributes, the region parameters, the source code of the rebuilding,
+        given lanes and needed node access functions, and the snman version,
+        nothing is exported for regions taken from the cache
 
     Returns
     -------
@@ -1034,6 +1197,29 @@ def multi_rebuild_regions(
         if len(H.edges) == 0:
             continue
 
+        # replay the rebuilt lanes from the cache if this region has been rebuilt before with the same inputs
+        if cache_dir:
+            cache_filepath = _rebuilding_cache_filepath(
+                cache_dir, H,
+                {
+                    'hierarchies_to_include': hierarchies_to_include,
+                    'hierarchies_to_fix': hierarchies_to_fix,
+                    'keep_all_streets': rebuilding_region['keep_all_streets'],
+                    'public_transit_mode': public_transit_mode,
+                    'parking_mode': parking_mode,
+                    'width_attribute': width_attribute,
+                    'existing_lanes_attribute': existing_lanes_attribute,
+                    'given_lanes_attribute': given_lanes_attribute,
+                    'target_lanes_attribute': target_lanes_attribute,
+                },
+                (rebuilding_function, given_lanes_function, needed_node_access_function)
+            )
+            cached_lanes = _load_rebuilding_cache(cache_filepath)
+            if cached_lanes is not None:
+                print('replay cached result')
+                nx.set_edge_attributes(G, cached_lanes, KEY_LANES_DESCRIPTION_AFTER)
+                continue
+
         # keep only hierarchies to include
         H = street_graph.filter_by_hierarchy(H, hierarchies_to_include)
 
@@ -1084,4 +1270,101 @@ def multi_rebuild_regions(
                 io.export_street_graph(H, *export_H)
 
         # write rebuilt lanes from the subgraph into the main graph
-        nx.set_edge_attributes(G, nx.get_edge_attributes(H, KEY_LANES_DESCRIPTION_AFTER), KEY_LANES_DESCRIPTION_AFTER)
+        rebuilt_lanes = nx.get_edge_attributes(H, KEY_LANES_DESCRIPTION_AFTER)
+        if cache_dir:
+            # cache only the lanes that this region changes in the main graph
+            _save_rebuilding_cache(cache_filepath, {
+                uvk: lanes for uvk, lanes in rebuilt_lanes.items()
+                if G.has_edge(*uvk) and G.edges[uvk].get(KEY_LANES_DESCRIPTION_AFTER) != lanes
+            })
+        nx.set_edge_attributes(G, rebuilt_lanes, KEY_LANES_DESCRIPTION_AFTER)
+
+
+def _checksum_repr(value):
+    """
+    Returns a representation of a value that does not depend on the order of sets or dicts
+    and includes the full geometries, for calculating checksums
+    """
+
+    if isinstance(value, shapely.Geometry):
+        return value.wkb_hex
+    if isinstance(value, (set, frozenset)):
+        return repr(sorted(_checksum_repr(item) for item in value))
+    if isinstance(value, dict):
+        return repr(sorted((repr(key), _checksum_repr(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return repr([_checksum_repr(item) for item in value])
+    return repr(value)
+
+
+def _function_checksum_repr(function):
+    """
+    Returns a representation of a function for calculating checksums: its name and the source code of its module,
+    so that the checksum changes if the function or any helper in the same module is edited,
+    for functools.partial also the bound arguments
+    """
+
+    if isinstance(function, functools.partial):
+        return repr((
+            _function_checksum_repr(function.func),
+            _checksum_repr(function.args),
+            _checksum_repr(function.keywords)
+        ))
+
+    try:
+        source = inspect.getsource(inspect.getmodule(function))
+    except (OSError, TypeError):
+        source = ''
+    return repr((
+        getattr(function, '__module__', None),
+        getattr(function, '__qualname__', repr(function)),
+        sha1(source.encode('utf-8')).hexdigest()
+    ))
+
+
+def _rebuilding_cache_filepath(cache_dir, H, region_parameters, functions):
+    """
+    Returns the path of the cache file for rebuilding a region.
+    The name is a checksum of the nodes and edges in the region's subgraph H with all their attributes,
+    the region parameters, the functions used for rebuilding, and the snman version.
+    """
+
+    checksum = sha1()
+    checksum.update(__version__.encode('utf-8'))
+    for node, data in sorted(H.nodes.items()):
+        checksum.update(repr((node, _checksum_repr(data))).encode('utf-8'))
+    for uvk, data in sorted(H.edges.items()):
+        checksum.update(repr((uvk, _checksum_repr(data))).encode('utf-8'))
+    checksum.update(_checksum_repr(region_parameters).encode('utf-8'))
+    for function in functions:
+        checksum.update(_function_checksum_repr(function).encode('utf-8'))
+
+    return Path(cache_dir) / ('rebuilding_' + checksum.hexdigest() + '.json')
+
+
+def _load_rebuilding_cache(cache_filepath):
+    """
+    Loads the cached rebuilt lanes as a dictionary {(u, v, key): lanes}, or None if there is no cache file
+    """
+
+    if not cache_filepath.is_file():
+        return None
+
+    cache = json.loads(cache_filepath.read_text(encoding='utf-8'))
+    # json stores the edge ids as lists, convert them back to tuples
+    return {(u, v, k): lanes for u, v, k, lanes in cache}
+
+
+def _save_rebuilding_cache(cache_filepath, rebuilt_lanes):
+    """
+    Saves the rebuilt lanes, writing to a temporary file first so that an interrupted run
+    does not leave a broken cache file behind
+    """
+
+    cache_filepath.parent.mkdir(parents=True, exist_ok=True)
+    temporary_filepath = cache_filepath.with_suffix('.tmp')
+    temporary_filepath.write_text(
+        json.dumps([[*uvk, lanes] for uvk, lanes in rebuilt_lanes.items()], default=int),
+        encoding='utf-8'
+    )
+    os.replace(temporary_filepath, cache_filepath)
@@ -241,14 +241,10 @@ def consolidate_intersections(G, intersections_gdf, reconnect_edges=True):
                 y=nodes_subset["y"].iloc[0],
             )
 
-    # calculate street_count attribute for all nodes lacking it
-    null_nodes = [n for n, sc in H.nodes(data="street_count") if sc is None]
-    street_count = oxc.stats.count_streets_per_node(H, nodes=null_nodes)
-    nx.set_node_attributes(H, street_count, name="street_count")
-
     if not G.edges or not reconnect_edges:
         # if reconnect_edges is False or there are no edges in original graph
         # (after dead-end removed), then skip edges and return new graph as-is
+        street_graph.update_precalculated_attributes(H)
         return H
 
     # STEP 6
@@ -271,6 +267,9 @@ def consolidate_intersections(G, intersections_gdf, reconnect_edges=True):
             #if u2 > v2:
             #    street_graph.reverse_edge(H, u2, v2, key2, reverse_topology=True)
 
+    # calculate street_count attribute for all nodes, now that the edges are reconnected
+    street_graph.update_precalculated_attributes(H)
+
     # STEP 7
     # for every group of merged nodes with more than 1 node in it, extend the
     # edge geometries to reach the new node point
@@ -480,8 +479,8 @@ def connect_components_in_intersections(Gc, intersections_gdf, separate_layers=T
                     shp.ops.Point(b_data.get('x'), b_data.get('y'))
                 ))
 
-                Gc.add_edge(
-                    a, b, geometry=geom,
+                oxc.stats.add_edge(
+                    Gc, a, b, geometry=geom,
                     osmid=0,
                     _components_connector=True
                 )
@@ -0,0 +1,203 @@
+import numpy as np
+import scipy.sparse
+from scipy.sparse import csgraph
+from .constants import *
+
+
+DEFAULT_WEIGHTS = ('cost_' + MODE_PRIVATE_CARS, 'cost_' + MODE_CYCLING, 'length')
+
+
+class SparseGraph:
+    """
+    A street graph or lane graph compiled into sparse matrices, one per cost attribute,
+    for fast shortest path and connectivity calculations using scipy.sparse.csgraph
+
+    Parallel edges are reduced to the one with the lowest cost, edges with infinite cost are left out.
+    Edges without the cost attribute get a cost of 1, like in networkx.
+    """
+
+    def __init__(self, G, weights=DEFAULT_WEIGHTS):
+        """
+        Compiles the graph
+
+        Parameters
+        ----------
+        G : nx.MultiDiGraph
+            street graph or lane graph
+        weights : tuple
+            edge attributes to be compiled into a matrix each
+        """
+
+        self.directed = G.is_directed()
+        self.nodes = list(G.nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+
+        edges = list(G.edges(keys=True, data=True)) if G.is_multigraph() else list(G.edges(data=True))
+        # edge ids (u, v, key) or (u, v), in the order of G.edges
+        self.edges = [edge[:-1] for edge in edges]
+        u = np.array([self.node_index[edge[0]] for edge in edges], dtype=np.int64)
+        v = np.array([self.node_index[edge[1]] for edge in edges], dtype=np.int64)
+
+        # a matrix without weights for connectivity
+        self.matrices = {}
+        # for each matrix entry, the position of the underlying edge in self.edges
+        self.edge_positions = {}
+        self.matrices[None], self.edge_positions[None] = self._to_csr(u, v, np.ones(len(edges)))
+
+        for weight in weights:
+            values = np.array([edge[-1].get(weight, 1) for edge in edges], dtype=float)
+            self.matrices[weight], self.edge_positions[weight] = self._to_csr(u, v, values)
+
+    def _to_csr(self, u, v, values):
+        """
+        Builds a csr matrix, keeping the minimum value for parallel edges,
+        and a matrix with the same structure holding the positions of the kept edges
+        """
+
+        n = len(self.nodes)
+        positions = np.flatnonzero(np.isfinite(values))
+        u, v, values = u[positions], v[positions], values[positions]
+
+        # sort by u, v, value and keep the first entry for each u, v
+        order = np.lexsort((values, v, u))
+        u, v, values, positions = u[order], v[order], values[order], positions[order]
+        first = np.ones(len(u), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+
+        # zero-cost edges are kept as explicit zeros, which csgraph treats as edges
+        matrix = scipy.sparse.csr_matrix((values[first], (u[first], v[first])), shape=(n, n))
+        # the entries are unique and sorted by u, v, so they are in the same order as in the matrix
+        edge_positions = scipy.sparse.csr_matrix(
+            (positions[first], matrix.indices, matrix.indptr), shape=(n, n)
+        )
+        return matrix, edge_positions
+
+    def matrix(self, weight=None):
+        """
+        Returns the csr matrix for a weight, or the unweighted matrix if weight is None
+        """
+
+        return self.matrices[weight]
+
+    def indices(self, nodes):
+        """
+        Converts node ids into matrix indices
+        """
+
+        return np.array([self.node_index[node] for node in nodes], dtype=np.int64)
+
+    def edge_path(self, weight, predecessors, target):
+        """
+        Reconstructs the shortest path to a target from a row of predecessors returned by distances()
+
+        Parameters
+        ----------
+        weight : str
+            compiled cost attribute, the same as for the predecessors
+        predecessors : np.ndarray
+            predecessor indices for one source
+        target : int
+            matrix index of the target node
+
+        Returns
+        -------
+        np.ndarray
+            positions of the edges along the path in self.edges, empty if the target is the source or unreachable
+        """
+
+        nodes = [target]
+        while predecessors[nodes[-1]] >= 0:
+            nodes.append(predecessors[nodes[-1]])
+        nodes.reverse()
+        if len(nodes) < 2:
+            return np.array([], dtype=np.int64)
+        return np.asarray(self.edge_positions[weight][nodes[:-1], nodes[1:]], dtype=np.int64).ravel()
+
+    def node_ids(self, indices):
+        """
+        Converts matrix indices into node ids, -9999 (no predecessor) becomes None
+        """
+
+        return [self.nodes[i] if i >= 0 else None for i in indices]
+
+    def distances(self, weight, sources=None, return_predecessors=False, limit=np.inf, min_only=False, reverse=False):
+        """
+        Shortest path costs from each source to all nodes (multi-source if min_only=True)
+
+        Parameters
+        ----------
+        weight : str
+            compiled cost attribute
+        sources : list
+            source node ids, all nodes if None
+        return_predecessors : bool
+            also return the predecessor indices for reconstructing the paths
+        limit : float
+            do not search beyond this cost, nodes further away get np.inf
+        min_only : bool
+            return only the cost from the nearest source for each node
+        reverse : bool
+            search against the edge directions, which gives the costs from all nodes to each source
+
+        Returns
+        -------
+        np.ndarray or tuple
+            a matrix (sources x nodes) of costs, or a vector if min_only=True,
+            the predecessors (and, if min_only=True, the nearest sources) as indices
+        """
+
+        indices = None if sources is None else self.indices(sources)
+        matrix = self.matrices[weight].T.tocsr() if reverse and self.directed else self.matrices[weight]
+        return csgraph.dijkstra(
+            matrix, directed=self.directed, indices=indices,
+            return_predecessors=return_predecessors, limit=limit, min_only=min_only
+        )
+
+    def sum_of_distances(self, weight, chunk_size=500):
+        """
+        Sum of the shortest path costs over all pairs of nodes, calculated in chunks of sources to limit memory
+
+        Returns
+        -------
+        tuple
+            sum over all reachable pairs, number of unreachable pairs
+        """
+
+        total = 0
+        n_unreachable = 0
+        for start in range(0, len(self.nodes), chunk_size):
+            indices = np.arange(start, min(start + chunk_size, len(self.nodes)))
+            dist = csgraph.dijkstra(self.matrices[weight], directed=self.directed, indices=indices)
+            reachable = np.isfinite(dist)
+            total += dist[reachable].sum()
+            n_unreachable += (~reachable).sum()
+        return total, int(n_unreachable)
+
+    def connected_components(self, connection='strong'):
+        """
+        Returns the connected components as sets of node ids, like networkx
+
+        Parameters
+        ----------
+        connection : str
+            'strong' or 'weak', only relevant for directed graphs
+        """
+
+        n_components, labels = csgraph.connected_components(
+            self.matrices[None], directed=self.directed, connection=connection
+        )
+        components = [set() for i in range(n_components)]
+        for node, label in zip(self.nodes, labels):
+            components[label].add(node)
+        return components
+
+    def largest_connected_component(self, connection='strong'):
+        """
+        Returns the node ids of the largest connected component
+        """
+
+        n_components, labels = csgraph.connected_components(
+            self.matrices[None], directed=self.directed, connection=connection
+        )
+        largest = np.argmax(np.bincount(labels))
+        return set(np.array(self.nodes, dtype=object)[labels == largest])
@@ -1,7 +1,9 @@
 from .constants import *
-from . import space_allocation, street_graph, graph, lane_graph
+from . import space_allocation, street_graph, graph, lane_graph, utils, _errors
 from . import osmnx_customized as oxc
 import copy
+import multiprocessing as mp
+import numbers
 import networkx as nx
 import pandas as pd
 
@@ -35,23 +37,99 @@ def street_sections_change(
     G = copy.deepcopy(G)
 
 
-def network_metrics_for_all_measurement_regions(G, measurement_regions_gdf, plot_scc=False):
+NETWORK_METRICS_CONFIGS = [
+    {
+        'label': 'CARS BEFORE',
+        'lanes': KEY_LANES_DESCRIPTION,
+        'mode': MODE_PRIVATE_CARS
+    },
+    {
+        'label': 'CARS AFTER',
+        'lanes': KEY_LANES_DESCRIPTION_AFTER,
+        'mode': MODE_PRIVATE_CARS
+    },
+    {
+        'label': 'CYCLING BEFORE',
+        'lanes': KEY_LANES_DESCRIPTION,
+        'mode': MODE_CYCLING
+    },
+    {
+        'label': 'CYCLING AFTER',
+        'lanes': KEY_LANES_DESCRIPTION_AFTER,
+        'mode': MODE_CYCLING
+    },
+    {
+        'label': 'TRANSIT BEFORE',
+        'lanes': KEY_LANES_DESCRIPTION,
+        'mode': MODE_TRANSIT
+    },
+    {
+        'label': 'TRANSIT AFTER',
+        'lanes': KEY_LANES_DESCRIPTION_AFTER,
+        'mode': MODE_TRANSIT
+    },
+]
 
-    metrics = measurement_regions_gdf.apply(
-        lambda row: (
-            row.name,
-            network_metrics(
-                oxc.truncate.truncate_graph_polygon(G, row['geometry'], quadrat_width=100, retain_all=True),
-                plot_scc=plot_scc
-            )
-        ),
-        axis=1
+
+def network_metrics_for_all_measurement_regions(
+        G, measurement_regions_gdf, plot_scc=False, engine='networkx', cpus=1, sample_pairs=None
+):
+    """
+    Generates a set of standard metrics for each measurement region, see network_metrics()
+
+    Parameters
+    ----------
+    G : nx.MultiDiGraph
+        street graph
+    measurement_regions_gdf : gpd.GeoDataFrame
+        see io.load_measurement_regions()
+    plot_scc : bool
+    engine : str
+        shortest path engine, see lane_graph.calculate_stats()
+    cpus : int
+        number of worker processes, all regions and configurations are processed in parallel,
+        each worker receives only the subgraph of its region, use None for all available cpus
+    sample_pairs : int or pd.DataFrame
+        estimate the shortest path statistics from a sample of node pairs, see network_metrics()
+
+    Returns
+    -------
+    dict
+        {region name: pd.DataFrame}
+    """
+
+    subgraphs = {
+        name: oxc.truncate.truncate_graph_polygon(G, geometry, quadrat_width=100, retain_all=True)
+        for name, geometry in measurement_regions_gdf['geometry'].items()
+    }
+
+    # empty regions get an empty dataframe, like in network_metrics()
+    tasks = [
+        (name, config)
+        for name, H in subgraphs.items()
+        if len(H.edges) > 0
+        for config in NETWORK_METRICS_CONFIGS
+    ]
+
+    samples = {name: _prepare_sample_pairs(H, sample_pairs) for name, H in subgraphs.items()}
+
+    results = _generate_metrics_for_configs(
+        [
+            (subgraphs[name], config['label'], config['lanes'], config['mode'], plot_scc, engine, samples[name])
+            for name, config in tasks
+        ],
+        cpus
     )
 
-    return dict(list(metrics))
+    return {
+        name: _metrics_to_dataframe([
+            stats for (task_name, config), stats in zip(tasks, results) if task_name == name
+        ])
+        for name in subgraphs.keys()
+    }
 
 
-def network_metrics(G, plot_scc=False):
+def network_metrics(G, plot_scc=False, engine='networkx', cpus=1, sample_pairs=None):
     """
     Generates a set of standard metrics for a given street graph
 
@@ -59,6 +137,15 @@ def network_metrics(G, plot_scc=False):
     ----------
     G
     plot_scc
+    engine : str
+        shortest path engine, see lane_graph.calculate_stats()
+    cpus : int
+        number of worker processes for calculating the configurations in parallel,
+        use None for all available cpus
+    sample_pairs : int or pd.DataFrame
+        estimate the shortest path statistics from a sample of node pairs instead of all pairs,
+        either a sample size or a sample from graph.sample_node_pairs(),
+        all configurations use the same sample, see compare_sampled_metrics()
 
     Returns
     -------
@@ -68,53 +155,109 @@ def network_metrics(G, plot_scc=False):
     if len(G.edges) == 0:
         return pd.DataFrame()
 
-    configs = [
-        {
-            'label': 'CARS BEFORE',
-            'lanes': KEY_LANES_DESCRIPTION,
-            'mode': MODE_PRIVATE_CARS
-        },
-        {
-            'label': 'CARS AFTER',
-            'lanes': KEY_LANES_DESCRIPTION_AFTER,
-            'mode': MODE_PRIVATE_CARS
-        },
-        {
-            'label': 'CYCLING BEFORE',
-            'lanes': KEY_LANES_DESCRIPTION,
-            'mode': MODE_CYCLING
-        },
-        {
-            'label': 'CYCLING AFTER',
-            'lanes': KEY_LANES_DESCRIPTION_AFTER,
-            'mode': MODE_CYCLING
-        },
-        {
-            'label': 'TRANSIT BEFORE',
-            'lanes': KEY_LANES_DESCRIPTION,
-            'mode': MODE_TRANSIT
-        },
-        {
-            'label': 'TRANSIT AFTER',
-            'lanes': KEY_LANES_DESCRIPTION_AFTER,
-            'mode': MODE_TRANSIT
-        },
-    ]
+    sample_pairs = _prepare_sample_pairs(G, sample_pairs)
+
+    results = _generate_metrics_for_configs(
+        [
+            (G, config['label'], config['lanes'], config['mode'], plot_scc, engine, sample_pairs)
+            for config in NETWORK_METRICS_CONFIGS
+        ],
+        cpus
+    )
+
+    return _metrics_to_dataframe(results)
 
-    df = pd.DataFrame(
-        map(
-            lambda config: _generate_metrics_for_one_config(
-                G, config['label'], config['lanes'], config['mode'], plot_scc
-            ),
-            configs
-        )
+
+def _prepare_sample_pairs(G, sample_pairs):
+    """
+    Draws a sample of node pairs if only the sample size is given
+    """
+
+    if sample_pairs is None or isinstance(sample_pairs, pd.DataFrame):
+        return sample_pairs
+    if isinstance(sample_pairs, numbers.Integral) and not isinstance(sample_pairs, bool):
+        return graph.sample_node_pairs(G, int(sample_pairs))
+    raise _errors.OptionNotImplemented(
+        'sample_pairs must be None, a number of pairs or a pd.DataFrame of pairs, not ' + str(type(sample_pairs))
     )
 
+
+def compare_sampled_metrics(stats_before, stats_after, metric='cost'):
+    """
+    Estimates the change of the average shortest path between two sampled metrics,
+    e.g., the 'CYCLING BEFORE' and 'CYCLING AFTER' columns of network_metrics(..., sample_pairs=...).
+    Only the node pairs available in both are used, which gives much tighter intervals than comparing
+    the two averages with their separate standard errors.
+
+    Parameters
+    ----------
+    stats_before : dict or pd.Series
+        metrics calculated with lane_graph.calculate_stats(..., sample_pairs=...)
+    stats_after : dict or pd.Series
+        metrics calculated with the same sample
+    metric : str
+        'cost' (like avg_shortest_path_vod_km) or 'length' (like avg_shortest_path_km)
+
+    Returns
+    -------
+    dict
+        * **difference_km**: average change per node pair (after - before)
+        * **difference_km_se**: standard error of the change
+        * **n_pairs**: number of pairs used
+    """
+
+    paired = stats_before['_sample'].merge(
+        stats_after['_sample'][['source', 'target', metric]],
+        on=['source', 'target'],
+        suffixes=('_before', '_after')
+    )
+    difference, difference_se = utils.stratified_mean(
+        paired[metric + '_after'] - paired[metric + '_before'],
+        paired['stratum'],
+        paired['stratum_weight']
+    )
+
+    return {
+        'difference_km': round(difference / 1000, 3),
+        'difference_km_se': round(difference_se / 1000, 3),
+        'n_pairs': len(paired),
+    }
+
+
+def _metrics_to_dataframe(results):
+    """
+    Converts a list of metrics (one dict per config) into a dataframe with one column per config
+    """
+
+    if len(results) == 0:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(results)
     df = df.set_index(['label']).transpose()
     return df
 
 
-def _generate_metrics_for_one_config(G, label, lanes_key, mode, plot_scc):
+def _generate_metrics_for_configs(args, cpus=1):
+    """
+    Runs _generate_metrics_for_one_config() for each set of arguments, in parallel if cpus > 1
+    """
+
+    if cpus is None:
+        cpus = mp.cpu_count()
+    cpus = min(cpus, mp.cpu_count(), max(len(args), 1))
+
+    if cpus == 1:
+        return [_generate_metrics_for_one_config(*arg) for arg in args]
+    else:
+        pool = mp.Pool(cpus)
+        sma = pool.starmap_async(_generate_metrics_for_one_config, args)
+        results = sma.get()
+        pool.close()
+        pool.join()
+        return results
+
+
+def _generate_metrics_for_one_config(G, label, lanes_key, mode, plot_scc, engine='networkx', sample_pairs=None):
     """
     Generates a set of standard metrics for a given configuration
 
@@ -125,6 +268,8 @@ def _generate_metrics_for_one_config(G, label, lanes_key, mode, plot_scc):
     lanes_key
     mode
     plot_scc
+    engine
+    sample_pairs
 
     Returns
     -------
@@ -135,7 +280,7 @@ def _generate_metrics_for_one_config(G, label, lanes_key, mode, plot_scc):
         lanes_attribute=lanes_key
     )
     L_lcc = graph.keep_only_the_largest_connected_component(L)
-    stats = lane_graph.calculate_stats(L_lcc, mode)
+    stats = lane_graph.calculate_stats(L_lcc, mode, engine=engine, sample_pairs=sample_pairs)
     stats['N_nodes_full'] = len(L.nodes)
     stats['N_edges_full'] = len(L.edges)
     stats['N_nodes_deleted'] = len(L.nodes) - len(L_lcc.nodes)
@@ -144,21 +144,29 @@ def add_connected_component_ids(G):
             nx.set_edge_attributes(subgraph, wcc, '_connected_component')
 
 
-def update_precalculated_attributes(G):
+def update_precalculated_attributes(G, recount=False):
     """
-    Update edge attributes in a street graph that have been pre-calculated by osmnx
+    Update node attributes in a street graph that have been pre-calculated by osmnx
     when the graph was created
 
+    The street counts are kept up to date by the functions that add or remove edges, using
+    oxc.stats.add_edge() and oxc.stats.remove_edge(), so only the nodes without a street count
+    are counted, unless recount=True
+
     Parameters
     ----------
     G : nx.MultiGraph or nx.MultiDiGraph
         street graph
+    recount : bool
+        count the streets of all nodes, e.g. to validate the street counts or after edges
+        have been added or removed without keeping them up to date
 
     Returns
     -------
     None
     """
-    street_count = oxc.stats.count_streets_per_node(G)
+    nodes = None if recount else [n for n, sc in G.nodes(data="street_count") if sc is None]
+    street_count = oxc.stats.count_streets_per_node(G, nodes=nodes)
     nx.set_node_attributes(G, street_count, name="street_count")
 
 
@@ -343,7 +351,7 @@ def split_edge(G, u, v, key, split_points):
                 list(edge_linestrings[i-1].coords) +
                 [node[1]]
             )
-            new_key = G.add_edge(new_u, new_v, **new_edge_data)
+            new_key = oxc.stats.add_edge(G, new_u, new_v, **new_edge_data)
             new_edges.append((new_u, new_v, new_key, new_edge_data))
 
             # in undirected graphs, the edge topology might have reversed implicitly
@@ -352,7 +360,7 @@ def split_edge(G, u, v, key, split_points):
                 reverse_edge(G, new_u, new_v, new_key, reverse_topology=False)
 
     # remove the original edge
-    G.remove_edge(u, v, key)
+    oxc.stats.remove_edge(G, u, v, key)
 
     return new_edges
 
@@ -388,7 +396,7 @@ def reverse_edge(
 
     # remove the old edge
     if reverse_topology:
-        G.remove_edge(u, v, key)
+        oxc.stats.remove_edge(G, u, v, key)
 
     # reverse lanes
     for lane_description_key in lane_description_keys:
@@ -414,7 +422,7 @@ def reverse_edge(
 
     # add the new edge
     if reverse_topology:
-        key = G.add_edge(v, u, **data)
+        key = oxc.stats.add_edge(G, v, u, **data)
     else:
         nx.set_edge_attributes(G, {(u, v, key): data})
 
@@ -427,7 +435,8 @@ def reverse_edge(
 
 def delete_edges_without_lanes(G, lane_description_key=KEY_LANES_DESCRIPTION):
     edges_without_lanes = dict(filter(lambda x: x[1] == [], nx.get_edge_attributes(G, lane_description_key).items()))
-    G.remove_edges_from(edges_without_lanes)
+    for uvk in edges_without_lanes:
+        oxc.stats.remove_edge(G, *uvk)
 
 
 def filter_lanes_by_modes(G, modes, lane_description_key=KEY_LANES_DESCRIPTION, delete_empty_edges=True, **kwargs):
@@ -165,3 +165,42 @@ def get_nth_element_of_list(my_list, n):
         return my_list[n]
     else:
         return None
+
+
+def stratified_mean(values, strata, stratum_weights):
+    """
+    Stratified estimate of a population mean and its standard error
+
+    Parameters
+    ----------
+    values : array-like
+        sampled values
+    strata : array-like
+        stratum of each sampled value
+    stratum_weights : array-like
+        population share of the stratum of each sampled value,
+        strata without any sampled values are left out and the remaining weights are rescaled
+
+    Returns
+    -------
+    tuple
+        mean, standard error
+    """
+
+    df = pd.DataFrame({'value': values, 'stratum': strata, 'weight': stratum_weights})
+    if len(df) == 0:
+        return np.nan, np.nan
+
+    by_stratum = df.groupby('stratum').agg(
+        mean=('value', 'mean'),
+        var=('value', 'var'),
+        n=('value', 'size'),
+        weight=('weight', 'first'),
+    )
+    # strata with a single value don't allow estimating the variance
+    by_stratum['var'] = by_stratum['var'].fillna(0)
+    weights = by_stratum['weight'] / by_stratum['weight'].sum()
+
+    mean = (weights * by_stratum['mean']).sum()
+    standard_error = np.sqrt((weights ** 2 * by_stratum['var'] / by_stratum['n']).sum())
+    return mean, standard_error